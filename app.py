@@ -1,13 +1,25 @@
 import os
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
-from PIL import Image, ImageTk
-import requests
-import json
-from pathlib import Path
 import threading
 import queue
-import time
+from scanner import ImageScanner
+from image_processor import ImageProcessor
+from batch_processor import BatchProcessor, DEFAULT_MAX_IN_FLIGHT
+from concurrency import DEFAULT_MAX_LIMIT
+from result_cache import ResultCache
+from job_journal import JobJournal
+from bib_index import BibIndex
+from results_store import ResultsStore, ResultsView, export_formats
+
+# Mensajes de la cola que se aplican a la interfaz en cada ciclo de check_queue, como máximo
+MAX_MESSAGES_PER_TICK = 2000
+# Errores que se muestran en el resumen final (el resto solo se cuenta)
+MAX_ERRORS_SHOWN = 10
+# Filas del Treeview que se reutilizan para mostrar la porción visible de los resultados
+TREE_WINDOW_ROWS = 60
+# Columna de ResultsStore que muestra cada columna del Treeview
+TREE_COLUMNS = {"archivo": "archivo", "numero_reconocido": "numeros", "estado": "estado"}
 
 class OCRApp:
     def __init__(self, root):
@@ -17,14 +29,28 @@ class OCRApp:
         
         # Variables
         self.folder_path = tk.StringVar()
+        self.model_name = tk.StringVar(value="llama3.2-vision")
+        # Límite de solicitudes simultáneas elegido por el lote, sin ajuste manual
+        self.adaptive_concurrency = tk.BooleanVar(value=True)
         self.processing = False
         self.stop_processing = False
         self.result_queue = queue.Queue()
+        # Primeros errores del procesamiento, para el aviso final, y cantidad total
+        self.errors = []
+        self.error_count = 0
+        # Tabla de resultados del último procesamiento, de la que se exporta, y su orden y filtro
+        self.results = ResultsStore()
+        self.view = ResultsView(self.results)
+        # Primera fila de la vista que muestra el Treeview, y filas que entran en pantalla
+        self.offset = 0
+        self.visible_rows = 20
+        self.number_filter = tk.StringVar()
+        self.media_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'media')
         
         # Configuración de la interfaz
         self.setup_ui()
         self.check_queue()
-        
+    
     def setup_ui(self):
         # Frame principal
         main_frame = ttk.Frame(self.root, padding="10")
@@ -38,27 +64,61 @@ class OCRApp:
         ttk.Entry(folder_frame, textvariable=self.folder_path, width=50).pack(side=tk.LEFT, padx=5, fill=tk.X, expand=True)
         ttk.Button(folder_frame, text="Examinar...", command=self.browse_folder).pack(side=tk.LEFT, padx=5)
         
+        # Frame de opciones del procesamiento
+        options_frame = ttk.Frame(main_frame)
+        options_frame.pack(fill=tk.X, pady=5)
+        
+        ttk.Label(options_frame, text="Modelo de Ollama:").pack(side=tk.LEFT, padx=5)
+        ttk.Combobox(options_frame, textvariable=self.model_name, width=20,
+                     values=["llama3.2-vision", "llava:7b", "llava:13b", "llava:34b"]).pack(side=tk.LEFT, padx=5)
+        ttk.Label(options_frame, text="Solicitudes simultáneas:").pack(side=tk.LEFT, padx=5)
+        self.concurrency = ttk.Spinbox(options_frame, from_=1, to=32, width=5)
+        self.concurrency.set(DEFAULT_MAX_IN_FLIGHT)
+        self.concurrency.pack(side=tk.LEFT, padx=5)
+        ttk.Checkbutton(options_frame, text="Automático", variable=self.adaptive_concurrency,
+                        command=self.toggle_concurrency).pack(side=tk.LEFT, padx=5)
+        self.toggle_concurrency()
+        
         # Frame de resultados
         result_frame = ttk.LabelFrame(main_frame, text="Resultados", padding="10")
         result_frame.pack(fill=tk.BOTH, expand=True, pady=5)
         
+        # Búsqueda por dorsal
+        filter_frame = ttk.Frame(result_frame)
+        filter_frame.pack(side=tk.TOP, fill=tk.X, pady=(0, 5))
+        ttk.Label(filter_frame, text="Buscar dorsal:").pack(side=tk.LEFT, padx=5)
+        ttk.Entry(filter_frame, textvariable=self.number_filter, width=10).pack(side=tk.LEFT, padx=5)
+        self.number_filter.trace_add("write", lambda *args: self.filter_results())
+        
         # Treeview para mostrar resultados
-        columns = ("archivo", "numero_reconocido", "confianza")
+        columns = ("archivo", "numero_reconocido", "estado")
         self.tree = ttk.Treeview(result_frame, columns=columns, show="headings")
         
-        # Configurar columnas
-        self.tree.heading("archivo", text="Archivo")
-        self.tree.heading("numero_reconocido", text="Número")
-        self.tree.heading("confianza", text="Confianza")
+        # Configurar columnas; al hacer clic en el encabezado se ordena por esa columna
+        self.headings = {"archivo": "Archivo", "numero_reconocido": "Número", "estado": "Estado"}
+        for column, text in self.headings.items():
+            self.tree.heading(column, text=text, command=lambda c=column: self.sort_results(c))
         
         # Ajustar ancho de columnas
         self.tree.column("archivo", width=400)
         self.tree.column("numero_reconocido", width=200, anchor=tk.CENTER)
-        self.tree.column("confianza", width=100, anchor=tk.CENTER)
+        self.tree.column("estado", width=150, anchor=tk.CENTER)
+        
+        # Filas con error resaltadas
+        self.tree.tag_configure("error", foreground="#b00020")
         
-        # Scrollbar
-        scrollbar = ttk.Scrollbar(result_frame, orient=tk.VERTICAL, command=self.tree.yview)
-        self.tree.configure(yscrollcommand=scrollbar.set)
+        # El Treeview tiene siempre las mismas TREE_WINDOW_ROWS filas, que muestran la porción
+        # de la vista en la que está la barra de desplazamiento; la barra recorre la vista completa
+        self.tree_items = [self.tree.insert("", tk.END, values=("", "", "")) for _ in range(TREE_WINDOW_ROWS)]
+        self.tree_shown = [None] * TREE_WINDOW_ROWS
+        # Reemplazos de la tabla la última vez que se dibujaron las filas
+        self.tree_replacements = None
+        self.tree.detach(*self.tree_items)
+        self.scrollbar = scrollbar = ttk.Scrollbar(result_frame, orient=tk.VERTICAL, command=self.scroll_results)
+        self.tree.bind("<Configure>", self.resize_results)
+        self.tree.bind("<MouseWheel>", lambda e: self.scroll_results("scroll", -3 if e.delta > 0 else 3, "units"))
+        self.tree.bind("<Button-4>", lambda e: self.scroll_results("scroll", -3, "units"))
+        self.tree.bind("<Button-5>", lambda e: self.scroll_results("scroll", 3, "units"))
         
         # Empaquetar treeview y scrollbar
         self.tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
@@ -71,7 +131,7 @@ class OCRApp:
         self.process_btn = ttk.Button(control_frame, text="Procesar Imágenes", command=self.toggle_processing)
         self.process_btn.pack(side=tk.LEFT, padx=5)
         
-        self.export_btn = ttk.Button(control_frame, text="Exportar a CSV", command=self.export_to_csv, state=tk.DISABLED)
+        self.export_btn = ttk.Button(control_frame, text="Exportar Resultados", command=self.export_results, state=tk.DISABLED)
         self.export_btn.pack(side=tk.LEFT, padx=5)
         
         # Barra de progreso
@@ -94,29 +154,37 @@ class OCRApp:
             return
             
         # Limpiar resultados anteriores
-        for item in self.tree.get_children():
-            self.tree.delete(item)
-            
-        # Escanear imágenes
-        image_extensions = ('.png', '.jpg', '.jpeg', '.bmp', '.tiff')
-        self.image_files = [f for f in os.listdir(folder) 
-                          if os.path.isfile(os.path.join(folder, f)) 
-                          and f.lower().endswith(image_extensions)]
+        self.show_results(ResultsStore())
         
-        self.total_images = len(self.image_files)
+        # Contar las imágenes (también en subcarpetas) sin bloquear la interfaz; el
+        # procesamiento puede empezar antes de que termine el conteo
+        self.scanner = ImageScanner(folder).count_in_background()
+        self.total_images = 0
         self.processed_images = 0
-        self.progress['maximum'] = self.total_images
         self.progress['value'] = 0
         
         # Habilitar/deshabilitar botones
         self.export_btn['state'] = tk.DISABLED
-        
-        if self.total_images > 0:
-            self.process_btn['state'] = tk.NORMAL
-            self.status_var.set(f"{self.total_images} imágenes encontradas")
-        else:
-            self.process_btn['state'] = tk.DISABLED
-            self.status_var.set("No se encontraron imágenes")
+        self.process_btn['state'] = tk.NORMAL
+        self.status_var.set("Buscando imágenes...")
+        self.update_count(self.scanner)
+    
+    def update_count(self, scanner):
+        """Muestra el avance del conteo de imágenes hasta que termina"""
+        if scanner is not getattr(self, 'scanner', None):
+            return
+        self.total_images = scanner.estimated_total(self.processed_images)
+        self.progress['maximum'] = max(1, self.total_images)
+        if scanner.total is None:
+            if not self.processing:
+                self.status_var.set(f"Buscando imágenes... {scanner.counted}")
+            self.root.after(200, self.update_count, scanner)
+        elif not self.processing:
+            if self.total_images > 0:
+                self.status_var.set(f"{self.total_images} imágenes encontradas")
+            else:
+                self.process_btn['state'] = tk.DISABLED
+                self.status_var.set("No se encontraron imágenes")
     
     def toggle_processing(self):
         if not self.processing:
@@ -125,90 +193,255 @@ class OCRApp:
             self.stop_processing = True
             self.process_btn['state'] = tk.DISABLED
     
+    def toggle_concurrency(self):
+        """Con el límite automático, las solicitudes simultáneas no se eligen a mano"""
+        self.concurrency['state'] = tk.DISABLED if self.adaptive_concurrency.get() else tk.NORMAL
+    
     def start_processing(self):
-        if not hasattr(self, 'image_files') or not self.image_files:
+        if not hasattr(self, 'scanner'):
             return
+        adaptive = self.adaptive_concurrency.get()
+        try:
+            # Con el límite automático, solo el máximo
+            max_in_flight = DEFAULT_MAX_LIMIT if adaptive else max(1, int(self.concurrency.get()))
+        except ValueError:
+            max_in_flight = DEFAULT_MAX_IN_FLIGHT
             
         self.processing = True
         self.stop_processing = False
         self.process_btn['text'] = "Detener"
+        self.export_btn['state'] = tk.DISABLED
         self.processed_images = 0
+        self.errors = []
+        self.error_count = 0
         self.progress['value'] = 0
+        self.show_results(ResultsStore())
         
         # Iniciar hilo para el procesamiento
-        threading.Thread(target=self.process_images, daemon=True).start()
+        threading.Thread(target=self.process_images,
+                         args=(self.scanner, self.model_name.get(), max_in_flight, self.results, adaptive),
+                         daemon=True).start()
     
-    def process_images(self):
-        folder = self.folder_path.get()
-        
-        for idx, image_file in enumerate(self.image_files):
-            if self.stop_processing:
-                break
-                
-            try:
-                image_path = os.path.join(folder, image_file)
-                
-                # Aquí iría la lógica para enviar la imagen a Ollama
-                # Por ahora simulamos una respuesta
-                time.sleep(1)  # Simulamos procesamiento
-                
-                # Simulamos un resultado
-                result = {
-                    "file": image_file,
-                    "number": "1234",  # Número reconocido
-                    "confidence": 0.95  # Nivel de confianza
-                }
-                
-                # Actualizamos la interfaz a través de la cola
-                self.result_queue.put(("update", result))
-                
-            except Exception as e:
-                self.result_queue.put(("error", f"Error procesando {image_file}: {str(e)}"))
-            
-            # Actualizar progreso
-            self.processed_images += 1
-            self.result_queue.put(("progress", self.processed_images))
+    def process_images(self, scanner, model_name, max_in_flight, results, adaptive_concurrency=False):
+        """Procesa la carpeta con el mismo pipeline que la aplicación Qt; los avisos van a la cola"""
+        os.makedirs(self.media_dir, exist_ok=True)
+        # Caché de resultados, registro de avance e índice de dorsales compartidos con la aplicación Qt
+        cache = ResultCache(os.path.join(self.media_dir, '.cache_reconocimiento.sqlite3'))
+        processor = ImageProcessor(pool_size=max_in_flight, cache=cache)
+        journal = JobJournal(JobJournal.path_for(self.media_dir, scanner.folder, model_name))
+        index = BibIndex(BibIndex.path_for(self.media_dir))
+        batch = BatchProcessor(
+            processor,
+            model_name,
+            output_dir=self.media_dir,
+            max_in_flight=max_in_flight,
+            journal=journal,
+            index=index,
+            event=os.path.basename(os.path.normpath(scanner.folder)),
+            adaptive_concurrency=adaptive_concurrency
+        )
+        resumen = None
+        try:
+            batch.run(
+                scanner,
+                on_result=lambda clave, resultado: self.result_queue.put(("update", (clave, resultado))),
+                should_stop=lambda: self.stop_processing,
+                results=results
+            )
+            if batch.cancelled:
+                resumen = "Proceso cancelado"
+            else:
+                exitosas = results.success_count
+                resumen = f"Procesamiento completado: {exitosas} de {len(results)} imágenes correctas"
+                if batch.concurrency is not None:
+                    resumen += f" (límite de solicitudes simultáneas al terminar: {batch.concurrency.limit})"
+                # El trabajo terminó completo: la próxima ejecución empieza de cero
+                journal.discard()
+        except Exception as e:
+            self.result_queue.put(("error", f"Error en el procesamiento: {str(e)}"))
+            resumen = "Procesamiento interrumpido por un error"
+        finally:
+            journal.close()
+            index.close()
+            processor.close()
+            cache.close()
+            # Finalizar procesamiento
+            self.result_queue.put(("done", resumen))
+    
+    def show_results(self, results):
+        """Muestra otra tabla de resultados, con el orden y el filtro actuales"""
+        self.results = results
+        self.view = ResultsView(results, self.view.column, self.view.descending, self.view.number)
+        self.offset = 0
+        self.tree_replacements = None
+        self.refresh_tree()
+    
+    def tree_row(self, fila):
+        """Devuelve los valores y las etiquetas de la fila del Treeview para una fila de la tabla"""
+        if self.results.is_error(fila):
+            return (self.results.row(fila)[0], "", f"Error: {self.results.error(fila)}"), ("error",)
+        numeros = ", ".join(map(str, self.results.numbers(fila)))
+        return (self.results.row(fila)[0], numeros, self.results.status(fila)), ()
+    
+    def refresh_tree(self, follow=False):
+        """
+        Muestra en las filas del Treeview la porción de la vista desde offset.
         
-        # Finalizar procesamiento
-        self.result_queue.put(("done", None))
+        Solo se actualizan las filas cuyo contenido cambió, así que el costo no depende de
+        la cantidad de resultados. La tabla solo agrega filas al final, así que una fila que
+        sigue en el mismo lugar no cambió, salvo que se haya reemplazado algún resultado (al
+        volver a procesar una imagen) o se muestre otra tabla. Con follow, si la vista
+        estaba al final, se sigue mostrando el final con los resultados nuevos.
+        """
+        total = len(self.view)
+        if follow:
+            self.offset = max(0, total - self.visible_rows)
+        self.offset = max(0, min(self.offset, total - self.visible_rows))
+        reemplazos = self.results.replacements
+        redibujar = reemplazos != self.tree_replacements
+        self.tree_replacements = reemplazos
+        for i, item in enumerate(self.tree_items):
+            posicion = self.offset + i
+            fila = self.view.row_at(posicion) if posicion < total else None
+            if fila == self.tree_shown[i] and (fila is None or not redibujar):
+                continue
+            if fila is None:
+                self.tree.detach(item)
+            else:
+                values, tags = self.tree_row(fila)
+                self.tree.item(item, values=values, tags=tags)
+                if self.tree_shown[i] is None:
+                    self.tree.move(item, "", i)
+            self.tree_shown[i] = fila
+        if total:
+            self.scrollbar.set(self.offset / total, min(1.0, (self.offset + self.visible_rows) / total))
+        else:
+            self.scrollbar.set(0.0, 1.0)
+    
+    def scroll_results(self, accion, cantidad, unidad=None):
+        """Desplaza la ventana de filas; recibe los comandos de la barra de desplazamiento"""
+        if accion == "moveto":
+            self.offset = int(float(cantidad) * len(self.view))
+        elif unidad == "pages":
+            self.offset += int(cantidad) * self.visible_rows
+        else:
+            self.offset += int(cantidad)
+        self.refresh_tree()
+        return "break"
+    
+    def resize_results(self, event):
+        """Ajusta la cantidad de filas que entran en el Treeview al cambiar su tamaño"""
+        alto_fila = int(ttk.Style().lookup("Treeview", "rowheight") or 20)
+        self.visible_rows = max(1, min(TREE_WINDOW_ROWS, (event.height - alto_fila) // alto_fila))
+        self.refresh_tree()
+    
+    def at_end(self):
+        return self.offset + self.visible_rows >= len(self.view)
+    
+    def sort_results(self, column):
+        """Ordena por una columna; otro clic invierte el orden y un tercero vuelve al orden de llegada"""
+        columna = TREE_COLUMNS[column]
+        if self.view.column != columna:
+            self.view.sort(columna)
+        elif not self.view.descending:
+            self.view.sort(columna, descending=True)
+        else:
+            self.view.sort(None)
+        for name, text in self.headings.items():
+            flecha = ""
+            if TREE_COLUMNS[name] == self.view.column:
+                flecha = " ▼" if self.view.descending else " ▲"
+            self.tree.heading(name, text=text + flecha)
+        self.offset = 0
+        self.refresh_tree()
+    
+    def filter_results(self):
+        texto = self.number_filter.get().strip()
+        if texto and not texto.isdigit():
+            return
+        self.view.filter(int(texto) if texto else None)
+        self.offset = 0
+        self.refresh_tree()
     
     def check_queue(self):
+        """
+        Aplica a la interfaz los mensajes acumulados desde el ciclo anterior.
+        
+        Los resultados ya están en la tabla, que llena el hilo de procesamiento: la ventana
+        de filas, la barra de progreso y el estado se actualizan una vez por ciclo y los
+        errores se acumulan para un único aviso al final, de modo que la ventana sigue
+        respondiendo aunque lleguen miles de resultados por minuto.
+        """
+        nuevas = 0
+        fin = None
         try:
-            while True:
+            for _ in range(MAX_MESSAGES_PER_TICK):
                 msg_type, data = self.result_queue.get_nowait()
                 
                 if msg_type == "update":
-                    # Añadir resultado al treeview
-                    self.tree.insert("", tk.END, values=(
-                        data["file"],
-                        data["number"],
-                        f"{data['confidence']*100:.1f}%"
-                    ))
-                elif msg_type == "progress":
-                    # Actualizar barra de progreso
-                    self.progress['value'] = data
-                    self.status_var.set(f"Procesando... {data}/{self.total_images}")
+                    clave, resultado = data
+                    nuevas += 1
+                    if not resultado.get('success'):
+                        self.add_error(f"{clave}: {resultado.get('error', 'Error desconocido')}")
                 elif msg_type == "error":
-                    messagebox.showerror("Error", data)
+                    self.add_error(data)
                 elif msg_type == "done":
-                    self.processing = False
-                    self.stop_processing = False
-                    self.process_btn['text'] = "Procesar Imágenes"
-                    self.status_var.set("Procesamiento completado")
-                    self.export_btn['state'] = tk.NORMAL
+                    fin = data
         except queue.Empty:
             pass
-        
+            
+        if nuevas:
+            # Mostrar los resultados nuevos; si la vista estaba al final, seguir al final
+            seguir = self.at_end()
+            self.view.refresh()
+            self.refresh_tree(follow=seguir)
+            self.processed_images += nuevas
+            
+            # Actualizar barra de progreso
+            self.total_images = self.scanner.estimated_total(self.processed_images)
+            self.progress['maximum'] = max(1, self.total_images)
+            self.progress['value'] = self.processed_images
+            estado = f"Procesando... {self.processed_images}/{self.total_images}"
+            if self.error_count:
+                estado += f" ({self.error_count} errores)"
+            self.status_var.set(estado)
+            
+        if fin is not None:
+            self.processing_done(fin)
+            
         # Volver a programar la verificación
         self.root.after(100, self.check_queue)
     
-    def export_to_csv(self):
-        if not hasattr(self, 'image_files') or not self.image_files:
+    def add_error(self, mensaje):
+        """Cuenta un error; solo se guardan los primeros MAX_ERRORS_SHOWN para el aviso final"""
+        self.error_count += 1
+        if len(self.errors) < MAX_ERRORS_SHOWN:
+            self.errors.append(mensaje)
+    
+    def processing_done(self, resumen):
+        self.processing = False
+        self.stop_processing = False
+        self.process_btn['text'] = "Procesar Imágenes"
+        self.process_btn['state'] = tk.NORMAL
+        self.status_var.set(resumen + (f" ({self.error_count} errores)" if self.error_count else ""))
+        if len(self.results):
+            self.export_btn['state'] = tk.NORMAL
+        # Un solo aviso con los primeros errores, en lugar de un diálogo por imagen
+        if self.error_count:
+            detalle = "\n".join(self.errors)
+            if self.error_count > len(self.errors):
+                detalle += f"\n... y {self.error_count - len(self.errors)} más"
+            messagebox.showerror("Error", f"{self.error_count} errores durante el procesamiento:\n\n{detalle}")
+    
+    def export_results(self):
+        if not len(self.results):
             return
             
+        tipos = {".csv": ("Archivos CSV", "*.csv"), ".jsonl": ("JSON Lines", "*.jsonl"),
+                 ".parquet": ("Parquet", "*.parquet"), ".npz": ("NumPy", "*.npz")}
         file_path = filedialog.asksaveasfilename(
             defaultextension=".csv",
-            filetypes=[("Archivos CSV", "*.csv"), ("Todos los archivos", "*.*")],
+            filetypes=[tipos[extension] for extension in export_formats()],
             title="Guardar resultados como..."
         )
         
@@ -216,15 +449,8 @@ class OCRApp:
             return
             
         try:
-            with open(file_path, 'w', encoding='utf-8') as f:
-                # Escribir encabezados
-                f.write("Archivo,Número,Confianza\n")
-                
-                # Escribir datos
-                for item in self.tree.get_children():
-                    values = self.tree.item(item)['values']
-                    f.write(f'"{values[0]}",{values[1]},{values[2]}\n')
-            
+            # Se exporta desde la tabla de resultados, sin leer las filas del Treeview
+            self.results.export(file_path)
             messagebox.showinfo("Éxito", "Los resultados se exportaron correctamente.")
         except Exception as e:
             messagebox.showerror("Error", f"No se pudo exportar el archivo: {str(e)}")
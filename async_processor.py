@@ -0,0 +1,259 @@
+import os
+import json
+import time
+import asyncio
+import inspect
+
+import httpx
+
+from image_processor import ImageProcessor, ProcessingError, BackendError
+
+
+class AsyncImageProcessor:
+    """
+    Versión asyncio de ImageProcessor, para servicios que ya corren en un event loop.
+
+    La solicitud a Ollama usa httpx.AsyncClient, de modo que cada imagen en espera es una
+    corrutina y no un hilo. Las etapas de Pillow, la caché y la escritura de la copia se
+    delegan a un executor, reutilizando los métodos de ImageProcessor. Los resultados
+    tienen el mismo formato que los de process_image.
+    """
+
+    def __init__(self, processor=None, max_concurrency=64, executor=None, connect_timeout=5,
+                 read_timeout=120, max_retries=3, backoff_factor=0.5, **processor_options):
+        """
+        Args:
+            processor (ImageProcessor, opcional): Procesador para las etapas de CPU, la caché,
+                los prompts y los servidores; si no se indica, se crea con processor_options
+                y aclose lo cierra
+            max_concurrency (int): Solicitudes simultáneas a Ollama
+            executor (concurrent.futures.Executor, opcional): Executor para el trabajo de Pillow;
+                por defecto, el del event loop
+            connect_timeout (float): Segundos para establecer la conexión
+            read_timeout (float): Segundos máximos de espera entre datos de la respuesta
+            max_retries (int): Reintentos ante fallos del servidor
+            backoff_factor (float): Base del retroceso exponencial entre reintentos al mismo servidor
+        """
+        # Un procesador recibido es del llamador, que decide cuándo cerrarlo
+        self._owns_processor = processor is None
+        self.processor = processor or ImageProcessor(**processor_options)
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.executor = executor
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self.client = httpx.AsyncClient(
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            limits=httpx.Limits(max_connections=self.max_concurrency,
+                                max_keepalive_connections=self.max_concurrency),
+            # Con varios servidores no conviene insistir con uno caído: _generate prueba otro
+            transport=httpx.AsyncHTTPTransport(retries=max_retries if len(self.processor.backends) == 1 else 0),
+        )
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.aclose()
+
+    async def aclose(self):
+        """Cierra las conexiones abiertas con Ollama, y el procesador si se creó aquí"""
+        await self.client.aclose()
+        if self._owns_processor:
+            # close espera al hilo de chequeos de salud: no debe bloquear el event loop
+            await self._run(self.processor.close)
+
+    async def _run(self, funcion, *args, **kwargs):
+        """Ejecuta una etapa bloqueante en el executor"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, lambda: funcion(*args, **kwargs))
+
+    async def _generate(self, prompt, images_base64, model_name, metricas=None, stop_at_newline=None):
+        """
+        Envía el prompt y las imágenes a /api/generate y devuelve el texto de la respuesta.
+
+        Como en ImageProcessor, si un servidor falla se reintenta en otro; con un solo
+        servidor, se reintenta en el mismo con retroceso exponencial.
+        """
+        backends = self.processor.backends
+        intentados = set()
+        intento = 0
+        async with self._semaphore:
+            while True:
+                backend = backends.acquire(exclude=intentados)
+                try:
+                    texto, primer_token = await self._generate_on(
+                        backend.url, prompt, images_base64, model_name, metricas, stop_at_newline
+                    )
+                except BackendError as e:
+                    backends.release(backend, ok=False)
+                    intentados.add(backend.url)
+                    intento += 1
+                    if len(backends) > 1:
+                        if len(intentados) >= len(backends):
+                            raise
+                        print(f"{e}; se reintenta en otro servidor")
+                    else:
+                        if intento > self.max_retries:
+                            raise
+                        await asyncio.sleep(self.backoff_factor * 2 ** (intento - 1))
+                    continue
+                except BaseException:
+                    # Errores del modelo, cancelaciones de la tarea, etc.
+                    backends.release(backend, ok=None)
+                    raise
+                backends.release(backend, latency=primer_token)
+                if metricas is not None and len(backends) > 1:
+                    metricas["servidor"] = backend.url
+                return texto
+
+    async def _generate_on(self, url, prompt, images_base64, model_name, metricas=None, stop_at_newline=None):
+        """Realiza la solicitud en un servidor concreto; devuelve (texto, segundos hasta el primer token)"""
+        cuerpo, respuesta = self.processor.generation_request(prompt, images_base64, model_name, stop_at_newline)
+        inicio = time.perf_counter()
+        primer_token = None
+        eval_count = None
+        try:
+            async with self.client.stream("POST", f"{url}/api/generate", json=cuerpo) as response:
+                if response.status_code != 200:
+                    texto_error = (await response.aread()).decode('utf-8', 'replace')
+                    error = BackendError if response.status_code >= 500 else ProcessingError
+                    raise error(f"Error en la API de Ollama: {response.status_code} - {texto_error}")
+                # Al salir del bloque antes de terminar, httpx cierra la conexión y Ollama deja de generar
+                async for line in response.aiter_lines():
+                    if not line:
+                        continue
+                    try:
+                        data = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    if data.get("response"):
+                        if primer_token is None:
+                            primer_token = time.perf_counter()
+                        if respuesta.feed(data["response"]):
+                            break
+                    if data.get("done"):
+                        eval_count = data.get("eval_count")
+                        break
+        except ProcessingError:
+            raise
+        except httpx.TimeoutException as e:
+            raise BackendError(f"Tiempo de espera agotado con Ollama ({url}): {str(e)}")
+        except httpx.TransportError as e:
+            raise BackendError(f"No se pudo conectar con Ollama ({url}): {str(e)}")
+        return self.processor.finish_generation(respuesta, inicio, primer_token, eval_count, metricas)
+
+    async def recognize(self, image_base64, model_name="llama3.2-vision", metricas=None):
+        """
+        Envía una imagen codificada a Ollama y extrae los números de la respuesta.
+
+        Returns:
+            tuple: (texto_completo, numeros_encontrados)
+        """
+        texto_completo = await self._generate(self.processor.prompt, [image_base64], model_name, metricas)
+        inicio = time.perf_counter()
+        numeros_encontrados = self.processor.extract_numbers(texto_completo)
+        if metricas is not None:
+            metricas["analisis"] = time.perf_counter() - inicio
+        return texto_completo, numeros_encontrados
+
+    async def process_image(self, image_path, model_name="llama3.2-vision", output_dir=None, relative_path=None):
+        """
+        Procesa una imagen como ImageProcessor.process_image, sin bloquear el event loop.
+
+        Args:
+            relative_path (str, opcional): Ruta relativa de la imagen en el lote, para
+                repetir sus subcarpetas en output_dir
+
+        Returns:
+            dict: Diccionario con los resultados del procesamiento
+        """
+        processor = self.processor
+        inicio = time.perf_counter()
+        metricas = {}
+        try:
+            clave_cache, cacheado = None, None
+            if os.path.exists(image_path):
+                clave_cache, cacheado = await self._run(processor.lookup_cache, image_path, model_name)
+
+            decoded = None
+            if cacheado is not None:
+                texto_completo, numeros_encontrados = cacheado
+            else:
+                image_base64, decoded = await self._run(
+                    processor.prepare_image, image_path, for_output=bool(output_dir), metricas=metricas
+                )
+                texto_completo, numeros_encontrados = await self.recognize(image_base64, model_name, metricas)
+                # Liberar la imagen codificada antes de esperar la escritura
+                del image_base64
+                await self._run(processor.store_cache, clave_cache, model_name, texto_completo, numeros_encontrados)
+
+            output_path = await self._run(
+                processor.save_output, image_path, numeros_encontrados, output_dir,
+                overwrite=cacheado is None, decoded=decoded, metricas=metricas, relative_path=relative_path
+            )
+
+            metricas["total"] = time.perf_counter() - inicio
+            return processor.build_result(texto_completo, numeros_encontrados, output_path, cacheado is not None, metricas)
+
+        except ProcessingError as e:
+            return {"error": str(e)}
+        except Exception as e:
+            return {"error": f"Error inesperado: {str(e)}"}
+
+    async def run(self, items, model_name="llama3.2-vision", output_dir=None, on_result=None, max_pending=None):
+        """
+        Procesa un lote y devuelve los resultados por clave.
+
+        Args:
+            items: Iterable (o iterable asíncrono) de tuplas (clave, ruta_imagen)
+            on_result (callable, opcional): on_result(clave, resultado); puede ser una corrutina
+            max_pending (int, opcional): Imágenes en proceso a la vez, contando las que se
+                decodifican o guardan; por defecto, el doble de max_concurrency
+
+        Returns:
+            dict: Resultados de process_image por clave
+        """
+        cupo = asyncio.Semaphore(max_pending or self.max_concurrency * 2)
+        results = {}
+        tareas = set()
+
+        async def procesar(clave, ruta):
+            try:
+                resultado = await self.process_image(ruta, model_name, output_dir, relative_path=clave)
+                results[clave] = resultado
+                if on_result is not None:
+                    aviso = on_result(clave, resultado)
+                    if inspect.isawaitable(aviso):
+                        await aviso
+            finally:
+                cupo.release()
+
+        async def recorrer():
+            if hasattr(items, "__aiter__"):
+                async for item in items:
+                    yield item
+                return
+            # Un iterable síncrono puede bloquear (ImageScanner lee carpetas, FolderWatcher
+            # espera archivos nuevos): cada elemento se pide en un hilo
+            iterador = iter(items)
+            fin = object()
+            while True:
+                item = await self._run(next, iterador, fin)
+                if item is fin:
+                    return
+                yield item
+
+        try:
+            async for clave, ruta in recorrer():
+                await cupo.acquire()
+                tarea = asyncio.create_task(procesar(clave, ruta))
+                tareas.add(tarea)
+                tarea.add_done_callback(tareas.discard)
+            if tareas:
+                await asyncio.gather(*tareas)
+        except BaseException:
+            for tarea in tareas:
+                tarea.cancel()
+            raise
+        return results
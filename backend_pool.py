@@ -0,0 +1,170 @@
+import time
+import threading
+
+import requests
+
+
+class Backend:
+    """Estado de un servidor de Ollama dentro del grupo"""
+
+    def __init__(self, url):
+        self.url = url.rstrip("/")
+        self.in_flight = 0
+        # Promedio móvil exponencial del tiempo hasta el primer token, en segundos
+        self.latency = None
+        self.failures = 0
+        self.ejected_until = 0.0
+        self.requests = 0
+        self.errors = 0
+
+    def available(self, ahora=None):
+        return (ahora or time.monotonic()) >= self.ejected_until
+
+    def snapshot(self):
+        return {
+            "url": self.url,
+            "en_curso": self.in_flight,
+            "latencia": round(self.latency, 4) if self.latency is not None else None,
+            "solicitudes": self.requests,
+            "errores": self.errors,
+            "disponible": self.available(),
+        }
+
+
+class BackendPool:
+    """
+    Reparte las solicitudes entre varios servidores de Ollama.
+
+    Cada solicitud va al servidor con menor (solicitudes en curso + 1) * latencia
+    observada, de modo que los nodos más rápidos o menos cargados reciben más trabajo.
+    Un servidor que falla varias veces seguidas se retira durante un tiempo; un hilo
+    de fondo consulta /api/tags para retirar los que no responden y devolver los que
+    se recuperan.
+    """
+
+    def __init__(self, urls, eject_after=2, cooldown=30.0, health_interval=10.0, health_timeout=2.0,
+                 smoothing=0.3):
+        """
+        Args:
+            urls (str | list): URL o lista de URLs de los servidores de Ollama
+            eject_after (int): Fallos seguidos para retirar un servidor
+            cooldown (float): Segundos que un servidor queda retirado
+            health_interval (float): Segundos entre chequeos de salud; 0 los desactiva
+            health_timeout (float): Tiempo máximo de cada chequeo
+            smoothing (float): Peso de la última medición en el promedio de latencia
+        """
+        if isinstance(urls, str):
+            urls = [urls]
+        if not urls:
+            raise ValueError("Se necesita al menos un servidor de Ollama")
+        self.backends = [Backend(url) for url in urls]
+        self.eject_after = eject_after
+        self.cooldown = cooldown
+        self.health_interval = health_interval
+        self.health_timeout = health_timeout
+        self.smoothing = smoothing
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __len__(self):
+        return len(self.backends)
+
+    def _score(self, backend, latencia_desconocida):
+        latencia = backend.latency if backend.latency is not None else latencia_desconocida
+        return (backend.in_flight + 1) * latencia
+
+    def acquire(self, exclude=()):
+        """
+        Elige el servidor para la próxima solicitud y la cuenta como en curso.
+
+        Args:
+            exclude: URLs que ya fallaron para esta solicitud
+
+        Returns:
+            Backend: El servidor elegido; si todos están retirados, el que vuelve antes
+        """
+        with self._lock:
+            ahora = time.monotonic()
+            candidatos = [b for b in self.backends if b.url not in exclude] or self.backends
+            disponibles = [b for b in candidatos if b.available(ahora)]
+            if disponibles:
+                # Los servidores sin mediciones se prueban primero
+                medidas = [b.latency for b in disponibles if b.latency is not None]
+                desconocida = min(medidas) if medidas else 1.0
+                elegido = min(disponibles, key=lambda b: self._score(b, desconocida))
+            else:
+                elegido = min(candidatos, key=lambda b: b.ejected_until)
+            elegido.in_flight += 1
+            elegido.requests += 1
+            return elegido
+
+    def release(self, backend, latency=None, ok=True):
+        """
+        Registra el final de una solicitud.
+
+        Args:
+            backend (Backend): Servidor devuelto por acquire
+            latency (float, opcional): Tiempo hasta el primer token, si la solicitud funcionó
+            ok (bool | None): False si el servidor falló; None si la solicitud se canceló
+        """
+        with self._lock:
+            backend.in_flight -= 1
+            if ok is None:
+                return
+            if ok:
+                backend.failures = 0
+                if latency is not None:
+                    if backend.latency is None:
+                        backend.latency = latency
+                    else:
+                        backend.latency += self.smoothing * (latency - backend.latency)
+                return
+            backend.errors += 1
+            backend.failures += 1
+            if backend.failures >= self.eject_after and len(self.backends) > 1:
+                self._eject(backend, f"tras {backend.failures} fallos")
+
+    def _eject(self, backend, motivo):
+        if backend.available():
+            print(f"Servidor {backend.url} retirado por {self.cooldown:.0f} s {motivo}")
+        backend.ejected_until = time.monotonic() + self.cooldown
+
+    def check_health(self):
+        """Consulta /api/tags en cada servidor y actualiza su disponibilidad"""
+        for backend in self.backends:
+            try:
+                respuesta = requests.get(f"{backend.url}/api/tags", timeout=self.health_timeout)
+                sano = respuesta.status_code == 200
+            except requests.RequestException:
+                sano = False
+            with self._lock:
+                if sano:
+                    if not backend.available():
+                        print(f"Servidor {backend.url} disponible nuevamente")
+                    backend.ejected_until = 0.0
+                    backend.failures = 0
+                elif len(self.backends) > 1:
+                    self._eject(backend, "porque no responde a /api/tags")
+
+    def _health_loop(self):
+        while not self._stop.wait(self.health_interval):
+            self.check_health()
+
+    def start(self):
+        """Inicia los chequeos de salud en segundo plano (solo con más de un servidor)"""
+        if self._thread is None and self.health_interval and len(self.backends) > 1:
+            self._thread = threading.Thread(target=self._health_loop, name="salud-ollama", daemon=True)
+            self._thread.start()
+        return self
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.health_timeout + 1)
+            self._thread = None
+
+    def snapshot(self):
+        """Estado de cada servidor, para métricas o diagnóstico"""
+        with self._lock:
+            return [b.snapshot() for b in self.backends]
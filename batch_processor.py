@@ -0,0 +1,521 @@
+import os
+import time
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from image_processor import ProcessingError, ProcessingCancelled, BackendError, BatchSplitError
+from metrics import MetricsRegistry
+from dedup import find_duplicates
+from concurrency import AdaptiveConcurrency, Limiter
+
+# Solicitudes simultáneas a Ollama por defecto
+DEFAULT_MAX_IN_FLIGHT = 4
+
+
+class BatchProcessor:
+    """
+    Procesa un lote de imágenes como un pipeline concurrente.
+
+    Cada imagen pasa por tres etapas con su propio grupo de hilos:
+    codificación (Pillow + base64), solicitud a Ollama y guardado con marca de agua.
+    Así la GPU recibe solicitudes continuamente mientras se preparan y guardan
+    las imágenes. La cantidad de imágenes dentro del pipeline está acotada para
+    no codificar por adelantado toda la carpeta.
+
+    Con batch_size mayor que 1, las imágenes codificadas se agrupan y cada grupo se
+    envía en una sola solicitud. Un grupo incompleto sale en cuanto no quedan imágenes
+    codificándose y hay una solicitud libre, para no demorar el final del lote.
+
+    Con dedup_distance, antes de empezar se agrupan las fotos casi idénticas (ráfagas)
+    y solo la primera de cada grupo va al modelo; sus números se copian al resto.
+
+    Con adaptive_concurrency, el límite de solicitudes simultáneas lo elige
+    AdaptiveConcurrency según el primer token y el rendimiento de las solicitudes, entre
+    1 y max_in_flight, empezando por DEFAULT_MAX_IN_FLIGHT. El límite vigente se informa en el medidor solicitudes_limite.
+    """
+
+    def __init__(self, processor, model_name, output_dir=None, max_in_flight=DEFAULT_MAX_IN_FLIGHT,
+                 encode_workers=None, watermark_workers=None, journal=None, batch_size=1,
+                 dedup_distance=None, verify_duplicates=False, index=None, event=None,
+                 adaptive_concurrency=False):
+        """
+        Args:
+            processor (ImageProcessor): Procesador que realiza cada etapa
+            model_name (str): Nombre del modelo de Ollama a utilizar
+            output_dir (str, opcional): Directorio donde guardar las imágenes procesadas
+            max_in_flight (int): Solicitudes simultáneas a Ollama (conviene que no supere
+                el pool_size del procesador, o las solicitudes esperarán una conexión libre)
+            encode_workers (int, opcional): Hilos para decodificar y codificar imágenes
+            watermark_workers (int, opcional): Hilos para la marca de agua y el guardado
+            journal (JobJournal, opcional): Registro de avance para reanudar el lote
+            batch_size (int): Imágenes por solicitud a Ollama; si el modelo no responde
+                una línea por imagen, ese grupo se procesa imagen por imagen
+            dedup_distance (int, opcional): Distancia de Hamming máxima entre huellas para
+                agrupar ráfagas; None procesa todas las imágenes
+            verify_duplicates (bool): Enviar también la última foto de cada ráfaga y, si sus
+                números no coinciden con los de la primera, procesar la ráfaga completa
+            index (BibIndex, opcional): Índice de dorsales que se actualiza con cada resultado
+            event (str, opcional): Evento con el que se indexan las fotos
+            adaptive_concurrency (bool): Ajustar las solicitudes simultáneas durante el lote;
+                max_in_flight pasa a ser el máximo
+        """
+        self.processor = processor
+        self.model_name = model_name
+        self.output_dir = output_dir
+        self.max_in_flight = max(1, int(max_in_flight))
+        cpus = os.cpu_count() or 1
+        self.encode_workers = encode_workers or min(4, cpus)
+        self.watermark_workers = watermark_workers or min(4, cpus)
+        self.journal = journal
+        self.index = index
+        self.event = event or "sin_evento"
+        self.batch_size = max(1, int(batch_size))
+        self.dedup_distance = dedup_distance
+        self.verify_duplicates = verify_duplicates
+        self.adaptive_concurrency = adaptive_concurrency
+        self.concurrency = None
+        self.resumed = 0
+        self.metrics = MetricsRegistry()
+        self._cancel = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def cancel(self):
+        """Detiene el lote: no se inician nuevas etapas y se cortan las respuestas en curso"""
+        self._cancel.set()
+
+    def run(self, items, on_start=None, on_result=None, should_stop=None, results=None):
+        """
+        Procesa las imágenes y devuelve los resultados por clave.
+
+        Las funciones de aviso se llaman siempre desde el hilo que ejecuta run().
+
+        Args:
+            items: Iterable de tuplas (clave, ruta_imagen); se consume a medida que avanza el lote
+            on_start (callable, opcional): on_start(clave) al entrar una imagen al pipeline
+            on_result (callable, opcional): on_result(clave, resultado) al terminar cada imagen
+            should_stop (callable, opcional): Devuelve True para cancelar el lote
+            results (ResultsStore, opcional): Tabla donde se guardan los resultados; por
+                defecto, un diccionario con el resultado completo de cada imagen
+
+        Returns:
+            dict: Resultados de process_image por clave, o la tabla results (parciales si
+                se canceló)
+        """
+        self._cancel.clear()
+        self.resumed = 0
+        self.metrics = MetricsRegistry()
+        self._eventos = queue.Queue()
+        self.concurrency = None
+        if self.adaptive_concurrency:
+            # Se arranca con el límite fijo por defecto, que cualquier servidor soporta, y no
+            # con una sola solicitud: el arranque sube desde ahí
+            self.concurrency = AdaptiveConcurrency(initial=min(DEFAULT_MAX_IN_FLIGHT, self.max_in_flight),
+                                                   maximum=self.max_in_flight)
+        limite = self.concurrency.limit if self.concurrency is not None else self.max_in_flight
+        # Solicitudes a Ollama en curso; el grupo de hilos tiene el máximo y este límite decide cuántas salen
+        self._solicitudes = Limiter(limite)
+        # Imágenes dentro del pipeline: las que esperan respuesta más un margen para codificar
+        self._cupo = Limiter(self._capacidad(limite))
+        self.metrics.set_gauge("solicitudes_limite", limite)
+        # Estado de la agrupación: imágenes esperando grupo, codificaciones y solicitudes pendientes
+        self._lock = threading.Lock()
+        self._grupo = []
+        self._codificando = 0
+        self._solicitando = 0
+        self._agrupar = self.batch_size > 1
+        # Ráfagas: imágenes que esperan la respuesta de su representante
+        self._rafagas = {}
+        self._sin_cupo = set()
+        self._duplicado_de = {}
+        self._pool_codificacion = ThreadPoolExecutor(self.encode_workers, thread_name_prefix="codificar")
+        self._pool_solicitudes = ThreadPoolExecutor(self.max_in_flight, thread_name_prefix="ollama")
+        self._pool_guardado = ThreadPoolExecutor(self.watermark_workers, thread_name_prefix="guardar")
+
+        alimentador = threading.Thread(target=self._alimentar, args=(items,), daemon=True)
+        alimentador.start()
+
+        if results is None:
+            results = {}
+        rutas = {}
+        enviadas = None
+        completadas = 0
+        try:
+            while enviadas is None or completadas < enviadas:
+                if should_stop is not None and should_stop():
+                    self.cancel()
+                if self._cancel.is_set():
+                    break
+                try:
+                    tipo, clave, dato = self._eventos.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+
+                if tipo == "inicio":
+                    rutas[clave] = (dato, time.perf_counter())
+                    if on_start is not None:
+                        on_start(clave)
+                elif tipo in ("resultado", "reanudado"):
+                    completadas += 1
+                    # Las fotos de una ráfaga entran al pipeline con su representante, sin ocupar cupo
+                    if clave not in self._sin_cupo:
+                        self._cupo.release()
+                    if tipo == "reanudado":
+                        dato, ruta = dato
+                    else:
+                        ruta, inicio = rutas.pop(clave, (None, None))
+                    if clave in self._duplicado_de:
+                        dato["duplicado_de"] = self._duplicado_de[clave]
+                    if tipo == "reanudado":
+                        self.resumed += 1
+                        self.metrics.record_result(dato, reanudado=True)
+                    else:
+                        # Sin inicio registrado no se conoce la duración, pero el resultado vale igual
+                        duracion = time.perf_counter() - inicio if inicio is not None else None
+                        if dato.get("success") and duracion is not None:
+                            dato["metricas"]["total"] = duracion
+                        self.metrics.record_result(dato, duracion)
+                        if self.journal is not None and ruta is not None:
+                            self.journal.record(clave, ruta, dato)
+                    results[clave] = dato
+                    if self.index is not None and ruta is not None:
+                        # Los reanudados también: el índice pudo no confirmar sus últimas altas
+                        self.index.add(ruta, dato, self.model_name, self.event)
+                    if on_result is not None:
+                        on_result(clave, dato)
+                elif tipo == "fin":
+                    enviadas = dato
+                elif tipo == "error":
+                    raise dato
+        finally:
+            if enviadas is None or completadas < enviadas:
+                self.cancel()
+            esperar = not self._cancel.is_set()
+            for pool in (self._pool_codificacion, self._pool_solicitudes, self._pool_guardado):
+                pool.shutdown(wait=esperar)
+            if self.index is not None:
+                self.index.flush()
+
+        return results
+
+    def _capacidad(self, limite):
+        """Imágenes que pueden estar dentro del pipeline con un límite de solicitudes"""
+        return limite * self.batch_size * 2 + self.encode_workers
+
+    def _alimentar(self, items):
+        """Recorre las imágenes y las envía a la etapa de codificación respetando el cupo"""
+        enviadas = 0
+        try:
+            if self.dedup_distance is not None:
+                items = self._agrupar_rafagas(items)
+            for clave, ruta in items:
+                while not self._cupo.acquire(timeout=0.1):
+                    if self._cancel.is_set():
+                        return
+                if self._cancel.is_set():
+                    return
+                # Las imágenes terminadas en una ejecución anterior no vuelven a procesarse
+                anterior = self.journal.completed_result(clave, ruta) if self.journal is not None else None
+                if anterior is not None:
+                    self._eventos.put(("reanudado", clave, (anterior, ruta)))
+                    enviadas += 1
+                    continue
+                self._eventos.put(("inicio", clave, ruta))
+                enviadas += 1
+                # Los miembros de una ráfaga se anuncian antes de enviar a su representante:
+                # si este se resuelve enseguida (por ejemplo, desde la caché), sus resultados
+                # no pueden llegar antes que su inicio
+                rafaga = self._rafagas.get(clave)
+                if rafaga is not None and rafaga["representante"] == clave:
+                    for miembro, _ in rafaga["miembros"]:
+                        self._eventos.put(("inicio", miembro, rafaga["rutas"][miembro]))
+                        enviadas += 1
+                with self._lock:
+                    self._codificando += 1
+                if not self._enviar(self._pool_codificacion, self._etapa_codificar, clave, ruta):
+                    return
+        except Exception as e:
+            self._eventos.put(("error", None, e))
+        finally:
+            self._eventos.put(("fin", None, enviadas))
+
+    def _agrupar_rafagas(self, items):
+        """
+        Agrupa las imágenes pendientes por huella y devuelve las que deben ir al modelo.
+
+        Las ya terminadas en un trabajo anterior se devuelven primero, para que el
+        alimentador las informe como reanudadas. De cada ráfaga se devuelve la primera
+        foto (y la última si se verifica); las demás quedan en espera.
+        """
+        items = list(items)
+        terminadas, pendientes = [], []
+        for clave, ruta in items:
+            anterior = self.journal.completed_result(clave, ruta) if self.journal is not None else None
+            (terminadas if anterior is not None else pendientes).append((clave, ruta))
+
+        grupos = find_duplicates([ruta for _, ruta in pendientes], self.dedup_distance)
+        enviar = list(terminadas)
+        for grupo in grupos:
+            grupo = [pendientes[i] for i in grupo]
+            representante = grupo[0]
+            enviar.append(representante)
+            if len(grupo) == 1:
+                continue
+            verificadores = [grupo[-1]] if self.verify_duplicates else []
+            miembros = grupo[1:-1] if self.verify_duplicates else grupo[1:]
+            enviar.extend(verificadores)
+            rafaga = {
+                "representante": representante[0],
+                "miembros": miembros,
+                "rutas": dict(grupo),
+                "esperadas": 1 + len(verificadores),
+                "respuestas": {},
+            }
+            for clave, _ in [representante] + verificadores:
+                self._rafagas[clave] = rafaga
+            self._sin_cupo.update(clave for clave, _ in miembros)
+        agrupadas = len(pendientes) - len(grupos)
+        if agrupadas:
+            print(f"{agrupadas} de {len(pendientes)} imágenes son parte de una ráfaga de fotos casi iguales")
+        return enviar
+
+    def _resolver_rafaga(self, clave, texto=None, numeros=None, ok=True):
+        """Cuando responden las fotos enviadas de una ráfaga, completa o procesa las que esperaban"""
+        with self._lock:
+            rafaga = self._rafagas.pop(clave, None)
+            if rafaga is None:
+                return
+            rafaga["respuestas"][clave] = (texto, numeros) if ok else None
+            if len(rafaga["respuestas"]) < rafaga["esperadas"]:
+                return
+        representante = rafaga["representante"]
+        respuesta = rafaga["respuestas"][representante]
+        coinciden = respuesta is not None and all(
+            otra is not None and sorted(otra[1]) == sorted(respuesta[1])
+            for otra in rafaga["respuestas"].values()
+        )
+        if coinciden:
+            texto, numeros = respuesta
+            for miembro, ruta in rafaga["miembros"]:
+                self._duplicado_de[miembro] = representante
+                self._continuar(miembro, ruta, texto, numeros, {})
+            return
+
+        if rafaga["miembros"]:
+            print(f"La ráfaga de {representante} no se pudo confirmar; se procesan sus "
+                  f"{len(rafaga['miembros'])} imágenes restantes por separado")
+        self.metrics.inc("rafagas_separadas_total")
+        for miembro, ruta in rafaga["miembros"]:
+            with self._lock:
+                self._codificando += 1
+            if not self._enviar(self._pool_codificacion, self._etapa_codificar, miembro, ruta):
+                with self._lock:
+                    self._codificando -= 1
+
+    def _enviar(self, pool, etapa, *args):
+        """Encola una etapa; devuelve False si el lote ya se canceló"""
+        if self._cancel.is_set():
+            return False
+        try:
+            pool.submit(etapa, *args)
+            return True
+        except RuntimeError:
+            # El grupo de hilos ya se cerró porque el lote terminó o se canceló
+            return False
+
+    def _terminar(self, clave, resultado):
+        self._eventos.put(("resultado", clave, resultado))
+
+    def _fallar(self, clave, error):
+        self._resolver_rafaga(clave, ok=False)
+        if isinstance(error, ProcessingError):
+            self._terminar(clave, {"error": str(error)})
+        else:
+            self._terminar(clave, {"success": False, "error": f"Error inesperado: {str(error)}"})
+
+    def _etapa_codificar(self, clave, ruta):
+        try:
+            self._codificar(clave, ruta)
+        finally:
+            with self._lock:
+                self._codificando -= 1
+            self._vaciar_grupo()
+
+    def _codificar(self, clave, ruta):
+        if self._cancel.is_set():
+            return
+        try:
+            # Las imágenes ya reconocidas no se decodifican ni se envían a Ollama
+            clave_cache, cacheado = None, None
+            if os.path.exists(ruta):
+                clave_cache, cacheado = self.processor.lookup_cache(ruta, self.model_name)
+            metricas = {}
+            if cacheado is not None:
+                texto, numeros = cacheado
+                self._continuar(clave, ruta, texto, numeros, metricas, desde_cache=True)
+                return
+            # La imagen decodificada se conserva para la marca de agua y no se vuelve a leer
+            image_base64, decoded = self.processor.prepare_image(
+                ruta, for_output=bool(self.output_dir), metricas=metricas
+            )
+        except Exception as e:
+            self._fallar(clave, e)
+            return
+        item = (clave, ruta, image_base64, decoded, clave_cache, metricas)
+        if not self._agrupar:
+            self._solicitar(self._etapa_solicitud, *item)
+            return
+        with self._lock:
+            self._grupo.append(item)
+            if len(self._grupo) < self.batch_size:
+                return
+            grupo, self._grupo = self._grupo, []
+        self._solicitar(self._etapa_solicitud_grupo, grupo)
+
+    def _solicitar(self, etapa, *args):
+        """Encola una solicitud a Ollama llevando la cuenta de las pendientes"""
+        with self._lock:
+            self._solicitando += 1
+        if not self._enviar(self._pool_solicitudes, etapa, *args):
+            with self._lock:
+                self._solicitando -= 1
+
+    def _vaciar_grupo(self):
+        """Envía el grupo incompleto si no se codifica ninguna otra imagen y hay una solicitud libre"""
+        with self._lock:
+            if not self._grupo or self._codificando or self._solicitando >= self._solicitudes.size:
+                return
+            grupo, self._grupo = self._grupo, []
+        if len(grupo) == 1:
+            self._solicitar(self._etapa_solicitud, *grupo[0])
+        else:
+            self._solicitar(self._etapa_solicitud_grupo, grupo)
+
+    def _llamar_ollama(self, funcion, *args, metricas):
+        """
+        Hace una solicitud a Ollama dentro del límite de solicitudes simultáneas.
+
+        Al terminar, informa al control adaptativo el primer token y si el servidor falló o
+        no respondió a tiempo; si el límite cambia, ajusta las solicitudes y el cupo del
+        pipeline.
+        """
+        while not self._solicitudes.acquire(timeout=0.1):
+            if self._cancel.is_set():
+                raise ProcessingCancelled("Procesamiento cancelado")
+        ok = False
+        registrar = True
+        try:
+            resultado = funcion(*args, self.model_name, cancel_event=self._cancel, metricas=metricas)
+            ok = True
+            return resultado
+        except BatchSplitError:
+            # El servidor respondió; solo no se pudo separar la respuesta por imagen
+            ok = True
+            raise
+        except BackendError:
+            # Errores del servidor y tiempos agotados: pueden indicar saturación
+            raise
+        except BaseException:
+            # Una cancelación o un error del modelo (un modelo que no existe, una imagen
+            # rechazada) no dicen nada sobre la carga del servidor
+            registrar = False
+            raise
+        finally:
+            en_curso = self._solicitudes.in_use
+            self._solicitudes.release()
+            if (self.concurrency is not None and registrar
+                    and self.concurrency.record(metricas.get("primer_token"), ok, en_curso)):
+                limite = self.concurrency.limit
+                self._solicitudes.resize(limite)
+                self._cupo.resize(self._capacidad(limite))
+                self.metrics.set_gauge("solicitudes_limite", limite)
+
+    def _fin_solicitud(self):
+        with self._lock:
+            self._solicitando -= 1
+        # Se liberó una solicitud: puede salir el grupo que esperaba
+        self._vaciar_grupo()
+
+    def _etapa_solicitud(self, clave, ruta, image_base64, decoded, clave_cache, metricas):
+        try:
+            if self._cancel.is_set():
+                return
+            try:
+                texto, numeros = self._llamar_ollama(self.processor.recognize, image_base64, metricas=metricas)
+            except Exception as e:
+                self._fallar(clave, e)
+                return
+            self.processor.store_cache(clave_cache, self.model_name, texto, numeros)
+            self._continuar(clave, ruta, texto, numeros, metricas, decoded=decoded)
+        finally:
+            self._fin_solicitud()
+
+    def _etapa_solicitud_grupo(self, grupo):
+        try:
+            if self._cancel.is_set():
+                return
+            metricas_grupo = {}
+            try:
+                respuestas = self._llamar_ollama(self.processor.recognize_batch, [item[2] for item in grupo],
+                                                 metricas=metricas_grupo)
+            except ProcessingCancelled:
+                return
+            except BatchSplitError as e:
+                print(f"{e}; se procesan las {len(grupo)} imágenes por separado")
+                self.metrics.inc("grupos_total", etiquetas={"estado": "separado"})
+                self._separar(grupo)
+                return
+            except ProcessingError as e:
+                # Muchos modelos de visión aceptan una sola imagen por solicitud
+                print(f"Error al enviar {len(grupo)} imágenes juntas: {e}; se envían de a una")
+                self.metrics.inc("grupos_total", etiquetas={"estado": "rechazado"})
+                with self._lock:
+                    self._agrupar = False
+                    pendientes, self._grupo = self._grupo, []
+                self._separar(grupo + pendientes)
+                return
+            except Exception as e:
+                for item in grupo:
+                    self._fallar(item[0], e)
+                return
+
+            self.metrics.inc("grupos_total", etiquetas={"estado": "ok"})
+            for (clave, ruta, _, decoded, clave_cache, metricas), (texto, numeros) in zip(grupo, respuestas):
+                # Los tiempos de la solicitud son compartidos; los tokens se reparten entre las imágenes
+                metricas.update(metricas_grupo)
+                metricas["tokens"] = metricas_grupo.get("tokens", 0) / len(grupo)
+                metricas["imagenes_por_solicitud"] = len(grupo)
+                self.processor.store_cache(clave_cache, self.model_name, texto, numeros)
+                self._continuar(clave, ruta, texto, numeros, metricas, decoded=decoded)
+        finally:
+            self._fin_solicitud()
+
+    def _separar(self, grupo):
+        """Vuelve a encolar las imágenes de un grupo como solicitudes individuales"""
+        for item in grupo:
+            self._solicitar(self._etapa_solicitud, *item)
+
+    def _continuar(self, clave, ruta, texto, numeros, metricas, desde_cache=False, decoded=None):
+        """Envía la imagen a la etapa de guardado si corresponde, o la da por terminada"""
+        self._resolver_rafaga(clave, texto, numeros)
+        if self.output_dir and numeros:
+            self._enviar(self._pool_guardado, self._etapa_guardar, clave, ruta, texto, numeros, metricas,
+                         desde_cache, decoded)
+        else:
+            self._terminar(clave, self.processor.build_result(texto, numeros, desde_cache=desde_cache,
+                                                              metricas=metricas))
+
+    def _etapa_guardar(self, clave, ruta, texto, numeros, metricas, desde_cache, decoded):
+        if self._cancel.is_set():
+            return
+        try:
+            output_path = self.processor.save_output(
+                ruta, numeros, self.output_dir, overwrite=not desde_cache, decoded=decoded, metricas=metricas,
+                relative_path=clave
+            )
+            self._terminar(clave, self.processor.build_result(texto, numeros, output_path, desde_cache, metricas))
+        except Exception as e:
+            self._fallar(clave, e)
@@ -0,0 +1,99 @@
+"""
+Benchmark del límite adaptativo de solicitudes simultáneas.
+
+Levanta benchmarks/fake_ollama.py con una cantidad de solicitudes en paralelo, como
+OLLAMA_NUM_PARALLEL, y procesa un corpus sintético con BatchProcessor usando límites
+fijos y el límite adaptativo. Informa imágenes por segundo, el primer token (p50/p95)
+y el límite al que llegó el control adaptativo.
+
+Los perfiles simulan una CPU que atiende una solicitud a la vez y una GPU que atiende
+varias, más lentas cuantas más atiende juntas.
+
+Uso:
+    python benchmarks/bench_concurrency.py --perfil cpu gpu --cantidad 300 --concurrencia 1 4 16 32
+"""
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from image_processor import ImageProcessor  # noqa: E402
+from batch_processor import BatchProcessor  # noqa: E402
+from concurrency import DEFAULT_MAX_LIMIT  # noqa: E402
+from benchmarks.corpus import generate_corpus  # noqa: E402
+from benchmarks.fake_ollama import FakeOllamaServer  # noqa: E402
+from benchmarks.bench_pipeline import percentile  # noqa: E402
+
+# Servidores simulados: solicitudes en paralelo, lentitud por solicitud en paralelo y
+# latencia hasta el primer token
+PROFILES = {
+    "cpu": {"parallel": 1, "slowdown": 0.0, "latency": 0.15},
+    "gpu": {"parallel": 16, "slowdown": 0.03, "latency": 0.3},
+}
+
+
+def run(url, rutas, concurrencia, adaptativa):
+    processor = ImageProcessor(url, pool_size=concurrencia)
+    batch = BatchProcessor(processor, "fake-vision", max_in_flight=concurrencia, adaptive_concurrency=adaptativa)
+    primer_token = []
+    terminadas = []
+    errores = [0]
+
+    def on_result(clave, resultado):
+        terminadas.append(time.perf_counter())
+        if resultado.get("success"):
+            primer_token.append(resultado["metricas"].get("primer_token", 0.0))
+        else:
+            errores[0] += 1
+
+    inicio = time.perf_counter()
+    batch.run(((os.path.basename(r), r) for r in rutas), on_result=on_result)
+    duracion = time.perf_counter() - inicio
+    processor.close()
+
+    # La segunda mitad del lote muestra el rendimiento una vez que el límite adaptativo se estabilizó
+    mitad = len(terminadas) // 2
+    segunda_mitad = (len(terminadas) - mitad) / (terminadas[-1] - terminadas[mitad]) if mitad else 0.0
+    nombre = f"adaptativo (máximo {concurrencia})" if adaptativa else f"{concurrencia} fijas"
+    linea = (f"  {nombre:<24}{len(rutas) / duracion:>8.2f} imágenes/s ({segunda_mitad:.2f} en la segunda mitad)  "
+             f"primer token p50 "
+             f"{percentile(primer_token, 50) * 1000:>6.0f} ms  p95 {percentile(primer_token, 95) * 1000:>6.0f} ms")
+    if adaptativa:
+        linea += f"  límite final {batch.concurrency.limit}"
+    if errores[0]:
+        linea += f"  errores {errores[0]}"
+    print(linea)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--perfil", nargs="+", choices=list(PROFILES), default=list(PROFILES))
+    parser.add_argument("--cantidad", type=int, default=300, help="Imágenes sintéticas")
+    parser.add_argument("--ancho", type=int, default=640)
+    parser.add_argument("--alto", type=int, default=480)
+    parser.add_argument("--corpus", default=os.path.join("benchmarks", "corpus"))
+    parser.add_argument("--concurrencia", type=int, nargs="+", default=[1, 4, 16, 32],
+                        help="Límites fijos con los que se compara")
+    parser.add_argument("--maximo", type=int, default=DEFAULT_MAX_LIMIT, help="Límite máximo del control adaptativo")
+    parser.add_argument("--tokens-por-segundo", type=float, default=100.0)
+    args = parser.parse_args()
+
+    rutas = generate_corpus(args.corpus, args.cantidad, args.ancho, args.alto)
+    for nombre in args.perfil:
+        perfil = PROFILES[nombre]
+        servidor = FakeOllamaServer(latency=perfil["latency"], tokens_per_second=args.tokens_por_segundo,
+                                    parallel=perfil["parallel"], slowdown=perfil["slowdown"]).start()
+        print(f"\n== {nombre}: {perfil['parallel']} solicitudes en paralelo, latencia {perfil['latency']} s, "
+              f"{len(rutas)} imágenes ==")
+        try:
+            for concurrencia in args.concurrencia:
+                run(servidor.url, rutas, concurrencia, adaptativa=False)
+            run(servidor.url, rutas, args.maximo, adaptativa=True)
+        finally:
+            servidor.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""
+Benchmark de la agrupación de ráfagas por huella perceptual.
+
+Genera ráfagas sintéticas de fotos casi iguales, las agrupa con dedup.find_duplicates
+e informa el tiempo del cálculo, cuántas solicitudes al modelo quedan y si algún
+grupo mezcla fotos de ráfagas distintas.
+
+Uso:
+    python benchmarks/bench_dedup.py --rafagas 30 --fotogramas 8 --distancia 6
+"""
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dedup import find_duplicates, DEFAULT_MAX_DISTANCE, DEFAULT_WINDOW  # noqa: E402
+from benchmarks.corpus import generate_bursts  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rafagas", type=int, default=20)
+    parser.add_argument("--fotogramas", type=int, default=6, help="Fotos por ráfaga")
+    parser.add_argument("--ancho", type=int, default=3000)
+    parser.add_argument("--alto", type=int, default=2000)
+    parser.add_argument("--corpus", default=os.path.join("benchmarks", "corpus", "rafagas"))
+    parser.add_argument("--distancia", type=int, nargs="+", default=[DEFAULT_MAX_DISTANCE],
+                        help="Distancias de Hamming máximas a probar")
+    parser.add_argument("--ventana", type=int, default=DEFAULT_WINDOW)
+    args = parser.parse_args()
+
+    rafagas = generate_bursts(args.corpus, args.rafagas, args.fotogramas, args.ancho, args.alto)
+    rutas = [ruta for rafaga in rafagas for ruta in rafaga]
+    rafaga_de = {ruta: i for i, rafaga in enumerate(rafagas) for ruta in rafaga}
+    print(f"{len(rutas)} fotos en {len(rafagas)} ráfagas de {args.fotogramas}")
+
+    for distancia in args.distancia:
+        inicio = time.perf_counter()
+        grupos = find_duplicates(rutas, distancia, args.ventana)
+        duracion = time.perf_counter() - inicio
+        mezclados = sum(1 for g in grupos if len({rafaga_de[rutas[i]] for i in g}) > 1)
+        print(f"\n== distancia {distancia} ==")
+        print(f"  huellas: {duracion:.2f} s ({duracion / len(rutas) * 1000:.1f} ms/foto)")
+        print(f"  solicitudes al modelo: {len(grupos)} de {len(rutas)} ({len(rutas) / len(grupos):.1f}x menos)")
+        print(f"  grupos que mezclan ráfagas distintas: {mezclados}")
+
+
+if __name__ == "__main__":
+    main()
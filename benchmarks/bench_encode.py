@@ -0,0 +1,111 @@
+"""
+Benchmark de ImageProcessor.encode_image_to_base64.
+
+Compara la decodificación completa (comportamiento anterior) con la decodificación
+reducida en modo draft, y mide la diferencia entre las imágenes que recibe el modelo.
+
+Uso:
+    python benchmarks/bench_encode.py --cantidad 20 --ancho 6000 --alto 4000
+"""
+import os
+import sys
+import time
+import base64
+import argparse
+import statistics
+from io import BytesIO
+
+from PIL import Image, ImageChops, ImageStat
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from image_processor import ImageProcessor  # noqa: E402
+from benchmarks.corpus import generate_corpus  # noqa: E402
+
+
+def encode_previous(image_path, full_decode=False):
+    """
+    Codificación anterior: thumbnail LANCZOS sobre la imagen abierta. Pillow ya aplicaba
+    un draft con reducing_gap=2; con full_decode se fuerza la decodificación completa.
+    """
+    with Image.open(image_path) as img:
+        if full_decode:
+            img.load()
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        img.thumbnail((1024, 1024), Image.Resampling.LANCZOS)
+        buffered = BytesIO()
+        img.save(buffered, format="JPEG")
+        return base64.b64encode(buffered.getvalue()).decode('utf-8')
+
+
+def decoded_pixels(image_path, variante):
+    """Píxeles que se decodifican realmente (aproxima la memoria pico de la decodificación)"""
+    with Image.open(image_path) as img:
+        escala = 1024 / max(img.size)
+        if variante == "draft":
+            img.draft('RGB', (int(img.width * escala) + 1, int(img.height * escala) + 1))
+        elif variante == "anterior":
+            img.draft(None, (int(img.width * escala) * 2, int(img.height * escala) * 2))
+        img.load()
+        return img.width * img.height
+
+
+def to_image(image_base64):
+    return Image.open(BytesIO(base64.b64decode(image_base64))).convert('L')
+
+
+def measure(funcion, rutas, repeticiones):
+    tiempos = []
+    for _ in range(repeticiones):
+        for ruta in rutas:
+            inicio = time.perf_counter()
+            funcion(ruta)
+            tiempos.append(time.perf_counter() - inicio)
+    return tiempos
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cantidad", type=int, default=10, help="Imágenes sintéticas a generar")
+    parser.add_argument("--ancho", type=int, default=6000)
+    parser.add_argument("--alto", type=int, default=4000)
+    parser.add_argument("--repeticiones", type=int, default=2)
+    parser.add_argument("--corpus", default=os.path.join("benchmarks", "corpus"),
+                        help="Directorio donde se generan las imágenes")
+    args = parser.parse_args()
+
+    rutas = generate_corpus(args.corpus, args.cantidad, args.ancho, args.alto)
+    processor = ImageProcessor()
+
+    variantes = [
+        ("decodificación completa", lambda ruta: encode_previous(ruta, full_decode=True), "completa"),
+        ("código anterior", encode_previous, "anterior"),
+        ("draft + thumbnail", processor.encode_image_to_base64, "draft"),
+    ]
+    print(f"{len(rutas)} imágenes de {args.ancho}x{args.alto}, {args.repeticiones} repeticiones\n")
+    print(f"{'variante':<26}{'media ms':>10}{'p95 ms':>10}{'Mpx decod.':>12}")
+    medias = []
+    for nombre, funcion, variante in variantes:
+        tiempos = measure(funcion, rutas, args.repeticiones)
+        p95 = statistics.quantiles(tiempos, n=20)[-1] if len(tiempos) > 1 else tiempos[0]
+        mpx = decoded_pixels(rutas[0], variante) / 1e6
+        medias.append(statistics.mean(tiempos))
+        print(f"{nombre:<26}{medias[-1] * 1000:>10.1f}{p95 * 1000:>10.1f}{mpx:>12.2f}")
+
+    # Diferencia media por píxel entre lo que recibe el modelo en cada variante
+    diferencias = []
+    for ruta in rutas:
+        a = to_image(encode_previous(ruta, full_decode=True))
+        b = to_image(processor.encode_image_to_base64(ruta))
+        if a.size != b.size:
+            b = b.resize(a.size)
+        diferencias.append(ImageStat.Stat(ImageChops.difference(a, b)).mean[0])
+
+    print(f"\nAceleración frente a la decodificación completa: {medias[0] / medias[2]:.1f}x")
+    print(f"Aceleración frente al código anterior: {medias[1] / medias[2]:.1f}x")
+    print(f"Diferencia media por píxel (0-255): {statistics.mean(diferencias):.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+"""
+Benchmark del procesamiento de lotes contra un servidor de Ollama simulado.
+
+Genera un corpus sintético, levanta benchmarks/fake_ollama.py en un puerto libre y
+procesa el corpus con BatchProcessor (y opcionalmente con process_image en serie).
+Informa imágenes por segundo, latencia por imagen (p50/p95/p99) y el tiempo de cada
+etapa: decodificación, codificación, solicitud, análisis, marca de agua y escritura.
+
+Uso:
+    python benchmarks/bench_pipeline.py --cantidad 40 --concurrencia 1 4 8 --latencia 0.5
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from image_processor import ImageProcessor  # noqa: E402
+from batch_processor import BatchProcessor  # noqa: E402
+from bib_regions import BibRegionDetector  # noqa: E402
+from benchmarks.corpus import generate_corpus  # noqa: E402
+from benchmarks.fake_ollama import FakeOllamaServer  # noqa: E402
+
+STAGES = ("decodificar", "regiones", "codificar", "solicitud", "analisis", "marca_agua", "escritura")
+
+
+class StageTimes:
+    """Acumula los tiempos por etapa que devuelve cada resultado en sus métricas"""
+
+    def __init__(self):
+        self.totals = defaultdict(float)
+        self.primer_token = []
+        self.tokens = 0
+
+    def add(self, resultado):
+        metricas = resultado.get("metricas") or {}
+        for etapa in STAGES:
+            self.totals[etapa] += metricas.get(etapa, 0.0)
+        if "primer_token" in metricas:
+            self.primer_token.append(metricas["primer_token"])
+        self.tokens += metricas.get("tokens", 0)
+
+
+def percentile(valores, p):
+    """Percentil por interpolación lineal"""
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    k = (len(ordenados) - 1) * p / 100
+    inferior = int(k)
+    superior = min(inferior + 1, len(ordenados) - 1)
+    return ordenados[inferior] + (ordenados[superior] - ordenados[inferior]) * (k - inferior)
+
+
+def report(nombre, total, duracion, latencias, tiempos, errores):
+    print(f"\n== {nombre} ==")
+    print(f"  imágenes: {total}  errores: {errores}  duración: {duracion:.2f} s")
+    print(f"  rendimiento: {total / duracion:.2f} imágenes/s")
+    print(f"  latencia por imagen: p50 {percentile(latencias, 50) * 1000:.0f} ms  "
+          f"p95 {percentile(latencias, 95) * 1000:.0f} ms  p99 {percentile(latencias, 99) * 1000:.0f} ms")
+    print(f"  primer token: p50 {percentile(tiempos.primer_token, 50) * 1000:.0f} ms  "
+          f"p95 {percentile(tiempos.primer_token, 95) * 1000:.0f} ms  tokens: {tiempos.tokens}")
+    # "solicitud" incluye la espera del primer token y la lectura de la respuesta
+    suma = sum(tiempos.totals.values()) or 1.0
+    print("  tiempo por etapa (suma de todos los hilos):")
+    for etapa in STAGES:
+        segundos = tiempos.totals.get(etapa, 0.0)
+        print(f"    {etapa:<12}{segundos:>9.2f} s  {segundos / max(total, 1) * 1000:>8.1f} ms/img  {segundos / suma:>6.1%}")
+
+
+def run_sequential(url, rutas, model_name, output_dir):
+    processor = ImageProcessor(url)
+    tiempos = StageTimes()
+    latencias, errores = [], 0
+    inicio = time.perf_counter()
+    for ruta in rutas:
+        t0 = time.perf_counter()
+        resultado = processor.process_image(ruta, model_name, output_dir=output_dir)
+        latencias.append(time.perf_counter() - t0)
+        tiempos.add(resultado)
+        errores += 0 if resultado.get("success") else 1
+    duracion = time.perf_counter() - inicio
+    processor.close()
+    report("process_image en serie", len(rutas), duracion, latencias, tiempos, errores)
+
+
+def run_batch(url, rutas, model_name, output_dir, concurrencia, metricas_path=None, batch_size=1, regions=None,
+              early_stop=True):
+    processor = ImageProcessor(url, pool_size=concurrencia, regions=regions, stop_at_newline=early_stop)
+    batch = BatchProcessor(processor, model_name, output_dir=output_dir, max_in_flight=concurrencia,
+                           batch_size=batch_size)
+    tiempos = StageTimes()
+    latencias = []
+    errores = [0]
+
+    def on_result(clave, resultado):
+        tiempos.add(resultado)
+        if resultado.get("success"):
+            latencias.append(resultado["metricas"]["total"])
+        else:
+            errores[0] += 1
+
+    inicio = time.perf_counter()
+    batch.run(((os.path.basename(r), r) for r in rutas), on_result=on_result)
+    duracion = time.perf_counter() - inicio
+    processor.close()
+    nombre = f"BatchProcessor, {concurrencia} solicitudes simultáneas"
+    if batch_size > 1:
+        nombre += f", {batch_size} imágenes por solicitud"
+    if regions is not None:
+        nombre += ", mosaico de regiones"
+    if not early_stop:
+        nombre += ", sin corte anticipado"
+    report(nombre, len(rutas), duracion,
+           latencias, tiempos, errores[0])
+    if metricas_path:
+        batch.metrics.write(metricas_path)
+        print(f"  métricas guardadas en {metricas_path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cantidad", type=int, default=20, help="Imágenes sintéticas")
+    parser.add_argument("--ancho", type=int, default=4000)
+    parser.add_argument("--alto", type=int, default=3000)
+    parser.add_argument("--corpus", default=os.path.join("benchmarks", "corpus"))
+    parser.add_argument("--concurrencia", type=int, nargs="+", default=[1, 4],
+                        help="Solicitudes simultáneas a probar")
+    parser.add_argument("--secuencial", action="store_true", help="Medir también process_image en serie")
+    parser.add_argument("--latencia", type=float, default=0.3, help="Segundos hasta el primer token")
+    parser.add_argument("--tokens-por-segundo", type=float, default=50.0)
+    parser.add_argument("--tasa-fallos", type=float, default=0.0)
+    parser.add_argument("--servidores", type=int, default=1,
+                        help="Servidores simulados entre los que se reparten las solicitudes")
+    parser.add_argument("--servidor-caido", action="store_true",
+                        help="Agregar una URL sin servidor para probar el retiro de nodos caídos")
+    parser.add_argument("--latencia-por-imagen", type=float, default=0.0,
+                        help="Segundos adicionales hasta el primer token por cada imagen de la solicitud")
+    parser.add_argument("--imagenes-por-solicitud", type=int, nargs="+", default=[1],
+                        help="Tamaños de grupo a probar con cada concurrencia")
+    parser.add_argument("--regiones", action="store_true", help="Enviar el mosaico de regiones que parecen dorsales")
+    parser.add_argument("--comparar-corte", action="store_true",
+                        help="Medir también sin cortar la respuesta después de la lista de números")
+    parser.add_argument("--sin-salida", action="store_true", help="No generar las copias con marca de agua")
+    parser.add_argument("--metricas", help="Guardar las métricas de la última ejecución (.json o .prom)")
+    args = parser.parse_args()
+
+    rutas = generate_corpus(args.corpus, args.cantidad, args.ancho, args.alto)
+    servidores = [
+        FakeOllamaServer(latency=args.latencia, tokens_per_second=args.tokens_por_segundo,
+                         failure_rate=args.tasa_fallos, seed=i, image_latency=args.latencia_por_imagen).start()
+        for i in range(max(1, args.servidores))
+    ]
+    urls = [s.url for s in servidores]
+    if args.servidor_caido:
+        # Puerto reservado y cerrado: las conexiones se rechazan
+        urls.append("http://127.0.0.1:9")
+    url = urls if len(urls) > 1 else urls[0]
+    print(f"{len(rutas)} imágenes de {args.ancho}x{args.alto}; servidores simulados en {', '.join(urls)} "
+          f"(latencia {args.latencia} s, {args.tokens_por_segundo} tokens/s, fallos {args.tasa_fallos:.0%})")
+
+    try:
+        if args.secuencial:
+            salida = None if args.sin_salida else tempfile.mkdtemp(prefix="bench_salida_")
+            run_sequential(url, rutas, "fake-vision", salida)
+            if salida:
+                shutil.rmtree(salida, ignore_errors=True)
+        for concurrencia in args.concurrencia:
+            for batch_size in args.imagenes_por_solicitud:
+                for early_stop in ((True, False) if args.comparar_corte else (True,)):
+                    salida = None if args.sin_salida else tempfile.mkdtemp(prefix="bench_salida_")
+                    run_batch(url, rutas, "fake-vision", salida, concurrencia, args.metricas, batch_size,
+                              BibRegionDetector() if args.regiones else None, early_stop)
+                    if salida:
+                        shutil.rmtree(salida, ignore_errors=True)
+    finally:
+        for servidor in servidores:
+            servidor.stop()
+
+
+if __name__ == "__main__":
+    main()
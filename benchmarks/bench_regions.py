@@ -0,0 +1,121 @@
+"""
+Benchmark de la detección de dorsales previa al modelo.
+
+Genera fotos sintéticas con dorsales en posiciones conocidas y compara enviar la foto
+completa contra enviar el mosaico de regiones detectadas: cobertura de los dorsales
+reales, píxeles y bytes enviados y tiempo de preparación. Con --ollama-url también
+mide, contra un servidor real, la exactitud de los números y el tiempo de respuesta.
+
+Uso:
+    python benchmarks/bench_regions.py --cantidad 30
+    python benchmarks/bench_regions.py --cantidad 10 --ollama-url http://localhost:11434 --modelo llava:13b
+"""
+import os
+import sys
+import json
+import time
+import base64
+import argparse
+from io import BytesIO
+
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from image_processor import ImageProcessor  # noqa: E402
+from bib_regions import BibRegionDetector  # noqa: E402
+from benchmarks.corpus import generate_image  # noqa: E402
+from benchmarks.bench_pipeline import percentile  # noqa: E402
+
+
+def labeled_corpus(directory, count, width, height, seed=0):
+    """Genera las fotos y guarda junto a ellas las cajas de los dorsales"""
+    os.makedirs(directory, exist_ok=True)
+    indice = os.path.join(directory, f"dorsales_{width}x{height}.json")
+    etiquetas = {}
+    if os.path.exists(indice):
+        with open(indice, encoding='utf-8') as f:
+            etiquetas = json.load(f)
+    for i in range(count):
+        ruta = os.path.join(directory, f"dorsales_{width}x{height}_{i:05d}.jpg")
+        if ruta not in etiquetas or not os.path.exists(ruta):
+            etiquetas[ruta] = generate_image(ruta, width, height, seed=seed + i)
+    with open(indice, 'w', encoding='utf-8') as f:
+        json.dump(etiquetas, f)
+    return [(ruta, etiquetas[ruta]) for ruta in sorted(etiquetas)[:count]]
+
+
+def covered(dorsal, cajas, escala, minimo=0.9):
+    """Si al menos `minimo` del dorsal (en coordenadas originales) queda dentro de alguna caja"""
+    x0, y0, x1, y1 = dorsal
+    area = (x1 - x0) * (y1 - y0)
+    for cx0, cy0, cx1, cy1 in cajas:
+        cx0, cy0, cx1, cy1 = cx0 / escala, cy0 / escala, cx1 / escala, cy1 / escala
+        ancho = max(0, min(x1, cx1) - max(x0, cx0))
+        alto = max(0, min(y1, cy1) - max(y0, cy0))
+        if ancho * alto >= minimo * area:
+            return True
+    return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cantidad", type=int, default=20)
+    parser.add_argument("--ancho", type=int, default=4000)
+    parser.add_argument("--alto", type=int, default=3000)
+    parser.add_argument("--corpus", default=os.path.join("benchmarks", "corpus", "dorsales"))
+    parser.add_argument("--ollama-url", help="Servidor de Ollama para medir exactitud y latencia reales")
+    parser.add_argument("--modelo", default="llama3.2-vision")
+    args = parser.parse_args()
+
+    fotos = labeled_corpus(args.corpus, args.cantidad, args.ancho, args.alto)
+    completo = ImageProcessor(args.ollama_url or "http://localhost:11434")
+    regiones = ImageProcessor(args.ollama_url or "http://localhost:11434", regions=BibRegionDetector())
+
+    for nombre, processor in (("foto completa", completo), ("mosaico de regiones", regiones)):
+        tiempos, bytes_enviados, pixeles = [], 0, 0
+        dorsales, cubiertos, sin_regiones = 0, 0, 0
+        aciertos, solicitudes = 0, []
+        for ruta, etiquetas in fotos:
+            metricas = {}
+            inicio = time.perf_counter()
+            image_base64, (decodificada, tamano) = processor.prepare_image(ruta, metricas=metricas)
+            tiempos.append(time.perf_counter() - inicio)
+            bytes_enviados += len(image_base64)
+            with Image.open(BytesIO(base64.b64decode(image_base64))) as enviada:
+                pixeles += enviada.width * enviada.height
+
+            escala = decodificada.width / tamano[0]
+            cajas = None
+            if processor.regions is not None:
+                # Las mismas regiones que usó prepare_image, sobre la misma imagen decodificada
+                mosaico, encontradas = processor.regions.mosaic(decodificada)
+                cajas = encontradas if mosaico is not None else None
+            for _, caja in etiquetas:
+                dorsales += 1
+                # Sin mosaico se envía la foto completa: todos los dorsales quedan incluidos
+                cubiertos += 1 if cajas is None else covered(caja, cajas, escala)
+            sin_regiones += cajas is None and processor.regions is not None
+
+            if args.ollama_url:
+                t0 = time.perf_counter()
+                _, numeros = processor.recognize(image_base64, args.modelo)
+                solicitudes.append(time.perf_counter() - t0)
+                aciertos += sorted(numeros) == sorted(n for n, _ in etiquetas)
+
+        total = len(fotos)
+        print(f"\n== {nombre} ==")
+        print(f"  preparación: p50 {percentile(tiempos, 50) * 1000:.0f} ms  p95 {percentile(tiempos, 95) * 1000:.0f} ms")
+        print(f"  enviado por foto: {bytes_enviados / total / 1024:.0f} KiB, {pixeles / total / 1e6:.2f} Mpx")
+        print(f"  dorsales incluidos en lo enviado: {cubiertos}/{dorsales} ({cubiertos / max(dorsales, 1):.0%})")
+        if processor.regions is not None:
+            print(f"  fotos enviadas completas por falta de regiones claras: {sin_regiones}/{total}")
+        if solicitudes:
+            print(f"  exactitud: {aciertos}/{total}  solicitud: p50 {percentile(solicitudes, 50):.2f} s  "
+                  f"p95 {percentile(solicitudes, 95):.2f} s")
+    completo.close()
+    regiones.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""Generación de un corpus sintético de fotos de carrera para los benchmarks."""
+import os
+import random
+
+from PIL import Image, ImageDraw, ImageFilter, ImageFont
+
+
+def _font(size):
+    try:
+        return ImageFont.truetype("DejaVuSans-Bold.ttf", size)
+    except OSError:
+        return ImageFont.load_default()
+
+
+def generate_image(path, width, height, seed=0, orientation=1):
+    """
+    Genera una foto sintética con ruido (para que el JPEG pese como una foto real)
+    y uno a tres dorsales con números.
+
+    Returns:
+        list: Dorsales dibujados como tuplas (numero, (x0, y0, x1, y1))
+    """
+    rnd = random.Random(seed)
+    # Fondo con ruido suavizado y un degradado de color
+    ruido = Image.effect_noise((width // 8, height // 8), 60).resize((width, height), Image.Resampling.BILINEAR)
+    fondo = Image.merge("RGB", (
+        ruido,
+        ruido.point(lambda v: (v + rnd.randint(0, 80)) % 256),
+        Image.linear_gradient("L").resize((width, height)),
+    )).filter(ImageFilter.GaussianBlur(1))
+
+    draw = ImageDraw.Draw(fondo)
+    dorsales = []
+    for _ in range(rnd.randint(1, 3)):
+        ancho = rnd.randint(width // 12, width // 6)
+        alto = int(ancho * 0.7)
+        x0 = rnd.randint(0, width - ancho)
+        y0 = rnd.randint(height // 3, height - alto)
+        numero = rnd.randint(1, 9999)
+        draw.rectangle((x0, y0, x0 + ancho, y0 + alto), fill=(245, 245, 245), outline=(20, 20, 20), width=4)
+        fuente = _font(int(alto * 0.55))
+        draw.text((x0 + ancho // 2, y0 + alto // 2), str(numero), fill=(10, 10, 10), font=fuente, anchor="mm")
+        dorsales.append((numero, (x0, y0, x0 + ancho, y0 + alto)))
+
+    exif = Image.Exif()
+    if orientation != 1:
+        exif[0x0112] = orientation
+    fondo.save(path, format="JPEG", quality=92, exif=exif.tobytes())
+    return dorsales
+
+
+def generate_corpus(directory, count, width=6000, height=4000, seed=0):
+    """
+    Genera count imágenes en directory, reutilizando las que ya existan.
+
+    Returns:
+        list: Rutas de las imágenes generadas
+    """
+    os.makedirs(directory, exist_ok=True)
+    rutas = []
+    for i in range(count):
+        ruta = os.path.join(directory, f"sintetica_{width}x{height}_{i:05d}.jpg")
+        if not os.path.exists(ruta):
+            generate_image(ruta, width, height, seed=seed + i)
+        rutas.append(ruta)
+    return rutas
+
+
+def generate_bursts(directory, bursts, frames=6, width=3000, height=2000, seed=0):
+    """
+    Genera ráfagas: cada una es una foto base y fotogramas casi iguales, con un leve
+    encuadre distinto y cambios de exposición, como los de una cámara en modo ráfaga.
+
+    Returns:
+        list: Listas de rutas, una por ráfaga
+    """
+    os.makedirs(directory, exist_ok=True)
+    rafagas = []
+    for b in range(bursts):
+        base = os.path.join(directory, f"rafaga_base_{width}x{height}_{b:04d}.jpg")
+        if not os.path.exists(base):
+            generate_image(base, width, height, seed=seed + b)
+        rutas = []
+        rnd = random.Random(seed * 7919 + b)
+        for f in range(frames):
+            ruta = os.path.join(directory, f"rafaga_{width}x{height}_{b:04d}_{f:02d}.jpg")
+            if not os.path.exists(ruta):
+                with Image.open(base) as img:
+                    dx, dy = rnd.randint(0, width // 50), rnd.randint(0, height // 50)
+                    fotograma = img.crop((dx, dy, dx + width - width // 50, dy + height - height // 50))
+                    fotograma = fotograma.point(lambda v, g=rnd.uniform(0.9, 1.1): min(255, int(v * g)))
+                    fotograma.save(ruta, format="JPEG", quality=90)
+            rutas.append(ruta)
+        rafagas.append(rutas)
+    return rafagas
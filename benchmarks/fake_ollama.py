@@ -0,0 +1,245 @@
+"""
+Servidor local que imita la API /api/generate de Ollama, para benchmarks sin GPU.
+
+Responde en NDJSON por streaming, como Ollama, con una latencia configurable hasta el
+primer token, una velocidad de tokens y una tasa de fallos (respuestas 500). Las
+solicitudes con varias imágenes reciben una línea "Imagen N: ..." por imagen. Respeta
+las opciones num_predict y stop, y deja de generar si el cliente cierra la conexión.
+
+Con --paralelo atiende esa cantidad de solicitudes a la vez y encola el resto, como
+OLLAMA_NUM_PARALLEL: la espera en la cola se suma al tiempo hasta el primer token.
+
+Uso:
+    python benchmarks/fake_ollama.py --puerto 11500 --latencia 0.5 --tokens-por-segundo 40
+"""
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Respuesta por defecto: la lista pedida en el prompt seguida de texto de más
+DEFAULT_ANSWER = "123, 4567"
+DEFAULT_TRAILING = "\nEstos son los números visibles de los participantes en primer plano."
+
+
+class _Server(ThreadingHTTPServer):
+    """ThreadingHTTPServer que no imprime las conexiones que el cliente cierra o reinicia"""
+
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # El corte anticipado de la respuesta y el reciclado de conexiones del cliente las
+        # cierran en cualquier momento: no es un error del servidor
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            return
+        super().handle_error(request, client_address)
+
+
+class FakeOllamaServer:
+    """Servidor HTTP en un hilo de fondo que simula un modelo de visión de Ollama"""
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.3, tokens_per_second=50.0,
+                 failure_rate=0.0, answer=DEFAULT_ANSWER, trailing=DEFAULT_TRAILING, seed=None,
+                 image_latency=0.0, multi_image=True, parallel=0, slowdown=0.0):
+        """
+        Args:
+            port (int): Puerto a escuchar; 0 elige uno libre
+            latency (float): Segundos hasta el primer token
+            tokens_per_second (float): Velocidad de generación; 0 envía todo de inmediato
+            failure_rate (float): Proporción de solicitudes que responden con error 500
+            answer (str): Texto de la respuesta con los números
+            trailing (str): Texto adicional que el modelo genera después de la lista
+            image_latency (float): Segundos adicionales hasta el primer token por cada imagen
+            multi_image (bool): Si es False, las solicitudes con varias imágenes responden
+                con error, como los modelos que aceptan una sola imagen
+            parallel (int): Solicitudes que se atienden a la vez; las demás esperan su turno
+                antes del primer token. 0 atiende todas a la vez
+            slowdown (float): Cuánto se alarga cada solicitud por cada otra que se atiende a
+                la vez (0.05 = 5 %), como en una GPU que reparte su cálculo
+        """
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.failure_rate = failure_rate
+        self.answer = answer
+        self.trailing = trailing
+        self.image_latency = image_latency
+        self.multi_image = multi_image
+        self.slowdown = slowdown
+        self.active = 0
+        self.requests = 0
+        self.failures = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._slots = threading.Semaphore(parallel) if parallel > 0 else None
+        self._httpd = _Server((host, port), self._handler_class())
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def tokens(self, images=1):
+        """Divide la respuesta en tokens aproximados (números, separadores y palabras)"""
+        if images > 1:
+            texto = "\n".join(f"Imagen {i}: {self.answer}" for i in range(1, images + 1))
+        else:
+            texto = self.answer + self.trailing
+        tokens, actual = [], ""
+        for caracter in texto:
+            actual += caracter
+            if caracter in ", \n":
+                tokens.append(actual)
+                actual = ""
+        if actual:
+            tokens.append(actual)
+        return tokens
+
+    def _should_fail(self):
+        with self._lock:
+            self.requests += 1
+            falla = self._random.random() < self.failure_rate
+            if falla:
+                self.failures += 1
+            return falla
+
+    def _handler_class(self):
+        servidor = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send_json(self, status, data):
+                cuerpo = json.dumps(data).encode('utf-8')
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(cuerpo)))
+                self.end_headers()
+                self.wfile.write(cuerpo)
+
+            def _send_chunk(self, data):
+                linea = (json.dumps(data) + "\n").encode('utf-8')
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(linea), linea))
+                self.wfile.flush()
+
+            def do_GET(self):
+                if self.path == "/api/tags":
+                    self._send_json(200, {"models": [{"name": "fake-vision"}]})
+                else:
+                    self._send_json(404, {"error": "not found"})
+
+            def do_POST(self):
+                longitud = int(self.headers.get("Content-Length", 0))
+                cuerpo = json.loads(self.rfile.read(longitud) or b"{}")
+                if self.path != "/api/generate":
+                    self._send_json(404, {"error": "not found"})
+                    return
+                if servidor._should_fail():
+                    self._send_json(500, {"error": "fallo simulado"})
+                    return
+                imagenes = len(cuerpo.get("images") or []) or 1
+                if imagenes > 1 and not servidor.multi_image:
+                    self._send_json(500, {"error": "this model only supports one image"})
+                    return
+
+                if servidor._slots is not None:
+                    servidor._slots.acquire()
+                with servidor._lock:
+                    servidor.active += 1
+                    factor = 1 + servidor.slowdown * (servidor.active - 1)
+                try:
+                    self._generate(cuerpo, imagenes, factor)
+                finally:
+                    with servidor._lock:
+                        servidor.active -= 1
+                    if servidor._slots is not None:
+                        servidor._slots.release()
+
+            def _generate(self, cuerpo, imagenes, factor):
+                time.sleep((servidor.latency + servidor.image_latency * imagenes) * factor)
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+
+                pausa = factor / servidor.tokens_per_second if servidor.tokens_per_second > 0 else 0
+                modelo = cuerpo.get("model", "fake-vision")
+                tokens = servidor.tokens(imagenes)
+                opciones = cuerpo.get("options") or {}
+                if opciones.get("num_predict"):
+                    tokens = tokens[:opciones["num_predict"]]
+                for parada in opciones.get("stop") or []:
+                    texto = "".join(tokens)
+                    if parada in texto:
+                        # Como Ollama: la secuencia de parada no se incluye en la respuesta
+                        texto = texto[:texto.index(parada)]
+                        tokens = [texto] if texto else []
+                try:
+                    for token in tokens:
+                        self._send_chunk({"model": modelo, "response": token, "done": False})
+                        if pausa:
+                            time.sleep(pausa)
+                    self._send_chunk({"model": modelo, "response": "", "done": True, "eval_count": len(tokens)})
+                    self.wfile.write(b"0\r\n\r\n")
+                    self.wfile.flush()
+                except (BrokenPipeError, ConnectionResetError):
+                    # El cliente cerró la conexión antes de terminar
+                    self.close_connection = True
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--puerto", type=int, default=11500)
+    parser.add_argument("--latencia", type=float, default=0.3, help="Segundos hasta el primer token")
+    parser.add_argument("--tokens-por-segundo", type=float, default=50.0)
+    parser.add_argument("--tasa-fallos", type=float, default=0.0, help="Proporción de respuestas 500 (0 a 1)")
+    parser.add_argument("--respuesta", default=DEFAULT_ANSWER)
+    parser.add_argument("--latencia-por-imagen", type=float, default=0.0,
+                        help="Segundos adicionales hasta el primer token por cada imagen")
+    parser.add_argument("--una-imagen", action="store_true",
+                        help="Rechazar las solicitudes con varias imágenes")
+    parser.add_argument("--paralelo", type=int, default=0,
+                        help="Solicitudes que se atienden a la vez, como OLLAMA_NUM_PARALLEL (0 sin límite)")
+    parser.add_argument("--lentitud", type=float, default=0.0,
+                        help="Cuánto se alarga cada solicitud por cada otra en curso (0.05 = 5 %%)")
+    args = parser.parse_args()
+
+    servidor = FakeOllamaServer(args.host, args.puerto, args.latencia, args.tokens_por_segundo,
+                                args.tasa_fallos, args.respuesta, image_latency=args.latencia_por_imagen,
+                                multi_image=not args.una_imagen, parallel=args.paralelo,
+                                slowdown=args.lentitud)
+    print(f"Servidor de prueba escuchando en {servidor.url}")
+    try:
+        servidor._httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        servidor._httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+"""
+Índice persistente de dorsales: para cada número, las fotos en las que aparece.
+
+Uso:
+    python bib_index.py 123
+    python bib_index.py 123 --evento maraton_2024 --indice media/indice_dorsales.sqlite3
+    python bib_index.py --eventos
+"""
+import os
+import sys
+import json
+import time
+import sqlite3
+import argparse
+import threading
+
+DEFAULT_INDEX_NAME = "indice_dorsales.sqlite3"
+
+
+class BibIndex:
+    """
+    Índice invertido en SQLite de número de dorsal a fotos.
+
+    Cada foto se guarda una vez, con su evento, modelo, fecha de procesamiento, ruta
+    original y copia con marca de agua; la tabla de dorsales tiene como clave primaria
+    (numero, imagen), de modo que buscar un número es una lectura del índice sin
+    recorrer las fotos, aun con cientos de miles de imágenes y varios eventos.
+
+    Las altas se agrupan en transacciones que se confirman cada commit_interval segundos,
+    para no pagar una escritura a disco por foto.
+    """
+
+    def __init__(self, path, commit_interval=1.0):
+        """
+        Args:
+            path (str): Ruta del archivo SQLite del índice
+            commit_interval (float): Segundos máximos entre confirmaciones de las altas
+        """
+        self.path = path
+        self.commit_interval = commit_interval
+        directorio = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directorio, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS imagenes (
+                id INTEGER PRIMARY KEY,
+                ruta TEXT NOT NULL UNIQUE,
+                evento TEXT NOT NULL,
+                modelo TEXT NOT NULL,
+                copia TEXT,
+                numeros TEXT NOT NULL,
+                procesada REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_imagenes_evento ON imagenes (evento);
+            CREATE TABLE IF NOT EXISTS dorsales (
+                numero INTEGER NOT NULL,
+                imagen INTEGER NOT NULL REFERENCES imagenes (id) ON DELETE CASCADE,
+                PRIMARY KEY (numero, imagen)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS idx_dorsales_imagen ON dorsales (imagen);
+        """)
+        self._conn.commit()
+        self._pendientes = 0
+        self._ultimo_commit = time.monotonic()
+
+    @staticmethod
+    def path_for(media_dir):
+        """Ruta del índice dentro de la carpeta de resultados"""
+        return os.path.join(media_dir, DEFAULT_INDEX_NAME)
+
+    def add(self, image_path, resultado, model_name, event):
+        """
+        Agrega o actualiza una foto procesada. Los resultados con error se ignoran.
+
+        Args:
+            image_path (str): Ruta de la foto original
+            resultado (dict): Resultado de process_image
+            model_name (str): Modelo que reconoció los números
+            event (str): Nombre del evento (por ejemplo, la carpeta de la carrera)
+        """
+        if not resultado.get("success"):
+            return
+        numeros = sorted(set(int(n) for n in resultado.get("numeros_encontrados") or []))
+        ruta = os.path.abspath(image_path)
+        with self._lock:
+            fila = self._conn.execute(
+                "INSERT INTO imagenes (ruta, evento, modelo, copia, numeros, procesada) VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (ruta) DO UPDATE SET evento = excluded.evento, modelo = excluded.modelo, "
+                "copia = excluded.copia, numeros = excluded.numeros, procesada = excluded.procesada "
+                "RETURNING id",
+                (ruta, event, model_name, resultado.get("output_path"), json.dumps(numeros), time.time())
+            ).fetchone()
+            imagen = fila[0]
+            self._conn.execute("DELETE FROM dorsales WHERE imagen = ?", (imagen,))
+            self._conn.executemany(
+                "INSERT INTO dorsales (numero, imagen) VALUES (?, ?)", [(n, imagen) for n in numeros]
+            )
+            self._pendientes += 1
+            if time.monotonic() - self._ultimo_commit >= self.commit_interval:
+                self._commit()
+
+    def _commit(self):
+        self._conn.commit()
+        self._pendientes = 0
+        self._ultimo_commit = time.monotonic()
+
+    def flush(self):
+        """Confirma las altas pendientes"""
+        with self._lock:
+            if self._pendientes:
+                self._commit()
+
+    def lookup(self, numero, event=None):
+        """
+        Busca las fotos en las que aparece un número.
+
+        Args:
+            numero (int): Número de dorsal
+            event (str, opcional): Limitar la búsqueda a un evento
+
+        Returns:
+            list: Diccionarios con ruta, copia, evento, modelo, procesada y numeros,
+                ordenados por evento y ruta
+        """
+        consulta = (
+            "SELECT i.ruta, i.copia, i.evento, i.modelo, i.procesada, i.numeros "
+            "FROM dorsales d JOIN imagenes i ON i.id = d.imagen WHERE d.numero = ?"
+        )
+        parametros = [int(numero)]
+        if event is not None:
+            # El + evita que SQLite recorra el evento entero por idx_imagenes_evento en lugar de
+            # partir de los pocos dorsales con ese número
+            consulta += " AND +i.evento = ?"
+            parametros.append(event)
+        consulta += " ORDER BY i.evento, i.ruta"
+        with self._lock:
+            filas = self._conn.execute(consulta, parametros).fetchall()
+        return [
+            {"ruta": ruta, "copia": copia, "evento": evento, "modelo": modelo,
+             "procesada": procesada, "numeros": json.loads(numeros)}
+            for ruta, copia, evento, modelo, procesada, numeros in filas
+        ]
+
+    def events(self):
+        """Devuelve los eventos indexados con su cantidad de fotos"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT evento, COUNT(*) FROM imagenes GROUP BY evento ORDER BY evento"
+            ).fetchall()
+
+    def remove_event(self, event):
+        """Elimina del índice todas las fotos de un evento"""
+        with self._lock:
+            self._conn.execute("DELETE FROM imagenes WHERE evento = ?", (event,))
+            self._commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.commit()
+            self._conn.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("numero", nargs="?", type=int, help="Número de dorsal a buscar")
+    parser.add_argument("--evento", help="Buscar solo en este evento")
+    parser.add_argument("--indice", default=BibIndex.path_for(
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), 'media')), help="Archivo del índice")
+    parser.add_argument("--eventos", action="store_true", help="Listar los eventos indexados")
+    parser.add_argument("--json", action="store_true", help="Mostrar los resultados como JSON")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.indice):
+        print(f"El índice {args.indice} no existe", file=sys.stderr)
+        return 2
+    indice = BibIndex(args.indice)
+    try:
+        if args.eventos:
+            for evento, cantidad in indice.events():
+                print(f"{evento}: {cantidad} fotos")
+            return 0
+        if args.numero is None:
+            parser.error("Indica un número de dorsal o --eventos")
+
+        inicio = time.perf_counter()
+        fotos = indice.lookup(args.numero, args.evento)
+        duracion = time.perf_counter() - inicio
+        if args.json:
+            print(json.dumps(fotos, ensure_ascii=False, indent=2))
+        else:
+            for foto in fotos:
+                print(f"[{foto['evento']}] {foto['ruta']}" + (f" -> {foto['copia']}" if foto['copia'] else ""))
+            print(f"{len(fotos)} fotos con el número {args.numero} ({duracion * 1000:.1f} ms)", file=sys.stderr)
+        return 0 if fotos else 1
+    finally:
+        indice.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,181 @@
+from collections import deque
+
+import numpy as np
+from PIL import Image
+
+
+class BibRegionDetector:
+    """
+    Busca en la foto las zonas que parecen dorsales y arma con ellas un mosaico pequeño.
+
+    Un dorsal es una superficie clara con trazos oscuros: muchos bordes fuertes y muchos
+    píxeles claros en poco espacio. La detección trabaja sobre una versión reducida en
+    escala de grises dividida en celdas, sin modelos ni GPU. Si no encuentra regiones
+    claras, o si cubren casi toda la foto, se envía la imagen completa como siempre.
+    """
+
+    def __init__(self, analysis_size=512, cell=8, edge_threshold=48, min_edge_density=0.12,
+                 min_bright_fraction=0.25, max_regions=4, margin=0.15, max_coverage=0.5,
+                 tile_height=256, mosaic_width=1024, detail_dimension=1600):
+        """
+        Args:
+            analysis_size (int): Lado más largo de la imagen sobre la que se buscan regiones
+            cell (int): Lado de cada celda de análisis, en píxeles de esa imagen
+            edge_threshold (int): Diferencia de brillo entre vecinos que cuenta como borde
+            min_edge_density (float): Proporción mínima de bordes en una celda candidata
+            min_bright_fraction (float): Proporción mínima de píxeles claros en una celda candidata
+            max_regions (int): Regiones que se incluyen en el mosaico
+            margin (float): Margen que se agrega alrededor de cada región, relativo a su tamaño
+            max_coverage (float): Si las regiones cubren más que esta parte de la foto, se usa la foto completa
+            tile_height (int): Alto de cada recorte dentro del mosaico
+            mosaic_width (int): Ancho máximo del mosaico
+            detail_dimension (int): Resolución mínima (lado más largo) a la que conviene decodificar
+                la foto para que los recortes conserven detalle
+        """
+        self.analysis_size = analysis_size
+        self.cell = cell
+        self.edge_threshold = edge_threshold
+        self.min_edge_density = min_edge_density
+        self.min_bright_fraction = min_bright_fraction
+        self.max_regions = max_regions
+        self.margin = margin
+        self.max_coverage = max_coverage
+        self.tile_height = tile_height
+        self.mosaic_width = mosaic_width
+        self.detail_dimension = detail_dimension
+
+    def _cell_scores(self, img):
+        """Devuelve el puntaje de cada celda y la escala de la imagen de análisis"""
+        escala = min(1.0, self.analysis_size / max(img.size))
+        tamano = (max(self.cell, round(img.width * escala)), max(self.cell, round(img.height * escala)))
+        # Reducir por un factor entero antes de pasar a grises es mucho más barato que al revés
+        factor = int(1 / escala)
+        reducida = img.reduce(factor) if factor > 1 else img
+        gris = np.asarray(reducida.convert('L').resize(tamano, Image.Resampling.BILINEAR), dtype=np.int16)
+
+        filas, columnas = gris.shape[0] // self.cell, gris.shape[1] // self.cell
+        gris = gris[:filas * self.cell, :columnas * self.cell]
+
+        # Bordes: diferencia con el vecino de la derecha o de abajo
+        bordes = np.zeros(gris.shape, dtype=bool)
+        bordes[:, :-1] |= np.abs(np.diff(gris, axis=1)) > self.edge_threshold
+        bordes[:-1, :] |= np.abs(np.diff(gris, axis=0)) > self.edge_threshold
+        # Claros respecto de la propia foto, para no depender de la exposición
+        histograma = np.cumsum(np.bincount(gris.ravel(), minlength=256))
+        claros = gris > np.searchsorted(histograma, 0.75 * histograma[-1])
+
+        def por_celda(mascara):
+            return mascara.reshape(filas, self.cell, columnas, self.cell).mean(axis=(1, 3))
+
+        densidad = por_celda(bordes)
+        claridad = por_celda(claros)
+        candidatas = (densidad >= self.min_edge_density) & (claridad >= self.min_bright_fraction)
+        return np.where(candidatas, densidad * claridad, 0.0), escala
+
+    @staticmethod
+    def _components(puntajes):
+        """Agrupa las celdas candidatas vecinas (8-conectividad) y devuelve (puntaje, caja en celdas)"""
+        filas, columnas = puntajes.shape
+        visitadas = np.zeros(puntajes.shape, dtype=bool)
+        componentes = []
+        for fila, columna in zip(*np.nonzero(puntajes)):
+            if visitadas[fila, columna]:
+                continue
+            visitadas[fila, columna] = True
+            pendientes = deque([(fila, columna)])
+            total, caja = 0.0, [columna, fila, columna, fila]
+            celdas = 0
+            while pendientes:
+                f, c = pendientes.popleft()
+                total += puntajes[f, c]
+                celdas += 1
+                caja = [min(caja[0], c), min(caja[1], f), max(caja[2], c), max(caja[3], f)]
+                for df in (-1, 0, 1):
+                    for dc in (-1, 0, 1):
+                        nf, nc = f + df, c + dc
+                        if 0 <= nf < filas and 0 <= nc < columnas and puntajes[nf, nc] and not visitadas[nf, nc]:
+                            visitadas[nf, nc] = True
+                            pendientes.append((nf, nc))
+            # Unas pocas celdas sueltas suelen ser ruido o un borde aislado
+            if celdas >= 4:
+                componentes.append((total, caja))
+        return componentes
+
+    def find_regions(self, img):
+        """
+        Busca las regiones que parecen dorsales.
+
+        Returns:
+            list: Cajas (x0, y0, x1, y1) en coordenadas de img, de la más a la menos probable
+        """
+        puntajes, escala = self._cell_scores(img)
+        componentes = sorted(self._components(puntajes), key=lambda c: c[0], reverse=True)
+
+        cajas = []
+        factor = self.cell / escala
+        for _, (c0, f0, c1, f1) in componentes[:self.max_regions]:
+            x0, y0, x1, y1 = c0 * factor, f0 * factor, (c1 + 1) * factor, (f1 + 1) * factor
+            mx, my = (x1 - x0) * self.margin, (y1 - y0) * self.margin
+            caja = (max(0, int(x0 - mx)), max(0, int(y0 - my)),
+                    min(img.width, int(x1 + mx)), min(img.height, int(y1 + my)))
+            cajas.append(caja)
+        return self._merge(cajas)
+
+    @staticmethod
+    def _merge(cajas):
+        """Une las cajas que se superponen, para no enviar dos veces el mismo dorsal"""
+        resultado = []
+        for caja in cajas:
+            for i, otra in enumerate(resultado):
+                if caja[0] < otra[2] and otra[0] < caja[2] and caja[1] < otra[3] and otra[1] < caja[3]:
+                    resultado[i] = (min(caja[0], otra[0]), min(caja[1], otra[1]),
+                                    max(caja[2], otra[2]), max(caja[3], otra[3]))
+                    break
+            else:
+                resultado.append(caja)
+        return resultado
+
+    def mosaic(self, img, cajas=None):
+        """
+        Arma un mosaico con los recortes de las regiones encontradas.
+
+        Returns:
+            tuple: (mosaico RGB o None si conviene enviar la foto completa, cajas usadas)
+        """
+        if cajas is None:
+            cajas = self.find_regions(img)
+        if not cajas:
+            return None, []
+        area = sum((x1 - x0) * (y1 - y0) for x0, y0, x1, y1 in cajas)
+        if area > self.max_coverage * img.width * img.height:
+            return None, cajas
+
+        separacion = 8
+        recortes = []
+        for caja in cajas:
+            recorte = img.crop(caja)
+            alto = min(self.tile_height, recorte.height)
+            ancho = min(self.mosaic_width, max(1, round(recorte.width * alto / recorte.height)))
+            recortes.append(recorte.resize((ancho, alto), Image.Resampling.LANCZOS))
+
+        # Estanterías: se llenan filas de izquierda a derecha hasta el ancho máximo
+        filas, fila, ancho_fila = [], [], 0
+        for recorte in recortes:
+            if fila and ancho_fila + separacion + recorte.width > self.mosaic_width:
+                filas.append(fila)
+                fila, ancho_fila = [], 0
+            ancho_fila += recorte.width + (separacion if fila else 0)
+            fila.append(recorte)
+        filas.append(fila)
+
+        ancho_total = max(sum(r.width for r in f) + separacion * (len(f) - 1) for f in filas)
+        alto_total = sum(max(r.height for r in f) for f in filas) + separacion * (len(filas) - 1)
+        lienzo = Image.new('RGB', (ancho_total, alto_total), (128, 128, 128))
+        y = 0
+        for f in filas:
+            x = 0
+            for recorte in f:
+                lienzo.paste(recorte, (x, y))
+                x += recorte.width + separacion
+            y += max(r.height for r in f) + separacion
+        return lienzo, cajas
@@ -0,0 +1,215 @@
+"""
+Procesamiento de lotes sin interfaz gráfica, para servidores junto a la GPU.
+
+Recorre una carpeta (opcionalmente de forma recursiva), reconoce los números de cada
+imagen con Ollama y escribe un resultado JSON por línea en la salida estándar o en
+un archivo. No importa Qt ni Tk.
+
+Con --vigilar, la carpeta se sigue vigilando y las fotos nuevas se procesan a medida
+que terminan de subirse.
+
+Uso:
+    python cli.py /ruta/fotos --recursivo --modelo llava:13b --concurrencia 8 > resultados.jsonl
+    python cli.py /ruta/subidas --vigilar --resultados resultados.jsonl
+    python cli.py /ruta/fotos --concurrencia-adaptativa > resultados.jsonl
+"""
+import os
+import sys
+import json
+import argparse
+import contextlib
+
+from image_processor import ImageProcessor
+from batch_processor import BatchProcessor, DEFAULT_MAX_IN_FLIGHT
+from result_cache import ResultCache
+from job_journal import JobJournal
+from dedup import DEFAULT_MAX_DISTANCE
+from bib_regions import BibRegionDetector
+from bib_index import BibIndex
+from folder_watcher import FolderWatcher
+from scanner import ImageScanner
+from export_stage import ExportStage
+from renditions import RENDITIONS, webp_available
+from results_store import ResultsStore, export_formats
+from concurrency import DEFAULT_MAX_LIMIT
+
+DEFAULT_MEDIA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'media')
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("carpeta", help="Carpeta con las imágenes a procesar")
+    parser.add_argument("-r", "--recursivo", action="store_true", help="Incluir las subcarpetas")
+    parser.add_argument("--incluir", nargs="+", metavar="PATRON",
+                        help="Procesar solo las imágenes que cumplen alguno de estos patrones (por ejemplo '*/fotografo_1/*')")
+    parser.add_argument("--excluir", nargs="+", metavar="PATRON",
+                        help="Omitir las imágenes o carpetas que cumplen alguno de estos patrones")
+    parser.add_argument("-m", "--modelo", default="llama3.2-vision", help="Modelo de Ollama a utilizar")
+    parser.add_argument("--ollama-url", nargs="+", default=["http://localhost:11434"],
+                        help="URL del servidor de Ollama; con varias URLs se reparten las solicitudes")
+    parser.add_argument("-s", "--salida", default=DEFAULT_MEDIA_DIR,
+                        help="Carpeta para las copias con marca de agua, la caché y el registro de avance")
+    parser.add_argument("--sin-copias", action="store_true", help="No generar las copias con marca de agua")
+    parser.add_argument("--exportar", nargs="+", choices=list(RENDITIONS), metavar="TAMANO",
+                        help="Generar además copias de entrega en <salida>/<tamaño> "
+                             f"({', '.join(RENDITIONS)}), en procesos aparte")
+    parser.add_argument("--webp", action="store_true", help="Guardar las copias de --exportar en WebP")
+    parser.add_argument("--procesos", type=int, help="Procesos para --exportar (por defecto, uno por núcleo)")
+    parser.add_argument("-c", "--concurrencia", type=int, default=DEFAULT_MAX_IN_FLIGHT,
+                        help="Solicitudes simultáneas a Ollama")
+    parser.add_argument("--concurrencia-adaptativa", type=int, nargs="?", const=DEFAULT_MAX_LIMIT, metavar="MAXIMO",
+                        help="Ajustar las solicitudes simultáneas según el primer token y el rendimiento "
+                             f"de Ollama, hasta MAXIMO (por defecto {DEFAULT_MAX_LIMIT}); reemplaza a --concurrencia")
+    parser.add_argument("-b", "--imagenes-por-solicitud", type=int, default=1,
+                        help="Imágenes por solicitud a Ollama (solo modelos que aceptan varias imágenes)")
+    parser.add_argument("--rafagas", type=int, nargs="?", const=DEFAULT_MAX_DISTANCE, metavar="DISTANCIA",
+                        help="Agrupar las fotos casi iguales y enviar solo la primera de cada grupo "
+                             f"(distancia de Hamming máxima entre huellas, por defecto {DEFAULT_MAX_DISTANCE})")
+    parser.add_argument("--verificar-rafagas", action="store_true",
+                        help="Enviar también la última foto de cada ráfaga y procesarla completa si no coincide")
+    parser.add_argument("--regiones", action="store_true",
+                        help="Enviar un mosaico con las zonas que parecen dorsales en lugar de la foto completa")
+    parser.add_argument("--max-tokens", type=int, default=64,
+                        help="Tokens máximos que genera el modelo por imagen (0 sin límite)")
+    parser.add_argument("--respuesta-completa", action="store_true",
+                        help="Leer toda la respuesta del modelo en lugar de cortarla después de la lista de números")
+    parser.add_argument("-o", "--resultados", help="Archivo JSONL para los resultados (por defecto, la salida estándar)")
+    parser.add_argument("--tabla", metavar="ARCHIVO",
+                        help=f"Exportar además la tabla de resultados al terminar ({', '.join(export_formats())})")
+    parser.add_argument("--no-cache", action="store_true", help="No usar la caché de resultados")
+    parser.add_argument("--invalidar-cache", action="store_true", help="Vaciar la caché antes de procesar")
+    parser.add_argument("--no-reanudar", action="store_true",
+                        help="Ignorar el registro de avance y procesar todas las imágenes")
+    parser.add_argument("--evento", help="Nombre del evento en el índice de dorsales (por defecto, el de la carpeta)")
+    parser.add_argument("--sin-indice", action="store_true", help="No actualizar el índice de dorsales")
+    parser.add_argument("--metricas", help="Guardar las métricas del lote (.json o .prom)")
+    parser.add_argument("--vigilar", action="store_true",
+                        help="Seguir vigilando la carpeta y procesar las fotos nuevas a medida que llegan")
+    parser.add_argument("--inactividad", type=float, metavar="SEGUNDOS",
+                        help="Con --vigilar, terminar tras estos segundos sin fotos nuevas")
+    parser.add_argument("--sondeo", action="store_true",
+                        help="Con --vigilar, consultar la carpeta periódicamente en lugar de usar inotify "
+                             "(para carpetas de red)")
+    args = parser.parse_args(argv)
+    if args.vigilar and args.rafagas is not None:
+        parser.error("--rafagas necesita la lista completa de fotos y no se puede usar con --vigilar")
+    if args.concurrencia_adaptativa is not None and args.concurrencia_adaptativa < 1:
+        parser.error("--concurrencia-adaptativa necesita un máximo de al menos 1")
+    if args.webp and not webp_available():
+        parser.error("Esta instalación de Pillow no admite WebP")
+    if args.tabla and os.path.splitext(args.tabla)[1].lower() not in export_formats():
+        parser.error(f"--tabla admite {', '.join(export_formats())}")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if not os.path.isdir(args.carpeta):
+        print(f"La carpeta {args.carpeta} no existe", file=sys.stderr)
+        return 2
+
+    os.makedirs(args.salida, exist_ok=True)
+    cache = None
+    if not args.no_cache:
+        cache = ResultCache(os.path.join(args.salida, '.cache_reconocimiento.sqlite3'))
+        if args.invalidar_cache:
+            cache.invalidate()
+
+    journal_path = JobJournal.path_for(args.salida, args.carpeta, args.modelo)
+    if args.no_reanudar and os.path.exists(journal_path):
+        os.remove(journal_path)
+    journal = JobJournal(journal_path)
+    index = None if args.sin_indice else BibIndex(BibIndex.path_for(args.salida))
+    evento = args.evento or os.path.basename(os.path.normpath(os.path.abspath(args.carpeta)))
+
+    concurrencia = args.concurrencia_adaptativa or args.concurrencia
+    processor = ImageProcessor(args.ollama_url, pool_size=concurrencia, cache=cache,
+                               regions=BibRegionDetector() if args.regiones else None,
+                               num_predict=args.max_tokens, stop_at_newline=not args.respuesta_completa)
+    batch = BatchProcessor(
+        processor,
+        args.modelo,
+        output_dir=None if args.sin_copias else args.salida,
+        max_in_flight=concurrencia,
+        journal=journal,
+        batch_size=args.imagenes_por_solicitud,
+        dedup_distance=args.rafagas,
+        verify_duplicates=args.verificar_rafagas,
+        index=index,
+        event=evento,
+        adaptive_concurrency=args.concurrencia_adaptativa is not None
+    )
+
+    salida = open(args.resultados, 'a', encoding='utf-8') if args.resultados else sys.stdout
+    errores = [0]
+    export = None
+    if args.exportar:
+        export = ExportStage(args.salida, args.exportar, workers=args.procesos, format="WEBP" if args.webp else None)
+
+    def on_result(clave, resultado):
+        if not resultado.get("success"):
+            errores[0] += 1
+        elif export is not None and resultado.get("numeros_encontrados"):
+            ruta = os.path.join(args.carpeta, clave)
+            nombre = processor.build_output_path(ruta, resultado["numeros_encontrados"], "", clave)
+            export.submit(ruta, os.path.splitext(nombre)[0])
+        linea = {"archivo": clave, "ruta": os.path.join(args.carpeta, clave)}
+        linea.update(resultado)
+        salida.write(json.dumps(linea, ensure_ascii=False) + "\n")
+        salida.flush()
+
+    watcher = None
+    if args.vigilar:
+        watcher = FolderWatcher(args.carpeta, recursive=args.recursivo, max_pending=args.concurrencia * 4,
+                                idle_timeout=args.inactividad, use_inotify=not args.sondeo,
+                                include=args.incluir, exclude=args.excluir)
+        items = watcher
+        print(f"Vigilando {args.carpeta}; Ctrl+C para terminar", file=sys.stderr)
+    else:
+        items = ImageScanner(args.carpeta, args.recursivo, include=args.incluir, exclude=args.excluir)
+
+    codigo = 0
+    try:
+        # Los avisos del procesador van a stderr para no mezclarse con los resultados JSONL
+        with contextlib.redirect_stdout(sys.stderr):
+            results = batch.run(items, on_result=on_result, results=ResultsStore())
+        print(f"Procesadas {len(results)} imágenes ({batch.resumed} del trabajo anterior, "
+              f"{errores[0]} con error)", file=sys.stderr)
+        if batch.concurrency is not None:
+            print(f"Límite de solicitudes simultáneas al terminar: {batch.concurrency.limit}", file=sys.stderr)
+        if export is not None:
+            print("Terminando las copias de entrega...", file=sys.stderr)
+            export.close()
+            print(f"Exportadas {export.exported} fotos ({export.errors} con error)", file=sys.stderr)
+        if args.tabla:
+            results.export(args.tabla)
+            print(f"Tabla de resultados guardada en {args.tabla}", file=sys.stderr)
+        # El trabajo terminó completo: la próxima ejecución empieza de cero. Al vigilar se
+        # conserva, para no reprocesar la carpeta cuando se vuelva a vigilar
+        if watcher is None:
+            journal.discard()
+        codigo = 1 if errores[0] else 0
+    except KeyboardInterrupt:
+        batch.cancel()
+        print("Proceso cancelado; se reanudará en la próxima ejecución", file=sys.stderr)
+        codigo = 130
+    finally:
+        if export is not None:
+            export.close(wait=False)
+        if watcher is not None:
+            watcher.stop()
+        journal.close()
+        if index is not None:
+            index.close()
+        processor.close()
+        if cache is not None:
+            cache.close()
+        if args.metricas:
+            batch.metrics.write(args.metricas)
+        if salida is not sys.stdout:
+            salida.close()
+    return codigo
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,281 @@
+"""
+Control adaptativo de las solicitudes simultáneas a Ollama.
+
+Ollama atiende una cantidad fija de solicitudes a la vez (OLLAMA_NUM_PARALLEL) y encola
+el resto. Mientras hay lugar, enviar más solicitudes aumenta el rendimiento; una vez
+lleno, solo alarga la cola: el rendimiento no cambia y el tiempo hasta el primer token
+crece con cada solicitud de más, hasta que aparecen los tiempos de espera agotados.
+
+AdaptiveConcurrency estima esa cola como en TCP Vegas. El menor tiempo hasta el primer
+token observado es el de una solicitud que no esperó; si la mediana reciente es mayor,
+la diferencia es espera, y por la ley de Little las solicitudes encoladas son
+
+    cola = límite * (1 - primer_token_base / primer_token_actual)
+
+Con poca cola el límite crece. Con más, el primer token no alcanza para decidir: en una
+GPU grande también tarda algo más con cada solicitud en paralelo aunque no haya cola.
+Por eso el límite se prueba un poco más arriba y un poco más abajo y se queda donde el
+rendimiento medido deja de mejorar. Una racha de errores o tiempos agotados reduce el
+límite de forma multiplicativa, como el AIMD de TCP.
+"""
+import math
+import time
+import threading
+import statistics
+
+# Límite mínimo y máximo por defecto del control adaptativo
+DEFAULT_MIN_LIMIT = 1
+DEFAULT_MAX_LIMIT = 64
+
+
+class Limiter:
+    """Semáforo cuyo tamaño se puede cambiar mientras hay hilos esperando"""
+
+    def __init__(self, size):
+        self._size = max(1, int(size))
+        self._in_use = 0
+        self._condition = threading.Condition()
+
+    @property
+    def size(self):
+        return self._size
+
+    @property
+    def in_use(self):
+        return self._in_use
+
+    def resize(self, size):
+        """Cambia el tamaño; si baja, los lugares en uso se liberan normalmente"""
+        with self._condition:
+            self._size = max(1, int(size))
+            self._condition.notify_all()
+
+    def acquire(self, timeout=None):
+        """Ocupa un lugar; devuelve False si no se liberó ninguno antes de timeout"""
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._in_use < self._size, timeout):
+                return False
+            self._in_use += 1
+            return True
+
+    def release(self):
+        with self._condition:
+            self._in_use -= 1
+            self._condition.notify()
+
+
+class AdaptiveConcurrency:
+    """
+    Elige el límite de solicitudes simultáneas a partir del primer token y el rendimiento.
+
+    Las decisiones se toman por ventana: cada 2 x límite solicitudes terminadas (al menos
+    MIN_WINDOW; en el arranque, una sola ronda) se calculan la mediana del primer token, la cola estimada y el rendimiento
+    (imágenes por segundo) de la ventana.
+
+    - Arranque: como en el arranque lento de TCP, el límite se duplica después de cada
+      ronda de solicitudes (una ventana de límite solicitudes, al menos MIN_START_WINDOW)
+      mientras el rendimiento suba y la cola no pase de la tolerada. Cuando aparece la
+      cola el límite se conserva; si la última duplicación no mejoró el rendimiento, se
+      vuelve al límite anterior.
+    - Después, cada PROBE_WINDOWS ventanas se prueba un límite un STEP mayor o menor:
+      hacia arriba si casi no hay cola y, si la hay, alternando. Una prueba hacia arriba
+      se conserva si el rendimiento mejoró más que TOLERANCE, y una hacia abajo si no
+      empeoró más que TOLERANCE; en ese caso se sigue en la misma dirección y, si no, se
+      vuelve al límite anterior. Así el límite queda donde agregar solicitudes ya no
+      rinde, aunque el primer token crezca por el trabajo en paralelo de la GPU y no por
+      la cola.
+    - Una ventana con bastantes más fallos que de costumbre multiplica el límite por
+      backoff, como el AIMD de TCP.
+    - Si el pipeline no llegó a ocupar el límite (la codificación no da abasto o el lote
+      se termina), la ventana no dice nada sobre el servidor y no se prueba nada.
+    """
+
+    # Solicitudes mínimas por ventana, después del arranque y durante el arranque
+    MIN_WINDOW = 5
+    MIN_START_WINDOW = 3
+    # Tamaño de las pruebas, como proporción del límite
+    STEP = 0.25
+    # Variación del rendimiento que se considera una mejora o una pérdida
+    TOLERANCE = 0.05
+    # Fallos por ventana, y proporción por encima de la habitual, que reducen el límite
+    MIN_ERRORS = 3
+    ERROR_TOLERANCE = 0.1
+    # Ventanas con el mismo límite antes de probar otro
+    PROBE_WINDOWS = 4
+
+    def __init__(self, initial=DEFAULT_MIN_LIMIT, minimum=DEFAULT_MIN_LIMIT, maximum=DEFAULT_MAX_LIMIT,
+                 backoff=0.7):
+        """
+        Args:
+            initial (int): Límite inicial; conviene empezar bajo para medir el primer token
+                sin cola
+            minimum (int): Límite mínimo
+            maximum (int): Límite máximo (el tamaño del grupo de hilos y de conexiones)
+            backoff (float): Factor que se aplica al límite cuando hay errores
+        """
+        self.minimum = max(1, int(minimum))
+        self.maximum = max(self.minimum, int(maximum))
+        self.backoff = backoff
+        self._limit = float(min(max(initial, self.minimum), self.maximum))
+        self.baseline = None
+        self.latency = None
+        self.throughput = None
+        self.queue = 0.0
+        self.windows = 0
+        self._starting = True
+        self._rate = None
+        self._probe = None
+        self._last_direction = 1
+        self._holding = 0
+        self._settling = 0
+        self._samples = []
+        self._completed = 0
+        self._errors = 0
+        self._error_rate = None
+        self._peak = 0
+        self._window_start = time.perf_counter()
+        self._lock = threading.Lock()
+
+    @property
+    def limit(self):
+        return int(self._limit)
+
+    def tolerated_queue(self):
+        """Solicitudes encoladas que se consideran normales; crece despacio con el límite, como en Vegas"""
+        return max(1.0, math.log10(self._limit) * 2)
+
+    def record(self, latency=None, ok=True, in_flight=None, now=None):
+        """
+        Registra una solicitud terminada y, si se completó la ventana, ajusta el límite.
+
+        Args:
+            latency (float, opcional): Segundos hasta el primer token, o None si no se midió
+            ok (bool): False si la solicitud falló o se agotó su tiempo de espera
+            in_flight (int, opcional): Solicitudes en curso al terminar esta, incluida
+            now (float, opcional): Momento de la medición (time.perf_counter())
+
+        Returns:
+            bool: True si el límite cambió
+        """
+        now = time.perf_counter() if now is None else now
+        with self._lock:
+            if self._settling > 0 and ok:
+                # Terminan las solicitudes enviadas con el límite anterior: todavía no
+                # reflejan el nuevo, y la ventana empieza cuando se terminan
+                self._settling -= 1
+                self._window_start = now
+                return False
+            self._completed += 1
+            if not ok:
+                self._errors += 1
+            elif latency is not None:
+                self._samples.append(latency)
+            if in_flight is not None:
+                self._peak = max(self._peak, in_flight)
+            if self._completed < self._window_size():
+                return False
+            anterior = self.limit
+            self._decide(now)
+            if self.limit != anterior:
+                # Las solicitudes en curso se enviaron con el límite anterior
+                self._settling = anterior
+            return self.limit != anterior
+
+    def _window_size(self):
+        """Solicitudes terminadas que hacen falta para decidir"""
+        if self._starting:
+            # En el arranque basta una ronda de solicitudes, como en el arranque lento de TCP
+            return max(self.MIN_START_WINDOW, self.limit)
+        return max(self.MIN_WINDOW, 2 * self.limit)
+
+    def _decide(self, now):
+        duracion = now - self._window_start
+        # Solo cuentan las solicitudes que respondieron: un límite que provoca errores rinde menos
+        rendimiento = (self._completed - self._errors) / duracion if duracion > 0 else None
+        self.throughput = rendimiento
+        self.windows += 1
+        muestras, errores, pico, completadas = self._samples, self._errors, self._peak, self._completed
+        proporcion = errores / completadas
+        self._samples, self._completed, self._errors, self._peak = [], 0, 0, 0
+        self._window_start = now
+
+        # Los fallos sueltos (un modelo que a veces responde 500) no indican saturación;
+        # sí una ventana con bastantes más fallos que de costumbre, más allá de la
+        # variación esperable en una ventana de ese tamaño
+        habituales = self._error_rate if self._error_rate is not None else proporcion
+        self._error_rate = proporcion if self._error_rate is None else 0.7 * self._error_rate + 0.3 * proporcion
+        variacion = 2 * math.sqrt(habituales * (1 - habituales) / completadas)
+        if errores >= self.MIN_ERRORS and proporcion > habituales + self.ERROR_TOLERANCE + variacion:
+            self._starting = False
+            self._probe = None
+            self._rate = None
+            self._holding = 0
+            self._set(self._limit * self.backoff)
+            return
+        if not muestras or rendimiento is None:
+            return
+        self.latency = statistics.median(muestras)
+        # La mediana por ventana, y no cada muestra, para que una respuesta suelta más
+        # rápida de lo normal no fije una base imposible de alcanzar
+        if self.baseline is None or self.latency < self.baseline:
+            self.baseline = self.latency
+        self.queue = self._limit * (1 - self.baseline / self.latency) if self.latency > 0 else 0.0
+        tolerada = self.tolerated_queue()
+
+        if pico and pico < self.limit:
+            # El pipeline no alcanzó a llenar el límite: se deshace la prueba en curso
+            if self._probe is not None:
+                self._set(self._probe[0])
+                self._probe = None
+            self._holding = 0
+            return
+
+        if self._starting:
+            anterior = self._rate
+            self._rate = rendimiento
+            creciendo = anterior is None or rendimiento > anterior * (1 + self.TOLERANCE)
+            if creciendo and self.queue <= tolerada and self._limit < self.maximum:
+                self._set(self._limit * 2)
+                return
+            self._starting = False
+            if anterior is not None and rendimiento < anterior * (1 + self.TOLERANCE):
+                # La última duplicación no rindió: solo agregó cola
+                self._set(self._limit / 2)
+                self._rate = anterior
+                return
+
+        if self._probe is not None:
+            anterior, tasa = self._probe
+            self._probe = None
+            subio = self._limit > anterior
+            # Hacia arriba se conserva si el rendimiento mejoró; hacia abajo, si no empeoró
+            if rendimiento > tasa * (1 + self.TOLERANCE if subio else 1 - self.TOLERANCE):
+                self._rate = rendimiento
+                if subio or self.queue > tolerada:
+                    self._try(1 if subio else -1)
+            else:
+                self._set(anterior)
+                self._rate = tasa
+            return
+
+        self._rate = rendimiento if self._rate is None else (self._rate + rendimiento) / 2
+        self._holding += 1
+        if self._holding < self.PROBE_WINDOWS:
+            return
+        # Con cola se alterna: el primer token también crece por el trabajo en paralelo,
+        # y solo el rendimiento de la prueba dice si sobran solicitudes
+        self._try(1 if self.queue < tolerada else -self._last_direction)
+
+    def _try(self, direccion):
+        """Prueba un límite un STEP mayor o menor durante la ventana siguiente"""
+        self._holding = 0
+        self._last_direction = direccion
+        paso = max(1.0, self._limit * self.STEP)
+        nuevo = min(max(self._limit + direccion * paso, self.minimum), self.maximum)
+        if nuevo == self._limit:
+            return
+        self._probe = (self._limit, self._rate)
+        self._limit = nuevo
+
+    def _set(self, limite):
+        self._limit = min(max(limite, self.minimum), self.maximum)
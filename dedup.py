@@ -0,0 +1,96 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+# Lado de la huella: HASH_SIZE x HASH_SIZE bits
+HASH_SIZE = 8
+# Distancia de Hamming máxima (sobre 64 bits) para considerar dos fotos casi iguales
+DEFAULT_MAX_DISTANCE = 10
+# Cada foto se compara con las siguientes en orden de nombre, donde quedan las ráfagas
+DEFAULT_WINDOW = 10
+
+
+def _thumbnail(path, hash_size=HASH_SIZE):
+    """Decodifica la imagen en escala de grises al tamaño de la huella (hash_size + 1 x hash_size)"""
+    with Image.open(path) as img:
+        # En los JPEG basta con decodificar a 1/8 de resolución
+        img.draft('L', (hash_size * 8, hash_size * 8))
+        img = img.convert('L').resize((hash_size + 1, hash_size), Image.Resampling.BOX)
+        return np.asarray(img, dtype=np.int16)
+
+
+def dhash_bits(paths, hash_size=HASH_SIZE, workers=None):
+    """
+    Calcula la huella por diferencias (dHash) de cada imagen.
+
+    Returns:
+        tuple: (matriz booleana de N x hash_size², lista con True para las imágenes
+            que se pudieron leer)
+    """
+    workers = workers or min(4, os.cpu_count() or 1)
+    miniaturas = np.zeros((len(paths), hash_size, hash_size + 1), dtype=np.int16)
+    validas = [False] * len(paths)
+
+    def leer(i):
+        try:
+            miniaturas[i] = _thumbnail(paths[i], hash_size)
+            validas[i] = True
+        except Exception as e:
+            print(f"No se pudo calcular la huella de {paths[i]}: {str(e)}")
+
+    with ThreadPoolExecutor(workers) as pool:
+        list(pool.map(leer, range(len(paths))))
+
+    # Un bit por par de píxeles vecinos: ¿el de la derecha es más claro?
+    bits = miniaturas[:, :, 1:] > miniaturas[:, :, :-1]
+    return bits.reshape(len(paths), -1), validas
+
+
+def _find(padres, i):
+    while padres[i] != i:
+        padres[i] = padres[padres[i]]
+        i = padres[i]
+    return i
+
+
+def find_duplicates(paths, max_distance=DEFAULT_MAX_DISTANCE, window=DEFAULT_WINDOW,
+                    hash_size=HASH_SIZE, workers=None):
+    """
+    Agrupa las fotos casi idénticas, como las de una ráfaga.
+
+    Las imágenes se ordenan por nombre y cada una se compara con las `window`
+    siguientes; las que están a distancia de Hamming <= max_distance quedan en el
+    mismo grupo (también de forma transitiva).
+
+    Args:
+        paths (list): Rutas de las imágenes
+        max_distance (int): Distancia máxima entre huellas, de 0 a hash_size²
+        window (int): Cantidad de imágenes siguientes con las que se compara cada una
+
+    Returns:
+        list: Grupos de índices de `paths`, en orden de nombre; los grupos de un solo
+            elemento son imágenes sin duplicados
+    """
+    n = len(paths)
+    if n == 0:
+        return []
+    orden = sorted(range(n), key=lambda i: paths[i])
+    bits, validas = dhash_bits([paths[i] for i in orden], hash_size, workers)
+    validas = np.array(validas)
+
+    padres = list(range(n))
+    for desplazamiento in range(1, min(window, n - 1) + 1):
+        # Distancias de todas las imágenes con la que está `desplazamiento` posiciones después
+        distancias = np.count_nonzero(bits[desplazamiento:] != bits[:-desplazamiento], axis=1)
+        cercanas = (distancias <= max_distance) & validas[desplazamiento:] & validas[:-desplazamiento]
+        for i in np.flatnonzero(cercanas):
+            a, b = _find(padres, i), _find(padres, i + desplazamiento)
+            if a != b:
+                padres[max(a, b)] = min(a, b)
+
+    grupos = {}
+    for posicion in range(n):
+        grupos.setdefault(_find(padres, posicion), []).append(orden[posicion])
+    return list(grupos.values())
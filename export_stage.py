@@ -0,0 +1,133 @@
+import os
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from watermark import WatermarkRenderer
+from renditions import RENDITIONS, EXTENSIONS, RenditionRenderer, rendition_options
+
+# Renderizador de cada proceso de exportación (las capas de marca de agua se reutilizan entre fotos)
+_renderer = None
+
+
+def _init_worker(max_layer_pixels):
+    global _renderer
+    # Fotos de la misma cámara comparten tamaño: conservar pocas capas, aunque sean grandes
+    _renderer = RenditionRenderer(WatermarkRenderer(max_entries=4, max_layer_pixels=max_layer_pixels))
+
+
+def _export_image(image_path, destinos, text, opacity):
+    """
+    Genera las copias de una foto en un proceso de exportación.
+
+    Solo viajan entre procesos las rutas y las opciones, no la imagen decodificada.
+
+    Returns:
+        dict: Segundos de decodificación y de cada copia
+    """
+    return _renderer.export(image_path, destinos, text, opacity)
+
+
+class ExportStage:
+    """
+    Genera las copias con marca de agua para la entrega en un grupo de procesos.
+
+    El reconocimiento solo necesita una copia chica; las copias de venta en alta
+    resolución se generan aparte, en tantos procesos como núcleos, fuera del GIL del
+    proceso principal. A cada proceso se le envía la ruta de la foto, no la imagen
+    decodificada; cada proceso genera todas las copias de la foto con RenditionRenderer y
+    las escribe de forma atómica en output_dir/<tamaño>/<nombre>.<extensión>.
+    """
+
+    def __init__(self, output_dir, presets=("web",), workers=None, text="COPIA", opacity=0.3,
+                 max_pending=None, max_layer_pixels=32_000_000, format=None):
+        """
+        Args:
+            output_dir (str): Carpeta base de las copias
+            presets (list): Nombres de RENDITIONS, o diccionario {nombre: opciones}
+            workers (int, opcional): Procesos de exportación; por defecto, uno por núcleo
+            text (str): Texto de la marca de agua
+            opacity (float): Opacidad de la marca de agua (0.0 a 1.0)
+            max_pending (int, opcional): Fotos encoladas como máximo; submit espera si se alcanza
+            max_layer_pixels (int): Tamaño máximo de las capas de marca de agua en caché por proceso
+            format (str, opcional): Formato de todas las copias ("JPEG", "WEBP" o "PNG"); por
+                defecto, el de cada copia
+        """
+        if not isinstance(presets, dict):
+            desconocidos = [p for p in presets if p not in RENDITIONS]
+            if desconocidos:
+                raise ValueError(f"Tamaños de exportación desconocidos: {', '.join(desconocidos)}")
+            presets = {p: RENDITIONS[p] for p in presets}
+        self.presets = {nombre: rendition_options(opciones, format) for nombre, opciones in presets.items()}
+        self.output_dir = output_dir
+        self.workers = workers or os.cpu_count() or 1
+        self.text = text
+        self.opacity = opacity
+        self.exported = 0
+        self.errors = 0
+        self._cupo = threading.Semaphore(max_pending or self.workers * 4)
+        self._lock = threading.Lock()
+        for nombre in self.presets:
+            os.makedirs(os.path.join(output_dir, nombre), exist_ok=True)
+        # spawn en lugar de fork: el proceso principal tiene hilos de red y de Pillow en curso
+        self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"),
+                                         initializer=_init_worker, initargs=(max_layer_pixels,))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def output_paths(self, name):
+        """Rutas de las copias de una foto, por tamaño"""
+        return {preset: os.path.join(self.output_dir, preset, f"{name}{EXTENSIONS[opciones['format']]}")
+                for preset, opciones in self.presets.items()}
+
+    def submit(self, image_path, name, overwrite=False):
+        """
+        Encola la exportación de una foto.
+
+        Args:
+            image_path (str): Ruta de la foto original
+            name (str): Nombre de las copias, sin extensión; puede incluir subcarpetas, que
+                se crean dentro de la carpeta de cada tamaño
+            overwrite (bool): Si es False y todas las copias ya existen (por ejemplo, al
+                reanudar un trabajo), no se vuelven a generar
+
+        Returns:
+            concurrent.futures.Future: Se resuelve con los tiempos de _export_image;
+                None si las copias ya existían
+        """
+        rutas = self.output_paths(name)
+        if not overwrite and all(os.path.exists(ruta) for ruta in rutas.values()):
+            return None
+        if os.path.dirname(name):
+            for ruta in rutas.values():
+                os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        self._cupo.acquire()
+        destinos = [(rutas[preset], opciones) for preset, opciones in self.presets.items()]
+        try:
+            futuro = self._pool.submit(_export_image, image_path, destinos, self.text, self.opacity)
+        except BaseException:
+            self._cupo.release()
+            raise
+        futuro.add_done_callback(lambda f: self._terminar(f, image_path))
+        return futuro
+
+    def _terminar(self, futuro, image_path):
+        self._cupo.release()
+        if futuro.cancelled():
+            return
+        error = futuro.exception()
+        with self._lock:
+            if error is None:
+                self.exported += 1
+            else:
+                self.errors += 1
+        if error is not None:
+            print(f"Error al exportar {image_path}: {str(error)}")
+
+    def close(self, wait=True):
+        """Espera las exportaciones pendientes (o las descarta si wait es False) y cierra los procesos"""
+        self._pool.shutdown(wait=wait, cancel_futures=not wait)
@@ -0,0 +1,332 @@
+import os
+import sys
+import time
+import queue
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+import threading
+
+from scanner import ImageScanner, IMAGE_EXTENSIONS
+
+# Constantes de inotify (linux/inotify.h)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+_EVENTO = struct.Struct("iIII")
+
+
+class _Inotify:
+    """Acceso mínimo a inotify mediante ctypes"""
+
+    MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE_SELF | IN_MOVE_SELF
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1")
+        self.watches = {}
+
+    def add(self, directorio):
+        wd = self._add_watch(self.fd, os.fsencode(directorio), self.MASK)
+        if wd < 0:
+            numero = ctypes.get_errno()
+            raise OSError(numero, os.strerror(numero), directorio)
+        self.watches[wd] = directorio
+
+    def read(self, timeout):
+        """Espera hasta timeout segundos y devuelve los eventos como (directorio, nombre, máscara)"""
+        listos, _, _ = select.select([self.fd], [], [], timeout)
+        if not listos:
+            return []
+        try:
+            datos = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        eventos = []
+        posicion = 0
+        while posicion + _EVENTO.size <= len(datos):
+            wd, mascara, _, largo = _EVENTO.unpack_from(datos, posicion)
+            posicion += _EVENTO.size
+            nombre = os.fsdecode(datos[posicion:posicion + largo].rstrip(b"\0"))
+            posicion += largo
+            if mascara & IN_IGNORED:
+                self.watches.pop(wd, None)
+                continue
+            eventos.append((self.watches.get(wd), nombre, mascara))
+        return eventos
+
+    def close(self):
+        os.close(self.fd)
+
+
+class FolderWatcher:
+    """
+    Vigila una carpeta y entrega las imágenes nuevas a medida que terminan de escribirse.
+
+    En Linux usa inotify: una foto está lista cuando se cierra después de escribirla o
+    cuando se mueve a la carpeta (como hacen los programas que suben a un archivo
+    temporal y lo renombran). En otros sistemas, en carpetas de red o si inotify no está
+    disponible, se consulta la carpeta periódicamente y una foto está lista cuando su
+    tamaño y fecha de modificación no cambian durante settle_time segundos.
+
+    Se itera como cualquier lista de imágenes, con tuplas (ruta relativa, ruta completa),
+    de modo que puede pasarse directamente a BatchProcessor.run. La cola interna está
+    acotada: si el procesamiento no da abasto, la detección espera en lugar de acumular
+    rutas en memoria.
+    """
+
+    def __init__(self, folder, recursive=False, extensions=IMAGE_EXTENSIONS, settle_time=2.0,
+                 poll_interval=1.0, max_pending=256, include_existing=True, idle_timeout=None,
+                 use_inotify=True, include=None, exclude=None):
+        """
+        Args:
+            folder (str): Carpeta a vigilar
+            recursive (bool): Incluir las subcarpetas, también las que se creen después
+            extensions (tuple): Extensiones de las imágenes, en minúsculas
+            settle_time (float): Segundos sin cambios para dar por terminada una foto
+                cuando no hay evento de cierre (consulta periódica y fotos existentes)
+            poll_interval (float): Segundos entre consultas de la carpeta
+            max_pending (int): Imágenes detectadas que pueden esperar a ser procesadas
+            include_existing (bool): Entregar también las imágenes que ya estaban en la carpeta
+            idle_timeout (float, opcional): Terminar tras estos segundos sin fotos nuevas
+            use_inotify (bool): Usar inotify si está disponible; False fuerza la consulta periódica
+            include (list, opcional): Patrones que deben cumplir las imágenes (como en ImageScanner)
+            exclude (list, opcional): Patrones de imágenes o carpetas que se omiten
+        """
+        self.folder = os.path.abspath(folder)
+        self.recursive = recursive
+        # Mismos criterios que el recorrido normal de la carpeta
+        self.scanner = ImageScanner(folder, recursive, include, exclude, extensions)
+        self.settle_time = settle_time
+        self.poll_interval = poll_interval
+        self.include_existing = include_existing
+        self.idle_timeout = idle_timeout
+        self.use_inotify = use_inotify
+        self.mode = None
+        # Imágenes detectadas (entregadas o en la cola); su cantidad sirve para el progreso
+        self.seen = 0
+        self._cola = queue.Queue(maxsize=max(1, int(max_pending)))
+        self._stop = threading.Event()
+        self._thread = None
+        self._entregadas = set()
+        # Candidatas a la espera de que dejen de cambiar: ruta -> (tamaño, mtime, desde)
+        self._candidatas = {}
+        # Consulta periódica: mtime de cada carpeta ya recorrida y sus subcarpetas
+        self._carpetas = {}
+        self._actividad = time.monotonic()
+
+    def start(self):
+        """Inicia la detección en segundo plano"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._vigilar, name="vigilar-carpeta", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        """Deja de buscar fotos nuevas; la iteración termina al entregar las ya detectadas"""
+        self._stop.set()
+
+    @property
+    def stopped(self):
+        return self._stop.is_set()
+
+    def __iter__(self):
+        self.start()
+        while True:
+            try:
+                ruta = self._cola.get(timeout=0.2)
+            except queue.Empty:
+                if self._stop.is_set() and not self._thread.is_alive():
+                    return
+                if (self.idle_timeout and not self._stop.is_set()
+                        and time.monotonic() - self._actividad >= self.idle_timeout):
+                    print(f"Sin fotos nuevas en {self.idle_timeout:.0f} s; se deja de vigilar {self.folder}")
+                    self.stop()
+                continue
+            yield os.path.relpath(ruta, self.folder), ruta
+
+    def _relativa(self, ruta):
+        return os.path.relpath(ruta, self.folder).replace(os.sep, '/')
+
+    def _es_imagen(self, ruta):
+        # Los archivos ocultos, que suelen ser temporales de la subida, también se descartan
+        return self.scanner.matches(self._relativa(ruta))
+
+    def _entregar(self, ruta):
+        """Pasa una foto terminada a la cola, esperando si está llena"""
+        if ruta in self._entregadas:
+            return
+        self._candidatas.pop(ruta, None)
+        self._entregadas.add(ruta)
+        self.seen += 1
+        self._actividad = time.monotonic()
+        while not self._stop.is_set():
+            try:
+                self._cola.put(ruta, timeout=0.2)
+                return
+            except queue.Full:
+                continue
+
+    def _candidata(self, ruta):
+        if ruta not in self._entregadas and ruta not in self._candidatas:
+            self._candidatas[ruta] = (None, None, time.monotonic())
+            self._actividad = time.monotonic()
+
+    def _revisar_candidatas(self):
+        """Entrega las candidatas cuyo tamaño y fecha no cambiaron en settle_time segundos"""
+        ahora = time.monotonic()
+        for ruta, (tamano, mtime, desde) in list(self._candidatas.items()):
+            if self._stop.is_set():
+                return
+            try:
+                st = os.stat(ruta)
+            except OSError:
+                # Se borró o se renombró antes de terminar
+                del self._candidatas[ruta]
+                continue
+            if (st.st_size, st.st_mtime_ns) != (tamano, mtime) or st.st_size == 0:
+                self._candidatas[ruta] = (st.st_size, st.st_mtime_ns, ahora)
+                self._actividad = ahora
+            elif ahora - desde >= self.settle_time:
+                self._entregar(ruta)
+
+    def _recorrer(self, directorio, nuevas=True, inotify=None):
+        """
+        Recorre una carpeta y marca como candidatas las imágenes no entregadas.
+
+        Las carpetas cuyo mtime no cambió desde el último recorrido no se vuelven a listar,
+        de modo que consultar un archivo de eventos con miles de fotos es barato.
+        """
+        pendientes = [directorio]
+        while pendientes:
+            actual = pendientes.pop()
+            try:
+                mtime = os.stat(actual).st_mtime_ns
+            except OSError:
+                self._carpetas.pop(actual, None)
+                continue
+            anterior = self._carpetas.get(actual)
+            if anterior is not None and anterior[0] == mtime:
+                pendientes.extend(anterior[1])
+                continue
+            subcarpetas = []
+            try:
+                with os.scandir(actual) as entradas:
+                    for entrada in sorted(entradas, key=lambda e: e.name):
+                        try:
+                            if entrada.is_dir(follow_symlinks=False):
+                                if self.recursive and not self.scanner.skip_dir(self._relativa(entrada.path)):
+                                    subcarpetas.append(entrada.path)
+                            elif entrada.path not in self._entregadas and self._es_imagen(entrada.path):
+                                if nuevas:
+                                    self._candidata(entrada.path)
+                                else:
+                                    self._entregadas.add(entrada.path)
+                        except OSError:
+                            continue
+            except OSError as e:
+                print(f"No se pudo leer la carpeta {actual}: {str(e)}")
+                continue
+            if inotify is not None:
+                for subcarpeta in subcarpetas:
+                    if subcarpeta not in self._carpetas:
+                        self._agregar_vigilancia(inotify, subcarpeta)
+            # Con sistemas de archivos de baja resolución, una carpeta modificada hace
+            # instantes puede volver a cambiar sin que cambie su mtime
+            if time.time_ns() - mtime > 2_000_000_000:
+                self._carpetas[actual] = (mtime, subcarpetas)
+            else:
+                self._carpetas.pop(actual, None)
+            pendientes.extend(subcarpetas)
+
+    def _agregar_vigilancia(self, inotify, directorio):
+        try:
+            inotify.add(directorio)
+        except OSError as e:
+            if e.errno == errno.ENOSPC:
+                print("Se alcanzó el límite de inotify (fs.inotify.max_user_watches); "
+                      "las subcarpetas restantes se consultan periódicamente")
+            else:
+                print(f"No se pudo vigilar la carpeta {directorio}: {str(e)}")
+
+    def _abrir_inotify(self):
+        if not self.use_inotify or not sys.platform.startswith("linux"):
+            return None
+        try:
+            inotify = _Inotify()
+            inotify.add(self.folder)
+            return inotify
+        except (OSError, AttributeError) as e:
+            print(f"inotify no disponible ({str(e)}); se consultará la carpeta periódicamente")
+            return None
+
+    def _vigilar(self):
+        inotify = self._abrir_inotify()
+        self.mode = "inotify" if inotify is not None else "consulta"
+        try:
+            # Las vigilancias se agregan antes del primer recorrido para no perder fotos
+            self._recorrer(self.folder, nuevas=self.include_existing, inotify=inotify)
+            ultimo_recorrido = time.monotonic()
+            while not self._stop.is_set():
+                if inotify is None:
+                    if self._stop.wait(self.poll_interval):
+                        break
+                    self._recorrer(self.folder)
+                else:
+                    for directorio, nombre, mascara in inotify.read(self.poll_interval):
+                        self._procesar_evento(inotify, directorio, nombre, mascara)
+                    # Las subcarpetas que no se pudieron vigilar se recorren de vez en cuando
+                    if time.monotonic() - ultimo_recorrido >= 30:
+                        self._recorrer(self.folder, inotify=inotify)
+                        ultimo_recorrido = time.monotonic()
+                self._revisar_candidatas()
+        except Exception as e:
+            print(f"Error al vigilar la carpeta {self.folder}: {str(e)}")
+        finally:
+            self._stop.set()
+            if inotify is not None:
+                inotify.close()
+
+    def _procesar_evento(self, inotify, directorio, nombre, mascara):
+        if mascara & IN_Q_OVERFLOW:
+            # Se perdieron eventos: recorrer todo de nuevo
+            print("Demasiados eventos de inotify; se vuelve a recorrer la carpeta")
+            self._carpetas.clear()
+            self._recorrer(self.folder, inotify=inotify)
+            return
+        if directorio is None:
+            return
+        if mascara & (IN_DELETE_SELF | IN_MOVE_SELF):
+            self._carpetas.pop(directorio, None)
+            if directorio == self.folder:
+                print(f"La carpeta {self.folder} se eliminó o se movió")
+                self._stop.set()
+            return
+        ruta = os.path.join(directorio, nombre)
+        if mascara & IN_ISDIR:
+            if (self.recursive and mascara & (IN_CREATE | IN_MOVED_TO)
+                    and not self.scanner.skip_dir(self._relativa(ruta))):
+                # Las fotos copiadas antes de vigilar la carpeta nueva se encuentran al recorrerla
+                self._agregar_vigilancia(inotify, ruta)
+                self._recorrer(ruta, inotify=inotify)
+            return
+        if not self._es_imagen(ruta):
+            return
+        if mascara & (IN_CLOSE_WRITE | IN_MOVED_TO):
+            self._entregar(ruta)
+        elif mascara & IN_CREATE:
+            # Si nunca llega el cierre (por ejemplo, un enlace), se entrega cuando deja de cambiar
+            self._candidata(ruta)
@@ -1,35 +1,276 @@
 import os
+import re
+import math
+import time
 import base64
 import json
 import requests
-import shutil
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from pathlib import Path
-from PIL import Image, ImageDraw, ImageFont, ImageEnhance
+from PIL import Image, ImageEnhance, ImageOps
+from watermark import WatermarkRenderer
+from renditions import atomic_save
+from backend_pool import BackendPool
 from io import BytesIO
 
+class ProcessingError(Exception):
+    """Error al procesar una imagen; el mensaje se devuelve tal cual en el resultado"""
+
+
+class ProcessingCancelled(ProcessingError):
+    """El procesamiento se canceló mientras se leía la respuesta del modelo"""
+
+
+class BackendError(ProcessingError):
+    """El servidor de Ollama no respondió o falló; la solicitud puede reintentarse en otro"""
+
+
+class BatchSplitError(ProcessingError):
+    """La respuesta a una solicitud con varias imágenes no se pudo separar por imagen"""
+
+
+class AnswerStream:
+    """
+    Acumula la respuesta del modelo a medida que llegan los tokens y decide cuándo está completa.
+    
+    Con stop_at_newline, la respuesta se da por terminada en la primera línea sin dígitos
+    que sigue a una línea con números: la lista ya terminó y lo que sigue suele ser texto
+    explicativo que no se usa. Las listas de varias líneas ("123,\\n456" o "1. 234\\n2. 567")
+    se leen hasta el final, y las líneas vacías no terminan la lista. Para no esperar el
+    final de una línea de texto larga, basta con PROSE_LENGTH caracteres sin dígitos.
+    """
+    
+    # Caracteres (sin contar espacios) de una línea sin dígitos que ya no continúa la lista
+    PROSE_LENGTH = 24
+    
+    def __init__(self, stop_at_newline=True, max_tokens=None):
+        self.stop_at_newline = stop_at_newline
+        self.max_tokens = max_tokens
+        self.partes = []
+        self.tokens = 0
+        self.completa = False
+        self._largo = 0
+        # Línea en curso: dónde empieza, si tiene dígitos y cuántos otros caracteres
+        self._inicio_linea = 0
+        self._linea_con_numeros = False
+        self._caracteres = 0
+        self._lista = False
+    
+    @property
+    def text(self):
+        return "".join(self.partes)
+    
+    def feed(self, token):
+        """
+        Agrega un token a la respuesta.
+        
+        Returns:
+            bool: True si la respuesta ya está completa y se puede cerrar la conexión
+        """
+        if self.completa:
+            return True
+        self.tokens += 1
+        if self.stop_at_newline:
+            for i, caracter in enumerate(token):
+                if caracter == "\n":
+                    if self._linea_con_numeros:
+                        self._lista = True
+                    elif self._lista and self._caracteres:
+                        return self._cortar(token)
+                    self._inicio_linea = self._largo + i + 1
+                    self._linea_con_numeros = False
+                    self._caracteres = 0
+                elif caracter.isdigit():
+                    self._linea_con_numeros = True
+                elif not caracter.isspace():
+                    self._caracteres += 1
+                    if self._lista and not self._linea_con_numeros and self._caracteres >= self.PROSE_LENGTH:
+                        return self._cortar(token)
+        self.partes.append(token)
+        self._largo += len(token)
+        if self.max_tokens is not None and self.tokens >= self.max_tokens:
+            self.completa = True
+        return self.completa
+    
+    def _cortar(self, token):
+        """Da la respuesta por terminada y descarta la línea en curso, que ya no es parte de la lista"""
+        texto = "".join(self.partes) + token
+        self.partes = [texto[:self._inicio_linea].rstrip()]
+        self.completa = True
+        return True
+
+
 class ImageProcessor:
-    def __init__(self, ollama_url="http://localhost:11434"):
-        self.ollama_url = ollama_url
+    # Prompt para el modelo
+    PROMPT = """Analiza esta imagen y encuentra todos los números visibles de los participantes del primer plano. 
+            No consideres números que estén en el segundo plano, ni números que estén desenfocados.
+            Responde solo con los números encontrados separados por comas."""
     
-    def encode_image_to_base64(self, image_path):
-        """Codifica una imagen a base64"""
+    # Prompt para varias imágenes en una misma solicitud
+    BATCH_PROMPT = """Recibirás {cantidad} imágenes numeradas de 1 a {cantidad} en el orden en que se envían.
+            En cada imagen encuentra todos los números visibles de los participantes del primer plano.
+            No consideres números que estén en el segundo plano, ni números que estén desenfocados.
+            Responde con exactamente una línea por imagen, con el formato "Imagen N: números separados por comas",
+            o "Imagen N: ninguno" si no hay números. No agregues nada más."""
+    
+    # Línea "Imagen N: ..." de la respuesta a varias imágenes
+    BATCH_LINE_PATTERN = re.compile(r'^[\s*_#>-]*imagen\s*(\d+)\s*[*_]*\s*[:.)\-–][\s*_]*(.*)$', re.IGNORECASE | re.MULTILINE)
+    
+    # Prompt cuando se buscan regiones: la imagen puede ser un mosaico de recortes o la foto completa
+    REGION_PROMPT = """La imagen es un mosaico de recortes de una foto de una carrera, separados por franjas grises, o la foto completa.
+            Encuentra todos los números de dorsal visibles de los participantes. Si es la foto completa, considera solo el primer plano.
+            No consideres números que estén desenfocados.
+            Responde solo con los números encontrados separados por comas."""
+    
+    # Escala de la copia con marca de agua respecto de la imagen original
+    OUTPUT_SCALE = 0.25
+    
+    def __init__(self, ollama_url="http://localhost:11434", pool_size=10, connect_timeout=5,
+                 read_timeout=120, max_retries=3, backoff_factor=0.5, cache=None,
+                 max_dimension=1024, resample=Image.Resampling.LANCZOS, jpeg_quality=75, fast_decode=True,
+                 regions=None, num_predict=64, stop_at_newline=True, stop_sequences=()):
+        """
+        Args:
+            ollama_url (str | list): URL del servidor de Ollama, o lista de URLs para repartir
+                las solicitudes entre varios servidores
+            pool_size (int): Conexiones abiertas que se reutilizan con cada servidor
+            connect_timeout (float): Segundos para establecer la conexión
+            read_timeout (float): Segundos máximos de espera entre datos de la respuesta
+            max_retries (int): Reintentos ante errores 5xx o conexiones reiniciadas
+            backoff_factor (float): Base del retroceso exponencial entre reintentos
+            cache (ResultCache, opcional): Caché de resultados para no repetir imágenes ya procesadas
+            max_dimension (int): Tamaño máximo, en píxeles, del lado más largo de la imagen enviada al modelo
+            resample: Filtro de Pillow para el redimensionado final
+            jpeg_quality (int): Calidad JPEG de la imagen enviada al modelo (1-100)
+            fast_decode (bool): Decodificar los JPEG a resolución reducida (modo draft)
+            regions (BibRegionDetector, opcional): Enviar al modelo un mosaico con las regiones
+                que parecen dorsales en lugar de la foto completa
+            num_predict (int): Tokens máximos que genera el modelo por imagen
+            stop_at_newline (bool): Cortar la respuesta en la primera línea sin números posterior
+                a la lista, en lugar de esperar el texto que el modelo agrega después
+            stop_sequences (tuple): Secuencias con las que Ollama deja de generar; no conviene
+                usar saltos de línea, porque algunos modelos los escriben antes de la lista
+        """
+        self.backends = BackendPool(ollama_url).start()
+        self.ollama_url = self.backends.backends[0].url
+        self.cache = cache
+        self.max_dimension = max_dimension
+        self.resample = resample
+        self.jpeg_quality = jpeg_quality
+        self.fast_decode = fast_decode
+        self.regions = regions
+        self.num_predict = num_predict
+        self.stop_at_newline = stop_at_newline
+        self.stop_sequences = list(stop_sequences)
+        # Con el mosaico de regiones cambia el prompt, y con él la clave de la caché
+        self.prompt = self.REGION_PROMPT if regions is not None else self.PROMPT
+        self.watermarks = WatermarkRenderer()
+        self.timeout = (connect_timeout, read_timeout)
+        self.session = self._create_session(pool_size, max_retries, backoff_factor, len(self.backends))
+    
+    def _create_session(self, pool_size, max_retries, backoff_factor, hosts=1):
+        """Crea una sesión HTTP con conexiones persistentes y reintentos"""
+        retry = Retry(
+            total=max_retries,
+            # Con varios servidores, una conexión rechazada pasa enseguida al siguiente
+            connect=max_retries if hosts == 1 else 0,
+            read=max_retries,
+            status=max_retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=(500, 502, 503, 504),
+            allowed_methods=None,  # Reintentar también los POST a /api/generate
+            raise_on_status=False
+        )
+        # La sesión y su grupo de conexiones se comparten entre los hilos del lote
+        adapter = HTTPAdapter(pool_connections=hosts, pool_maxsize=pool_size, max_retries=retry, pool_block=True)
+        session = requests.Session()
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+    
+    def close(self):
+        """Cierra las conexiones abiertas con Ollama"""
+        self.backends.close()
+        self.session.close()
+    
+    def decode_image(self, img, max_dimension):
+        """
+        Decodifica una imagen abierta a la menor resolución útil, con la orientación EXIF aplicada.
+        
+        En los JPEG se usa el modo draft: el decodificador reduce la imagen por 1/2, 1/4 u 1/8
+        en el dominio DCT, sin bajar de max_dimension en el lado más largo. Así no se
+        decodifica la imagen completa de la cámara para luego achicarla.
+        
+        Args:
+            img (PIL.Image.Image): Imagen recién abierta, todavía sin cargar
+            max_dimension (int): Tamaño que se necesita en el lado más largo
+            
+        Returns:
+            PIL.Image.Image: Imagen RGB orientada, de al menos max_dimension en su lado más largo
+        """
+        if self.fast_decode:
+            escala = max_dimension / max(img.size)
+            if escala < 1:
+                img.draft('RGB', (math.ceil(img.width * escala), math.ceil(img.height * escala)))
+        
+        # Rotar según la etiqueta Orientation (0x0112) de la cámara
+        if img.getexif().get(0x0112, 1) != 1:
+            img = ImageOps.exif_transpose(img)
+        
+        # Convertir a RGB si es necesario
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        return img
+    
+    def load_image(self, image_path, for_output=False):
+        """
+        Decodifica la imagen una sola vez, al tamaño que necesitan todas las etapas.
+        
+        Args:
+            image_path (str): Ruta de la imagen
+            for_output (bool): Si también se usará para la copia con marca de agua
+            
+        Returns:
+            tuple: (imagen RGB orientada, tamaño original orientado)
+        """
         with Image.open(image_path) as img:
-            # Convertir a RGB si es necesario
-            if img.mode != 'RGB':
-                img = img.convert('RGB')
+            ancho, alto = img.size
+            # Las orientaciones 5 a 8 intercambian ancho y alto
+            if img.getexif().get(0x0112, 1) in (5, 6, 7, 8):
+                ancho, alto = alto, ancho
             
-            # Redimensionar si es muy grande (máximo 1024px en el lado más largo)
-            max_size = (1024, 1024)
-            img.thumbnail(max_size, Image.Resampling.LANCZOS)
+            necesario = self.max_dimension
+            if self.regions is not None:
+                # Los recortes se toman de una imagen con más detalle que la que se envía completa
+                necesario = max(necesario, self.regions.detail_dimension)
+            if for_output:
+                necesario = max(necesario, int(max(ancho, alto) * self.OUTPUT_SCALE))
             
-            # Convertir a base64
-            buffered = BytesIO()
-            img.save(buffered, format="JPEG")
-            return base64.b64encode(buffered.getvalue()).decode('utf-8')
+            decoded = self.decode_image(img, necesario)
+            decoded.load()
+            return decoded, (ancho, alto)
+    
+    def encode_image(self, img):
+        """Codifica a base64 una imagen ya decodificada, reducida a max_dimension"""
+        # Redimensionar si es muy grande (máximo max_dimension en el lado más largo)
+        if max(img.size) > self.max_dimension:
+            escala = self.max_dimension / max(img.size)
+            nuevo_tamano = (max(1, round(img.width * escala)), max(1, round(img.height * escala)))
+            img = img.resize(nuevo_tamano, self.resample)
+        
+        # Convertir a base64
+        buffered = BytesIO()
+        img.save(buffered, format="JPEG", quality=self.jpeg_quality)
+        return base64.b64encode(buffered.getvalue()).decode('utf-8')
+    
+    def encode_image_to_base64(self, image_path):
+        """Codifica una imagen a base64"""
+        img, _ = self.load_image(image_path)
+        return self.encode_image(img)
     
     def extract_numbers(self, text):
         """Extrae números del texto de respuesta"""
-        import re
         # Buscar secuencias de dígitos
         numbers = re.findall(r'\d+', text)
         # Convertir a enteros y eliminar duplicados
@@ -48,204 +289,473 @@ class ImageProcessor:
             quality: Calidad de la imagen de salida (1-100)
         """
         try:
-            # Abrir la imagen
-            with Image.open(image_path) as img:
-                # Convertir a RGBA si es necesario
-                if img.mode != 'RGBA':
-                    img = img.convert('RGBA')
-                
-                # Redimensionar la imagen para hacerla más manejable (25% del tamaño original)
-                original_size = img.size
-                new_size = (int(original_size[0] * 0.25), int(original_size[1] * 0.25))
-                img = img.resize(new_size, Image.Resampling.LANCZOS)
-                
-                # Crear una capa para la marca de agua
-                watermark = Image.new('RGBA', img.size, (0, 0, 0, 0))
-                
-                # Configurar la fuente con un tamaño fijo más grande
-                try:
-                    # Tamaño base para la fuente (ajustar según sea necesario)
-                    base_font_size = max(24, int(min(img.size) / 15))
-                    font = ImageFont.truetype("arial.ttf", base_font_size)
-                except:
-                    # Si no se puede cargar la fuente, usar la predeterminada
-                    font = ImageFont.load_default()
-                
-                # Crear un dibujo temporal para calcular el tamaño del texto
-                temp_draw = ImageDraw.Draw(Image.new('RGBA', (1, 1)))
-                
-                # Usar textbbox para obtener las dimensiones del texto
-                bbox = temp_draw.textbbox((0, 0), text, font=font)
-                text_width = bbox[2] - bbox[0]
-                text_height = bbox[3] - bbox[1]
-                
-                # Espaciado entre marcas de agua
-                spacing_x = int(text_width * 3)  # Aumentar el espaciado
-                spacing_y = int(text_height * 3)
-                
-                # Crear un dibujo en la capa de marca de agua
-                draw = ImageDraw.Draw(watermark)
-                
-                # Dibujar la marca de agua en un patrón de tablero de ajedrez
-                for i in range(-spacing_x, img.width + spacing_x, spacing_x):
-                    for j in range(-spacing_y, img.height + spacing_y, spacing_y):
-                        # Posición con desplazamiento para filas impares
-                        x = i + ((j // spacing_y) % 2) * (spacing_x // 2)
-                        y = j
-                        
-                        # Dibujar el texto con borde para mejor visibilidad
-                        # Primero el borde
-                        border_opacity = int(255 * opacity * 0.7)  # Borde ligeramente más transparente
-                        for x_offset in [-2, 0, 2]:
-                            for y_offset in [-2, 0, 2]:
-                                if x_offset != 0 or y_offset != 0:  # No dibujar en la posición central
-                                    draw.text(
-                                        (x + x_offset, y + y_offset),
-                                        text,
-                                        font=font,
-                                        fill=(0, 0, 0, border_opacity)
-                                    )
-                        # Luego el texto principal
-                        draw.text(
-                            (x, y),
-                            text,
-                            font=font,
-                            fill=(255, 255, 255, int(255 * opacity))
-                        )
-                
-                # Rotar ligeramente la marca de agua (15 grados en lugar de 30)
-                watermark = watermark.rotate(15, resample=Image.BICUBIC, expand=False)
-                
-                # Combinar la imagen original con la marca de agua
-                result = Image.alpha_composite(img, watermark)
-                
-                # Convertir a RGB si es necesario para el formato de salida
-                if output_path.lower().endswith(('.jpg', '.jpeg')):
-                    result = result.convert('RGB')
-                
-                # Guardar la imagen con calidad reducida
-                result.save(output_path, quality=quality, optimize=True)
-                return True
+            img, original_size = self.load_image(image_path, for_output=True)
+            result = self.watermark_image(img, original_size, text, opacity)
+            self.write_output(result, output_path, quality)
+            return True
             
         except Exception as e:
             print(f"Error al agregar marca de agua: {str(e)}")
             return False
     
-    def process_image(self, image_path, model_name="llama3.2-vision", output_dir=None):
+    def watermark_image(self, img, original_size, text="COPIA", opacity=0.3):
         """
-        Procesa una imagen utilizando la API de Ollama para reconocer números.
+        Genera la copia con marca de agua a partir de una imagen ya decodificada.
         
         Args:
-            image_path (str): Ruta a la imagen a procesar
-            model_name (str): Nombre del modelo de Ollama a utilizar
-            output_dir (str, opcional): Directorio donde guardar la imagen procesada
+            img: Imagen decodificada (de al menos OUTPUT_SCALE del tamaño original)
+            original_size: Tamaño de la imagen original
+            text: Texto de la marca de agua
+            opacity: Opacidad de la marca de agua (0.0 a 1.0)
             
         Returns:
-            dict: Diccionario con los resultados del procesamiento
+            PIL.Image.Image: Imagen RGBA con la marca de agua
         """
+        # Redimensionar la imagen para hacerla más manejable (25% del tamaño original)
+        new_size = (max(1, int(original_size[0] * self.OUTPUT_SCALE)), max(1, int(original_size[1] * self.OUTPUT_SCALE)))
+        if img.size != new_size:
+            img = img.resize(new_size, Image.Resampling.LANCZOS)
+        
+        # Combinar la imagen con la capa de marca de agua (renderizada una vez por tamaño)
+        return self.watermarks.apply(img, text, opacity)
+    
+    def write_output(self, result, output_path, quality=85):
+        """Guarda la imagen de salida con calidad reducida, sin dejar archivos a medio escribir"""
+        # Convertir a RGB si es necesario para el formato de salida
+        if output_path.lower().endswith(('.jpg', '.jpeg')):
+            result = result.convert('RGB')
+        
+        atomic_save(result, output_path, quality=quality, optimize=True)
+    
+    def lookup_cache(self, image_path, model_name):
+        """
+        Busca el resultado de una imagen en la caché.
+        
+        Returns:
+            tuple: (clave_cache, (texto_completo, numeros_encontrados) o None).
+                La clave es None si no hay caché o no se pudo leer el archivo.
+        """
+        if self.cache is None:
+            return None, None
         try:
-            # Verificar que el archivo existe
-            if not os.path.exists(image_path):
-                return {"error": f"El archivo {image_path} no existe"}
-            
-            # Codificar la imagen a base64
+            clave = self.cache.make_key(image_path, model_name, self.prompt)
+            return clave, self.cache.get(clave)
+        except Exception as e:
+            print(f"Error al consultar la caché: {str(e)}")
+            return None, None
+    
+    def store_cache(self, clave_cache, model_name, texto_completo, numeros_encontrados):
+        """Guarda en la caché el resultado de una imagen"""
+        if self.cache is None or clave_cache is None:
+            return
+        try:
+            self.cache.put(clave_cache, model_name, texto_completo, numeros_encontrados)
+        except Exception as e:
+            print(f"Error al guardar en la caché: {str(e)}")
+    
+    def prepare_image(self, image_path, for_output=False, metricas=None):
+        """
+        Verifica que la imagen exista, la decodifica y la codifica para enviarla al modelo.
+        
+        Args:
+            for_output (bool): Decodificar también al tamaño de la copia con marca de agua
+            metricas (dict, opcional): Recibe los tiempos "decodificar", "regiones" y "codificar"
+                en segundos, y la cantidad de "dorsales_recortados" si se envía un mosaico
+        
+        Returns:
+            tuple: (imagen en base64, (imagen decodificada, tamaño original))
+        
+        Raises:
+            ProcessingError: Si el archivo no existe o no se puede codificar
+        """
+        if not os.path.exists(image_path):
+            raise ProcessingError(f"El archivo {image_path} no existe")
+        try:
+            inicio = time.perf_counter()
+            decoded = self.load_image(image_path, for_output)
+            decodificado = time.perf_counter()
+            enviar = decoded[0]
+            if self.regions is not None:
+                mosaico, cajas = self.regions.mosaic(enviar)
+                if mosaico is not None:
+                    enviar = mosaico
+                    if metricas is not None:
+                        metricas["dorsales_recortados"] = len(cajas)
+                if metricas is not None:
+                    metricas["regiones"] = time.perf_counter() - decodificado
+            codificacion = time.perf_counter()
+            image_base64 = self.encode_image(enviar)
+            if metricas is not None:
+                metricas["decodificar"] = decodificado - inicio
+                metricas["codificar"] = time.perf_counter() - codificacion
+            return image_base64, decoded
+        except Exception as e:
+            raise ProcessingError(f"Error al procesar la imagen: {str(e)}")
+    
+    def _generate(self, prompt, images_base64, model_name, cancel_event=None, metricas=None,
+                  stop_at_newline=None):
+        """
+        Envía el prompt y las imágenes a /api/generate y devuelve el texto de la respuesta.
+        
+        Si hay varios servidores, la solicitud va al que el grupo considera menos cargado;
+        cuando ese servidor falla, se reintenta en los demás antes de informar el error.
+        
+        Raises:
+            ProcessingError: Si la API responde con error o la respuesta no se puede leer
+        """
+        intentados = set()
+        while True:
+            backend = self.backends.acquire(exclude=intentados)
             try:
-                image_base64 = self.encode_image_to_base64(image_path)
-            except Exception as e:
-                return {"error": f"Error al procesar la imagen: {str(e)}"}
-            
-            # Preparar el prompt para el modelo
-            prompt = """Analiza esta imagen y encuentra todos los números visibles de los participantes del primer plano. 
-            No consideres números que estén en el segundo plano, ni números que estén desenfocados.
-            Responde solo con los números encontrados separados por comas."""
-            
-            # Hacer la solicitud a la API de Ollama
-            response = requests.post(
-                f"{self.ollama_url}/api/generate",
-                json={
-                    "model": model_name,
-                    "prompt": prompt,
-                    "images": [image_base64],
-                    "options": {
-                        "temperature": 0.1
-                    }
-                },
-                stream=True
+                texto, primer_token = self._generate_on(backend.url, prompt, images_base64, model_name,
+                                                        cancel_event, metricas, stop_at_newline)
+            except BackendError as e:
+                self.backends.release(backend, ok=False)
+                intentados.add(backend.url)
+                if len(intentados) >= len(self.backends):
+                    raise
+                print(f"{e}; se reintenta en otro servidor")
+                continue
+            except ProcessingError:
+                # El servidor respondió, pero rechazó la solicitud o se canceló la lectura
+                self.backends.release(backend, ok=None)
+                raise
+            self.backends.release(backend, latency=primer_token)
+            if metricas is not None and len(self.backends) > 1:
+                metricas["servidor"] = backend.url
+            return texto
+    
+    def generation_request(self, prompt, images_base64, model_name, stop_at_newline=None):
+        """
+        Arma el cuerpo de la solicitud a /api/generate y el AnswerStream que lee la respuesta.
+        
+        Se le pide a Ollama que no genere más de num_predict tokens por imagen y que corte
+        en las stop_sequences configuradas.
+        
+        Returns:
+            tuple: (cuerpo de la solicitud, AnswerStream)
+        """
+        if stop_at_newline is None:
+            stop_at_newline = self.stop_at_newline
+        max_tokens = self.num_predict * len(images_base64) if self.num_predict else None
+        opciones = {"temperature": 0.1}
+        if self.stop_sequences:
+            opciones["stop"] = self.stop_sequences
+        if max_tokens:
+            opciones["num_predict"] = max_tokens
+        cuerpo = {
+            "model": model_name,
+            "prompt": prompt,
+            "images": images_base64,
+            "options": opciones
+        }
+        return cuerpo, AnswerStream(stop_at_newline, max_tokens)
+    
+    def finish_generation(self, respuesta, inicio, primer_token=None, eval_count=None, metricas=None):
+        """
+        Registra en metricas los tiempos y los tokens de una solicitud terminada.
+        
+        Args:
+            respuesta (AnswerStream): Respuesta leída
+            inicio (float): Momento en que se envió la solicitud (time.perf_counter())
+            primer_token (float, opcional): Momento en que llegó el primer token
+            eval_count (int, opcional): Tokens generados según Ollama, si la respuesta terminó
+        
+        Returns:
+            tuple: (texto de la respuesta, segundos hasta el primer token)
+        """
+        fin = time.perf_counter()
+        if metricas is not None:
+            metricas["primer_token"] = (primer_token or fin) - inicio
+            metricas["solicitud"] = fin - inicio
+            metricas["tokens"] = eval_count if eval_count is not None else respuesta.tokens
+            if eval_count is None and respuesta.completa:
+                metricas["respuesta_cortada"] = 1
+        return respuesta.text, (primer_token or fin) - inicio
+    
+    def _generate_on(self, url, prompt, images_base64, model_name, cancel_event=None, metricas=None,
+                     stop_at_newline=None):
+        """
+        Realiza la solicitud en un servidor concreto.
+        
+        La respuesta se lee con AnswerStream; en cuanto está completa se cierra la conexión,
+        con lo que Ollama deja de generar.
+        
+        Returns:
+            tuple: (texto de la respuesta, segundos hasta el primer token)
+        """
+        cuerpo, respuesta = self.generation_request(prompt, images_base64, model_name, stop_at_newline)
+        
+        # Hacer la solicitud a la API de Ollama
+        inicio = time.perf_counter()
+        primer_token = None
+        eval_count = None
+        try:
+            response = self.session.post(
+                f"{url}/api/generate",
+                json=cuerpo,
+                stream=True,
+                timeout=self.timeout
             )
-            
+        except requests.Timeout as e:
+            raise BackendError(f"Tiempo de espera agotado con Ollama ({url}): {str(e)}")
+        except requests.ConnectionError as e:
+            raise BackendError(f"No se pudo conectar con Ollama ({url}): {str(e)}")
+        
+        with response:
             if response.status_code != 200:
-                return {"error": f"Error en la API de Ollama: {response.status_code} - {response.text}"}
+                error = BackendError if response.status_code >= 500 else ProcessingError
+                raise error(f"Error en la API de Ollama: {response.status_code} - {response.text}")
             
             # Procesar la respuesta
             try:
-                texto_completo = ""
-                
                 # Procesar cada línea de la respuesta
                 for line in response.iter_lines():
+                    if cancel_event is not None and cancel_event.is_set():
+                        raise ProcessingCancelled("Procesamiento cancelado")
                     if line:
                         try:
                             data = json.loads(line)
-                            if "response" in data:
-                                texto_completo += data["response"]
                         except json.JSONDecodeError:
                             continue
-                
-                # Extraer números del texto
-                numeros_encontrados = self.extract_numbers(texto_completo)
-                
-                # Procesar la salida si se especificó un directorio de salida
-                output_path = None
-                if output_dir and numeros_encontrados:
-                    try:
-                        # Crear directorio de salida si no existe
-                        os.makedirs(output_dir, exist_ok=True)
-                        
-                        # Obtener el nombre del archivo original sin extensión
-                        original_name = os.path.splitext(os.path.basename(image_path))[0]
-                        
-                        # Generar nombre de archivo con formato: nombre_original_nXX_nYY
-                        nums_str = "_n".join([""] + [str(num) for num in sorted(numeros_encontrados)]).lstrip("_")
-                        nombre_base = f"{original_name}_{nums_str}"
-                        extension = os.path.splitext(image_path)[1].lower()
-                        
-                        # Asegurar que la extensión sea compatible
-                        if extension not in ['.jpg', '.jpeg', '.png']:
-                            extension = '.jpg'
-                            
-                        output_filename = f"{nombre_base}{extension}"
-                        output_path = os.path.join(output_dir, output_filename)
-                        
-                        # Copiar la imagen original
-                        shutil.copy2(image_path, output_path)
-                        
-                        # Agregar marca de agua
-                        self.add_watermark(output_path, output_path)
-                        
-                    except Exception as e:
-                        print(f"Error al guardar la imagen procesada: {str(e)}")
-                
-                return {
-                    "success": True,
-                    "texto_original": texto_completo,
-                    "numeros_encontrados": numeros_encontrados,
-                    "mensaje": f"Se encontraron {len(numeros_encontrados)} números" if numeros_encontrados else "No se encontraron números",
-                    "output_path": output_path if output_dir and numeros_encontrados else None
-                }
-                
+                        if data.get("response"):
+                            if primer_token is None:
+                                primer_token = time.perf_counter()
+                            if respuesta.feed(data["response"]):
+                                # Al salir del bloque se cierra la conexión y Ollama deja de generar
+                                break
+                        if data.get("done"):
+                            eval_count = data.get("eval_count")
+                            break
+            except ProcessingCancelled:
+                raise
             except Exception as e:
-                return {"error": f"Error al procesar la respuesta: {str(e)}"}
+                raise BackendError(f"Error al procesar la respuesta: {str(e)}")
+        return self.finish_generation(respuesta, inicio, primer_token, eval_count, metricas)
+    
+    def recognize(self, image_base64, model_name="llama3.2-vision", cancel_event=None, metricas=None):
+        """
+        Envía una imagen codificada a la API de Ollama y extrae los números de la respuesta.
+        
+        Args:
+            image_base64 (str): Imagen codificada en base64
+            model_name (str): Nombre del modelo de Ollama a utilizar
+            cancel_event (threading.Event, opcional): Si se activa, se corta la lectura de la respuesta
+            metricas (dict, opcional): Recibe "primer_token", "solicitud" y "analisis" en segundos,
+                y la cantidad de "tokens" generados
+            
+        Returns:
+            tuple: (texto_completo, numeros_encontrados)
+            
+        Raises:
+            ProcessingError: Si la API responde con error o la respuesta no se puede procesar
+        """
+        texto_completo = self._generate(self.prompt, [image_base64], model_name, cancel_event, metricas)
+        
+        # Extraer números del texto
+        inicio = time.perf_counter()
+        numeros_encontrados = self.extract_numbers(texto_completo)
+        if metricas is not None:
+            metricas["analisis"] = time.perf_counter() - inicio
+        return texto_completo, numeros_encontrados
+    
+    def split_batch_answer(self, texto, cantidad):
+        """
+        Separa la respuesta de una solicitud con varias imágenes en el texto de cada una.
+        
+        Returns:
+            list: Texto de cada imagen en orden, o None si la respuesta no tiene
+                exactamente una línea "Imagen N: ..." por cada imagen
+        """
+        por_imagen = {}
+        for match in self.BATCH_LINE_PATTERN.finditer(texto):
+            indice = int(match.group(1))
+            if indice < 1 or indice > cantidad or indice in por_imagen:
+                return None
+            por_imagen[indice] = match.group(2).strip()
+        if len(por_imagen) != cantidad:
+            return None
+        return [por_imagen[i] for i in range(1, cantidad + 1)]
+    
+    def recognize_batch(self, images_base64, model_name="llama3.2-vision", cancel_event=None, metricas=None):
+        """
+        Reconoce los números de varias imágenes con una sola solicitud a Ollama.
+        
+        El prompt pide una línea por imagen; si el modelo no respeta ese formato,
+        se lanza BatchSplitError para que el llamador procese las imágenes por separado.
+        
+        Returns:
+            list: Tuplas (texto, numeros_encontrados), una por imagen y en el mismo orden
+            
+        Raises:
+            BatchSplitError: Si la respuesta no se puede separar por imagen
+            ProcessingError: Si la API responde con error
+        """
+        cantidad = len(images_base64)
+        prompt = self.BATCH_PROMPT.format(cantidad=cantidad)
+        # Cada imagen responde en su propia línea: no se corta después de la primera lista
+        texto_completo = self._generate(prompt, images_base64, model_name, cancel_event, metricas,
+                                        stop_at_newline=False)
+        
+        inicio = time.perf_counter()
+        textos = self.split_batch_answer(texto_completo, cantidad)
+        if textos is None:
+            raise BatchSplitError(f"No se pudo separar la respuesta por imagen: {texto_completo[:200]}")
+        # "Ninguno" o una línea vacía no aportan números
+        resultados = [(texto, self.extract_numbers(texto)) for texto in textos]
+        if metricas is not None:
+            metricas["analisis"] = time.perf_counter() - inicio
+        return resultados
+    
+    def build_output_path(self, image_path, numeros_encontrados, output_dir, relative_path=None):
+        """
+        Genera la ruta de salida con formato: nombre_original_nXX_nYY
+        
+        Args:
+            relative_path (str, opcional): Ruta de la imagen relativa a la carpeta del lote;
+                sus subcarpetas se repiten dentro de output_dir, para que dos fotos con el
+                mismo nombre en carpetas distintas no se pisen
+        """
+        # Obtener el nombre del archivo original sin extensión
+        original_name = os.path.splitext(os.path.basename(image_path))[0]
+        
+        nums_str = "_n".join([""] + [str(num) for num in sorted(numeros_encontrados)]).lstrip("_")
+        nombre_base = f"{original_name}_{nums_str}"
+        extension = os.path.splitext(image_path)[1].lower()
+        
+        # Asegurar que la extensión sea compatible
+        if extension not in ['.jpg', '.jpeg', '.png']:
+            extension = '.jpg'
+        
+        subcarpeta = os.path.dirname(os.path.normpath(relative_path)) if relative_path else ""
+        # Una clave fuera de la carpeta del lote no puede escribir fuera de output_dir
+        if os.path.isabs(subcarpeta) or subcarpeta.split(os.sep)[0] == os.pardir:
+            subcarpeta = ""
+            
+        return os.path.join(output_dir, subcarpeta, f"{nombre_base}{extension}")
+    
+    def save_output(self, image_path, numeros_encontrados, output_dir, overwrite=True, decoded=None, metricas=None,
+                    relative_path=None):
+        """
+        Guarda una copia con marca de agua de la imagen si se encontraron números.
+        
+        Args:
+            relative_path (str, opcional): Ruta relativa de la imagen en el lote, ver build_output_path
+            overwrite (bool): Si es False y la imagen de salida ya existe, se reutiliza
+            decoded (tuple, opcional): (imagen, tamaño original) devuelto por prepare_image,
+                para no volver a decodificar el archivo
+            metricas (dict, opcional): Recibe "marca_agua" y "escritura" en segundos
+        
+        Returns:
+            str: Ruta de la imagen guardada, o None si no se guardó nada
+        """
+        if not output_dir or not numeros_encontrados:
+            return None
+        try:
+            output_path = self.build_output_path(image_path, numeros_encontrados, output_dir, relative_path)
+            # Crear directorio de salida si no existe
+            os.makedirs(os.path.dirname(output_path), exist_ok=True)
+            if not overwrite and os.path.exists(output_path):
+                return output_path
+            
+            # Generar la copia con marca de agua directamente en la ruta de salida
+            inicio = time.perf_counter()
+            if decoded is None:
+                decoded = self.load_image(image_path, for_output=True)
+            img, original_size = decoded
+            resultado = self.watermark_image(img, original_size)
+            marcado = time.perf_counter()
+            self.write_output(resultado, output_path)
+            if metricas is not None:
+                metricas["marca_agua"] = marcado - inicio
+                metricas["escritura"] = time.perf_counter() - marcado
+            return output_path
+            
+        except Exception as e:
+            print(f"Error al guardar la imagen procesada: {str(e)}")
+            return None
+    
+    def build_result(self, texto_completo, numeros_encontrados, output_path=None, desde_cache=False, metricas=None):
+        """Arma el diccionario de resultado de una imagen procesada"""
+        return {
+            "success": True,
+            "texto_original": texto_completo,
+            "numeros_encontrados": numeros_encontrados,
+            "mensaje": f"Se encontraron {len(numeros_encontrados)} números" if numeros_encontrados else "No se encontraron números",
+            "output_path": output_path,
+            "desde_cache": desde_cache,
+            "metricas": metricas or {}
+        }
+    
+    def process_image(self, image_path, model_name="llama3.2-vision", output_dir=None):
+        """
+        Procesa una imagen utilizando la API de Ollama para reconocer números.
+        
+        Args:
+            image_path (str): Ruta a la imagen a procesar
+            model_name (str): Nombre del modelo de Ollama a utilizar
+            output_dir (str, opcional): Directorio donde guardar la imagen procesada
+            
+        Returns:
+            dict: Diccionario con los resultados del procesamiento
+        """
+        inicio = time.perf_counter()
+        metricas = {}
+        try:
+            # Reutilizar el resultado si la imagen ya se procesó con el mismo modelo
+            clave_cache, cacheado = None, None
+            if os.path.exists(image_path):
+                clave_cache, cacheado = self.lookup_cache(image_path, model_name)
+            
+            if cacheado is not None:
+                texto_completo, numeros_encontrados = cacheado
+            else:
+                # Decodificar la imagen una sola vez y codificarla a base64
+                image_base64, decoded = self.prepare_image(image_path, for_output=bool(output_dir), metricas=metricas)
                 
+                # Reconocer los números con el modelo
+                texto_completo, numeros_encontrados = self.recognize(image_base64, model_name, metricas=metricas)
+                self.store_cache(clave_cache, model_name, texto_completo, numeros_encontrados)
+            
+            # Procesar la salida si se especificó un directorio de salida
+            output_path = self.save_output(
+                image_path, numeros_encontrados, output_dir, overwrite=cacheado is None,
+                decoded=decoded if cacheado is None else None, metricas=metricas
+            )
+            
+            metricas["total"] = time.perf_counter() - inicio
+            return self.build_result(texto_completo, numeros_encontrados, output_path, cacheado is not None, metricas)
+            
+        except ProcessingError as e:
+            return {"error": str(e)}
         except Exception as e:
             return {"error": f"Error inesperado: {str(e)}"}
 
 
 # Para pruebas locales
 if __name__ == "__main__":
-    import sys
-    if len(sys.argv) > 1:
-        processor = ImageProcessor()
-        result = processor.process_image(sys.argv[1])
+    import argparse
+    from result_cache import ResultCache
+    
+    parser = argparse.ArgumentParser(description="Reconoce los números de una imagen con Ollama")
+    parser.add_argument("imagen", nargs="?", help="Ruta a la imagen a procesar")
+    parser.add_argument("--modelo", default="llama3.2-vision", help="Modelo de Ollama a utilizar")
+    parser.add_argument("--cache", default=os.path.join("media", ".cache_reconocimiento.sqlite3"),
+                        help="Archivo de la caché de resultados")
+    parser.add_argument("--no-cache", action="store_true", help="No usar la caché de resultados")
+    parser.add_argument("--invalidar-cache", action="store_true", help="Vaciar la caché antes de procesar")
+    args = parser.parse_args()
+    
+    cache = None if args.no_cache else ResultCache(args.cache)
+    if cache is not None and args.invalidar_cache:
+        cache.invalidate()
+        print("Caché de resultados vaciada")
+    
+    if args.imagen:
+        processor = ImageProcessor(cache=cache)
+        result = processor.process_image(args.imagen, args.modelo)
+        processor.close()
         print("Resultado del reconocimiento:")
         print(result)
-    else:
+    elif not args.invalidar_cache:
         print("Por favor, proporciona la ruta a una imagen como argumento")
@@ -0,0 +1,107 @@
+import os
+import json
+import time
+import hashlib
+
+
+class JobJournal:
+    """
+    Registro de avance de un lote, en formato JSONL y solo de escritura al final.
+
+    Cada imagen terminada agrega una línea con su resultado. Si la aplicación u Ollama
+    se caen, al reiniciar el mismo trabajo se leen estas líneas y se omiten las imágenes
+    que ya se procesaron correctamente. Una línea incompleta por un corte se descarta.
+    """
+
+    def __init__(self, path, fsync_interval=1.0):
+        """
+        Args:
+            path (str): Ruta del archivo JSONL del trabajo
+            fsync_interval (float): Segundos mínimos entre sincronizaciones con el disco
+        """
+        self.path = path
+        self.fsync_interval = fsync_interval
+        self.entries = self._load()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._file = open(path, 'a', encoding='utf-8')
+        # Si el último registro quedó cortado, empezar en una línea nueva
+        if self._file.tell() > 0 and not self._ends_with_newline():
+            self._file.write("\n")
+            self._file.flush()
+        self._last_sync = time.monotonic()
+
+    @staticmethod
+    def path_for(media_dir, folder_path, model_name):
+        """Ruta del registro para una carpeta y un modelo dentro de la carpeta media"""
+        trabajo = hashlib.sha1(f"{os.path.abspath(folder_path)}\0{model_name}".encode('utf-8')).hexdigest()[:16]
+        return os.path.join(media_dir, '.trabajos', f"{trabajo}.jsonl")
+
+    def _ends_with_newline(self):
+        with open(self.path, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b"\n"
+
+    def _load(self):
+        """Lee los registros existentes; el último registro de cada imagen es el válido"""
+        entries = {}
+        if not os.path.exists(self.path):
+            return entries
+        with open(self.path, 'r', encoding='utf-8', errors='replace') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                    entries[entry["clave"]] = entry
+                except (json.JSONDecodeError, KeyError, TypeError):
+                    # Línea incompleta por un corte durante la escritura
+                    continue
+        return entries
+
+    @staticmethod
+    def _file_signature(ruta):
+        info = os.stat(ruta)
+        return info.st_size, info.st_mtime_ns
+
+    def completed_result(self, clave, ruta):
+        """
+        Devuelve el resultado guardado si la imagen ya se procesó correctamente
+        y no cambió desde entonces; en otro caso None.
+        """
+        entry = self.entries.get(clave)
+        if not entry or not entry["resultado"].get("success"):
+            return None
+        try:
+            if list(self._file_signature(ruta)) != entry["firma"]:
+                return None
+        except OSError:
+            return None
+        return entry["resultado"]
+
+    def record(self, clave, ruta, resultado):
+        """Agrega el resultado de una imagen al registro"""
+        try:
+            firma = list(self._file_signature(ruta))
+        except (OSError, TypeError):
+            firma = None
+        entry = {"clave": clave, "ruta": ruta, "firma": firma, "resultado": resultado}
+        self.entries[clave] = entry
+        # Una sola escritura por línea; el flush la deja en el sistema operativo
+        self._file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self._file.flush()
+        ahora = time.monotonic()
+        if ahora - self._last_sync >= self.fsync_interval:
+            os.fsync(self._file.fileno())
+            self._last_sync = ahora
+
+    def close(self):
+        if not self._file.closed:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+
+    def discard(self):
+        """Cierra y elimina el registro, una vez que el trabajo terminó completo"""
+        self.close()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
@@ -2,78 +2,264 @@ import sys
 import os
 from PyQt6.QtWidgets import (QApplication, QMainWindow, QPushButton, QVBoxLayout, 
                            QWidget, QLabel, QFileDialog, QProgressBar, QMessageBox,
-                           QTextEdit, QHBoxLayout, QComboBox)
-from PyQt6.QtCore import Qt, QThread, pyqtSignal
-from PyQt6.QtGui import QPixmap, QIcon
+                           QPlainTextEdit, QHBoxLayout, QComboBox, QSpinBox, QCheckBox,
+                           QTableView, QHeaderView, QLineEdit, QAbstractItemView)
+from PyQt6.QtCore import Qt, QThread, pyqtSignal, QAbstractTableModel, QModelIndex, QTimer
+from PyQt6.QtGui import QPixmap, QIcon, QColor
 from image_processor import ImageProcessor
+from batch_processor import BatchProcessor, DEFAULT_MAX_IN_FLIGHT
+from result_cache import ResultCache
+from job_journal import JobJournal
+from dedup import DEFAULT_MAX_DISTANCE
+from concurrency import DEFAULT_MAX_LIMIT
+from bib_index import BibIndex
+from folder_watcher import FolderWatcher
+from scanner import ImageScanner
+from results_store import ResultsStore, ResultsView, export_formats
+from collections import deque
 import json
 
+# Filas que la tabla de resultados agrega cada vez que la vista llega al final
+FETCH_BATCH = 500
+# Líneas que conserva el registro; las más viejas se descartan
+MAX_LOG_LINES = 5000
+# Mensajes que se acumulan entre dos actualizaciones del registro; si llegan más, se omiten los más viejos
+MAX_PENDING_LOG = 500
+# Milisegundos entre actualizaciones del registro y de la tabla
+REFRESH_INTERVAL_MS = 200
+
 class ImageProcessingThread(QThread):
     progress_updated = pyqtSignal(int)
-    processing_finished = pyqtSignal(dict)
+    processing_finished = pyqtSignal(object)
     log_message = pyqtSignal(str)
     
-    def __init__(self, folder_path, model_name):
+    def __init__(self, folder_path, model_name, max_in_flight=DEFAULT_MAX_IN_FLIGHT, use_cache=True,
+                 group_bursts=False, watch=False, recursive=True, adaptive_concurrency=False):
         super().__init__()
         self.folder_path = folder_path
         self.model_name = model_name
-        self.processor = ImageProcessor()
+        # Con el límite adaptativo, max_in_flight es solo el máximo: el lote elige cuántas enviar
+        if adaptive_concurrency:
+            max_in_flight = DEFAULT_MAX_LIMIT
+        # Al vigilar, las fotos nuevas se procesan a medida que terminan de subirse
+        self.watcher = FolderWatcher(folder_path, recursive, max_pending=max_in_flight * 4) if watch else None
+        # Recorrido de la carpeta (y subcarpetas) que alimenta el pipeline mientras avanza
+        self.scanner = ImageScanner(folder_path, recursive)
+        # Tabla compacta de resultados: la ventana la recibe al terminar para mostrarla y exportarla
+        self.results = ResultsStore()
         # Crear carpeta media si no existe
         self.media_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'media')
         os.makedirs(self.media_dir, exist_ok=True)
+        # Caché de resultados para no reenviar a Ollama las imágenes ya procesadas
+        self.cache = ResultCache(os.path.join(self.media_dir, '.cache_reconocimiento.sqlite3')) if use_cache else None
+        # Una conexión por cada solicitud simultánea
+        self.processor = ImageProcessor(pool_size=max_in_flight, cache=self.cache)
+        # Registro de avance para reanudar el trabajo si se interrumpe
+        self.journal = JobJournal(JobJournal.path_for(self.media_dir, folder_path, model_name))
+        # Índice de dorsales para buscar las fotos de cada corredor; el evento es la carpeta
+        self.index = BibIndex(BibIndex.path_for(self.media_dir))
+        self.batch = BatchProcessor(
+            self.processor,
+            model_name,
+            output_dir=self.media_dir,
+            max_in_flight=max_in_flight,
+            journal=self.journal,
+            # Las fotos de una ráfaga reciben los números de la primera, confirmados con la última;
+            # al vigilar no se conoce la lista completa, así que no se agrupan
+            dedup_distance=DEFAULT_MAX_DISTANCE if group_bursts and not watch else None,
+            verify_duplicates=True,
+            index=self.index,
+            event=os.path.basename(os.path.normpath(folder_path)),
+            adaptive_concurrency=adaptive_concurrency
+        )
         
     def run(self):
         try:
-            results = {}
-            image_files = [f for f in os.listdir(self.folder_path) 
-                         if f.lower().endswith(('.png', '.jpg', '.jpeg', '.bmp', '.gif'))]
+            self.processed_images = 0
+            if self.watcher is not None:
+                self.total_images = 0
+                items = self.watcher
+                self.log_message.emit(f"Vigilando {self.folder_path}: las fotos nuevas se procesan al terminar de subirse")
+            else:
+                # El conteo corre en paralelo: el procesamiento empieza con la primera imagen
+                self.scanner.count_in_background()
+                self.total_images = 0
+                items = self.scanner
+                self.log_message.emit(f"Buscando imágenes en {self.folder_path}...")
+            if self.journal.entries:
+                self.log_message.emit("Reanudando el trabajo anterior: se omitirán las imágenes ya procesadas")
             
-            total_images = len(image_files)
-            self.log_message.emit(f"Encontradas {total_images} imágenes para procesar")
-            
-            for idx, image_file in enumerate(image_files, 1):
-                if self.isInterruptionRequested():
-                    self.log_message.emit("Proceso cancelado por el usuario")
-                    return
-                    
-                image_path = os.path.join(self.folder_path, image_file)
-                self.log_message.emit(f"Procesando: {image_file}...")
-                
-                try:
-                    # Procesar la imagen guardando en la carpeta media
-                    result = self.processor.process_image(
-                        image_path, 
-                        self.model_name,
-                        output_dir=self.media_dir
-                    )
-                    results[image_file] = result
-                    
-                    if isinstance(result, dict) and result.get('success', False):
-                        nums = result.get('numeros_encontrados', [])
-                        if nums:
-                            output_file = os.path.basename(result.get('output_path', ''))
-                            self.log_message.emit(f"  - Números encontrados: {', '.join(map(str, nums))}")
-                            if output_file:
-                                self.log_message.emit(f"  - Imagen guardada como: {output_file}")
-                        else:
-                            self.log_message.emit("  - No se encontraron números")
-                    else:
-                        error_msg = result.get('error', 'Error desconocido') if isinstance(result, dict) else str(result)
-                        self.log_message.emit(f"  - Error: {error_msg}")
-                        
-                except Exception as e:
-                    error_msg = f"Error inesperado: {str(e)}"
-                    results[image_file] = {"success": False, "error": error_msg}
-                    self.log_message.emit(f"  - {error_msg}")
-                
-                progress = int((idx / total_images) * 100)
-                self.progress_updated.emit(progress)
+            results = self.batch.run(
+                items,
+                on_start=self.report_start,
+                on_result=self.report_result,
+                should_stop=self.isInterruptionRequested,
+                results=self.results
+            )
             
+            if self.batch.cancelled:
+                self.log_message.emit("Proceso cancelado por el usuario")
+                return
+
+            if self.batch.resumed:
+                self.log_message.emit(f"{self.batch.resumed} imágenes recuperadas del trabajo anterior")
+            if self.batch.concurrency is not None:
+                self.log_message.emit(f"Límite de solicitudes simultáneas al terminar: {self.batch.concurrency.limit}")
+            duplicadas = results.duplicate_count
+            if duplicadas:
+                self.log_message.emit(f"{duplicadas} imágenes resueltas con otra foto de su ráfaga")
+            self.report_metrics()
+            # El trabajo terminó completo: la próxima ejecución empieza de cero. Al vigilar se
+            # conserva, para no reprocesar la carpeta cuando se vuelva a vigilar
+            if self.watcher is None:
+                self.journal.discard()
             self.processing_finished.emit(results)
             
         except Exception as e:
             self.log_message.emit(f"Error en el procesamiento: {str(e)}")
-            self.processing_finished.emit({"error": f"Error en el procesamiento: {str(e)}"})
+            # Se entregan los resultados parciales para poder exportarlos
+            self.processing_finished.emit(self.results)
+        finally:
+            if self.watcher is not None:
+                self.watcher.stop()
+            self.journal.close()
+            self.index.close()
+            self.processor.close()
+            if self.cache is not None:
+                self.cache.close()
+    
+    def stop_watching(self):
+        """Deja de esperar fotos nuevas; las ya detectadas terminan de procesarse"""
+        if self.watcher is not None:
+            self.watcher.stop()
+    
+    def report_metrics(self):
+        """Registra un resumen de rendimiento y guarda las métricas del trabajo en la carpeta media"""
+        resumen = self.batch.metrics.summary()
+        etapas = resumen["histogramas"]
+        primer_token = etapas.get('etapa_duracion_segundos{etapa="primer_token"}')
+        mensaje = f"Rendimiento: {resumen['imagenes_por_segundo']:.2f} imágenes/s"
+        if primer_token:
+            mensaje += f", primer token p50 {primer_token['p50']:.2f} s"
+        self.log_message.emit(mensaje)
+        try:
+            self.batch.metrics.write(os.path.join(self.media_dir, 'metricas_ultimo_trabajo.json'))
+        except OSError as e:
+            self.log_message.emit(f"No se pudieron guardar las métricas: {str(e)}")
+    
+    def report_start(self, image_file):
+        self.log_message.emit(f"Procesando: {image_file}...")
+    
+    def report_result(self, image_file, result):
+        if isinstance(result, dict) and result.get('success', False):
+            nums = result.get('numeros_encontrados', [])
+            if nums:
+                output_file = os.path.basename(result.get('output_path') or '')
+                origen = f" (ráfaga de {result['duplicado_de']})" if result.get('duplicado_de') else ""
+                self.log_message.emit(f"  - {image_file}: Números encontrados: {', '.join(map(str, nums))}{origen}")
+                if output_file:
+                    self.log_message.emit(f"  - Imagen guardada como: {output_file}")
+            else:
+                self.log_message.emit(f"  - {image_file}: No se encontraron números")
+        else:
+            error_msg = result.get('error', 'Error desconocido') if isinstance(result, dict) else str(result)
+            self.log_message.emit(f"  - {image_file}: Error: {error_msg}")
+        
+        self.processed_images += 1
+        if self.watcher is not None:
+            self.total_images = self.watcher.seen
+        else:
+            self.total_images = self.scanner.estimated_total(self.processed_images)
+        progress = int((self.processed_images / max(1, self.total_images)) * 100)
+        self.progress_updated.emit(progress)
+
+class ResultsTableModel(QAbstractTableModel):
+    """
+    Modelo de la tabla de resultados sobre una ResultsStore, sin copiar las filas.
+    
+    La vista pide solo los datos de las filas que dibuja. Las filas se exponen de a
+    FETCH_BATCH con canFetchMore/fetchMore a medida que se desplaza la tabla, y el orden
+    y el filtro por dorsal los resuelve ResultsView sobre las columnas de la tabla, de
+    modo que la memoria y el tiempo de dibujo no dependen del tamaño del lote.
+    """
+    HEADERS = ("Archivo", "Números", "Estado")
+    # Columna de ResultsStore que muestra cada columna de la tabla
+    COLUMNS = ("archivo", "numeros", "estado")
+    
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.view = ResultsView(ResultsStore())
+        self.exposed = 0
+    
+    def set_store(self, store):
+        """Muestra otra tabla de resultados, con el orden y el filtro actuales"""
+        self.beginResetModel()
+        self.view = ResultsView(store, self.view.column, self.view.descending, self.view.number)
+        self.exposed = min(FETCH_BATCH, len(self.view))
+        self.endResetModel()
+    
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else self.exposed
+    
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.HEADERS)
+    
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if role == Qt.ItemDataRole.DisplayRole and orientation == Qt.Orientation.Horizontal:
+            return self.HEADERS[section]
+        return None
+    
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        store = self.view.store
+        fila = self.view.row_at(index.row())
+        if role == Qt.ItemDataRole.DisplayRole:
+            columna = self.COLUMNS[index.column()]
+            if columna == "archivo":
+                return store.row(fila)[0]
+            if columna == "numeros":
+                return ", ".join(map(str, store.numbers(fila)))
+            return store.status(fila)
+        if role == Qt.ItemDataRole.ForegroundRole and store.is_error(fila):
+            return QColor("#b00020")
+        if role == Qt.ItemDataRole.ToolTipRole and store.is_error(fila):
+            return store.error(fila)
+        return None
+    
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and self.exposed < len(self.view)
+    
+    def fetchMore(self, parent=QModelIndex()):
+        if parent.isValid():
+            return
+        nuevas = min(FETCH_BATCH, len(self.view) - self.exposed)
+        if nuevas <= 0:
+            return
+        self.beginInsertRows(QModelIndex(), self.exposed, self.exposed + nuevas - 1)
+        self.exposed += nuevas
+        self.endInsertRows()
+    
+    def refresh(self):
+        """Incorpora las filas que llegaron a la tabla; se exponen cuando la vista las pide"""
+        self.view.refresh()
+        if self.exposed < FETCH_BATCH:
+            self.fetchMore()
+    
+    def _reset(self, cambio):
+        self.beginResetModel()
+        cambio()
+        self.exposed = min(FETCH_BATCH, len(self.view))
+        self.endResetModel()
+    
+    def sort(self, column, order=Qt.SortOrder.AscendingOrder):
+        # Sin indicador de orden (column -1) se vuelve al orden de llegada
+        columna = self.COLUMNS[column] if 0 <= column < len(self.COLUMNS) else None
+        self._reset(lambda: self.view.sort(columna, order == Qt.SortOrder.DescendingOrder))
+    
+    def set_number_filter(self, numero):
+        """Muestra solo las fotos con ese número de dorsal; None muestra todas"""
+        self._reset(lambda: self.view.filter(numero))
 
 class MainWindow(QMainWindow):
     def __init__(self):
@@ -84,11 +270,19 @@ class MainWindow(QMainWindow):
         # Variables
         self.folder_path = ""
         self.processing_thread = None
-        self.results = {}
+        self.results = None
+        # Registro pendiente de mostrar: se vuelca al área de registro cada REFRESH_INTERVAL_MS
+        self.pending_log = deque(maxlen=MAX_PENDING_LOG)
+        self.omitted_log = 0
         
         # Configuración de la interfaz
         self.setup_ui()
         
+        # Una sola actualización periódica del registro y de la tabla, por muchos mensajes que lleguen
+        self.refresh_timer = QTimer(self)
+        self.refresh_timer.timeout.connect(self.refresh_views)
+        self.refresh_timer.start(REFRESH_INTERVAL_MS)
+        
     def setup_ui(self):
         # Widget principal
         main_widget = QWidget()
@@ -111,26 +305,88 @@ class MainWindow(QMainWindow):
         model_layout.addWidget(model_label)
         model_layout.addWidget(self.model_combo)
         
+        # Solicitudes simultáneas a Ollama
+        concurrency_layout = QHBoxLayout()
+        concurrency_label = QLabel("Solicitudes simultáneas:")
+        self.concurrency_spin = QSpinBox()
+        self.concurrency_spin.setRange(1, 32)
+        self.concurrency_spin.setValue(DEFAULT_MAX_IN_FLIGHT)
+        concurrency_layout.addWidget(concurrency_label)
+        concurrency_layout.addWidget(self.concurrency_spin)
+        # Sin ajuste manual: el lote elige el límite según la respuesta de Ollama
+        self.adaptive_check = QCheckBox("Automático")
+        self.adaptive_check.toggled.connect(self.concurrency_spin.setDisabled)
+        self.adaptive_check.setChecked(True)
+        concurrency_layout.addWidget(self.adaptive_check)
+        
+        # Caché de resultados
+        self.cache_check = QCheckBox("Usar resultados guardados de ejecuciones anteriores")
+        self.cache_check.setChecked(True)
+        
+        # Agrupación de ráfagas
+        self.bursts_check = QCheckBox("Agrupar ráfagas de fotos casi iguales (una solicitud por ráfaga)")
+        
+        # Vigilancia de la carpeta durante el evento
+        self.watch_check = QCheckBox("Vigilar la carpeta y procesar las fotos nuevas a medida que llegan")
+        
+        # Archivos de eventos organizados por fotógrafo u hora
+        self.recursive_check = QCheckBox("Incluir las subcarpetas")
+        self.recursive_check.setChecked(True)
+        
         # Botón de procesar
         self.process_btn = QPushButton("Procesar Imágenes")
         self.process_btn.clicked.connect(self.process_images)
         self.process_btn.setEnabled(False)
         
+        # Exportación de la tabla de resultados
+        self.export_btn = QPushButton("Exportar Resultados")
+        self.export_btn.clicked.connect(self.export_results)
+        self.export_btn.setEnabled(False)
+        
         # Barra de progreso
         self.progress_bar = QProgressBar()
         self.progress_bar.setValue(0)
         
-        # Área de registro
-        self.log_area = QTextEdit()
+        # Tabla de resultados con búsqueda por dorsal
+        filter_layout = QHBoxLayout()
+        self.filter_edit = QLineEdit()
+        self.filter_edit.setPlaceholderText("Número de dorsal")
+        self.filter_edit.textChanged.connect(self.filter_results)
+        filter_layout.addWidget(QLabel("Buscar dorsal:"))
+        filter_layout.addWidget(self.filter_edit)
+        
+        self.results_model = ResultsTableModel(self)
+        self.results_table = QTableView()
+        self.results_table.setModel(self.results_model)
+        # Sin indicador de orden, los resultados se muestran en orden de llegada hasta que se ordena una columna
+        self.results_table.horizontalHeader().setSortIndicator(-1, Qt.SortOrder.AscendingOrder)
+        self.results_table.setSortingEnabled(True)
+        self.results_table.setSelectionBehavior(QAbstractItemView.SelectionBehavior.SelectRows)
+        # Filas de alto fijo: la vista no mide cada fila para calcular el desplazamiento
+        self.results_table.verticalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Fixed)
+        self.results_table.verticalHeader().hide()
+        self.results_table.horizontalHeader().setSectionResizeMode(0, QHeaderView.ResizeMode.Stretch)
+        
+        # Área de registro, con una cantidad máxima de líneas
+        self.log_area = QPlainTextEdit()
         self.log_area.setReadOnly(True)
+        self.log_area.setMaximumBlockCount(MAX_LOG_LINES)
         
         # Agregar widgets al layout
         layout.addLayout(folder_layout)
         layout.addLayout(model_layout)
+        layout.addLayout(concurrency_layout)
+        layout.addWidget(self.cache_check)
+        layout.addWidget(self.bursts_check)
+        layout.addWidget(self.watch_check)
+        layout.addWidget(self.recursive_check)
         layout.addWidget(self.process_btn)
+        layout.addWidget(self.export_btn)
         layout.addWidget(self.progress_bar)
+        layout.addLayout(filter_layout)
+        layout.addWidget(self.results_table, 3)
         layout.addWidget(QLabel("Registro:"))
-        layout.addWidget(self.log_area)
+        layout.addWidget(self.log_area, 1)
         
         # Estilos
         self.setStyleSheet("""
@@ -151,7 +407,7 @@ class MainWindow(QMainWindow):
             QPushButton:hover {
                 background-color: #45a049;
             }
-            QTextEdit {
+            QPlainTextEdit, QTableView {
                 border: 1px solid #ccc;
                 border-radius: 4px;
                 padding: 5px;
@@ -179,17 +435,42 @@ class MainWindow(QMainWindow):
         if not self.folder_path:
             QMessageBox.warning(self, "Error", "Por favor selecciona una carpeta primero")
             return
-            
-        self.process_btn.setEnabled(False)
-        self.process_btn.setText("Procesando...")
+        
+        # Mientras se vigila, el botón detiene la vigilancia
+        if self.processing_thread and self.processing_thread.isRunning():
+            self.processing_thread.stop_watching()
+            self.process_btn.setEnabled(False)
+            self.process_btn.setText("Terminando...")
+            self.log("Deteniendo la vigilancia; se terminan las fotos en curso")
+            return
+        
+        watch = self.watch_check.isChecked()
+        if watch:
+            self.process_btn.setText("Detener vigilancia")
+        else:
+            self.process_btn.setEnabled(False)
+            self.process_btn.setText("Procesando...")
         self.progress_bar.setValue(0)
+        self.export_btn.setEnabled(False)
         self.log("Iniciando procesamiento de imágenes...")
         
         model_name = self.model_combo.currentText()
-        self.processing_thread = ImageProcessingThread(self.folder_path, model_name)
+        self.processing_thread = ImageProcessingThread(
+            self.folder_path,
+            model_name,
+            max_in_flight=self.concurrency_spin.value(),
+            use_cache=self.cache_check.isChecked(),
+            group_bursts=self.bursts_check.isChecked(),
+            watch=watch,
+            recursive=self.recursive_check.isChecked(),
+            adaptive_concurrency=self.adaptive_check.isChecked()
+        )
         self.processing_thread.progress_updated.connect(self.update_progress)
         self.processing_thread.processing_finished.connect(self.processing_finished)
         self.processing_thread.log_message.connect(self.log)
+        # La tabla muestra los resultados a medida que el hilo los agrega
+        self.results = self.processing_thread.results
+        self.results_model.set_store(self.results)
         self.processing_thread.start()
     
     def update_progress(self, value):
@@ -199,30 +480,71 @@ class MainWindow(QMainWindow):
         self.results = results
         self.process_btn.setEnabled(True)
         self.process_btn.setText("Procesar Imágenes")
+        self.export_btn.setEnabled(len(results) > 0)
+        self.refresh_views()
         self.log("Procesamiento completado")
         
-        # Mostrar resumen
-        total = len(results)
-        success = sum(1 for r in results.values() if isinstance(r, dict) and r.get('success', False))
-        
-        # Mostrar los números encontrados
-        for filename, result in results.items():
-            if isinstance(result, dict):
-                if result.get('success'):
-                    nums = result.get('numeros_encontrados', [])
-                    if nums:
-                        self.log(f"{filename}: Encontrados números: {', '.join(map(str, nums))}")
-                    else:
-                        self.log(f"{filename}: No se encontraron números")
-                else:
-                    self.log(f"{filename}: {result.get('error', 'Error desconocido')}")
-        
-        self.log(f"Resumen: {success} de {total} imágenes procesadas correctamente")
+        # Mostrar resumen; el detalle de cada imagen está en la tabla
+        estados = results.counts()
+        self.log(f"Resumen: {results.success_count} de {len(results)} imágenes procesadas correctamente "
+                 f"({estados['OK']} con números, {estados['Sin números']} sin números, {estados['Error']} con error)")
     
+    def filter_results(self, texto):
+        texto = texto.strip()
+        if texto and not texto.isdigit():
+            return
+        self.results_model.set_number_filter(int(texto) if texto else None)
+    
+    def refresh_views(self):
+        """Vuelca el registro pendiente y agrega a la tabla los resultados nuevos"""
+        barra = self.results_table.verticalScrollBar()
+        al_final = barra.value() >= barra.maximum()
+        self.results_model.refresh()
+        # Si la tabla estaba al final, seguir los resultados nuevos
+        if al_final and self.results_model.canFetchMore():
+            self.results_model.fetchMore()
+            self.results_table.scrollToBottom()
+        self.flush_log()
+    
+    def export_results(self):
+        if not self.results:
+            return
+        filtros = {".csv": "CSV (*.csv)", ".jsonl": "JSON Lines (*.jsonl)",
+                   ".parquet": "Parquet (*.parquet)", ".npz": "NumPy (*.npz)"}
+        disponibles = [filtros[extension] for extension in export_formats()]
+        file_path, filtro = QFileDialog.getSaveFileName(self, "Exportar resultados", "resultados.csv",
+                                                        ";;".join(disponibles))
+        if not file_path:
+            return
+        # Si no se escribió la extensión, usar la del filtro elegido
+        if os.path.splitext(file_path)[1].lower() not in filtros:
+            file_path += next((ext for ext, texto in filtros.items() if texto == filtro), ".csv")
+        try:
+            self.results.export(file_path)
+            self.log(f"{len(self.results)} resultados exportados a {file_path}")
+        except Exception as e:
+            QMessageBox.critical(self, "Error", f"No se pudo exportar el archivo: {str(e)}")
     
     def log(self, message):
-        self.log_area.append(f"> {message}")
-        self.log_area.verticalScrollBar().setValue(self.log_area.verticalScrollBar().maximum())
+        # Si llegan más mensajes de los que caben hasta la próxima actualización, se omiten los más viejos
+        if len(self.pending_log) == self.pending_log.maxlen:
+            self.omitted_log += 1
+        self.pending_log.append(f"> {message}")
+    
+    def flush_log(self):
+        """Agrega al área de registro, de una sola vez, los mensajes acumulados"""
+        if not self.pending_log:
+            return
+        lineas = list(self.pending_log)
+        self.pending_log.clear()
+        if self.omitted_log:
+            lineas.insert(0, f"> ... {self.omitted_log} mensajes omitidos")
+            self.omitted_log = 0
+        barra = self.log_area.verticalScrollBar()
+        al_final = barra.value() >= barra.maximum()
+        self.log_area.appendPlainText("\n".join(lineas))
+        if al_final:
+            barra.setValue(barra.maximum())
     
     def closeEvent(self, event):
         if self.processing_thread and self.processing_thread.isRunning():
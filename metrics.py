@@ -0,0 +1,195 @@
+import json
+import time
+import threading
+
+# Límites de los histogramas de duración, en segundos
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Etapas que se registran a partir de result["metricas"]
+STAGES = ("decodificar", "regiones", "codificar", "primer_token", "solicitud", "analisis", "marca_agua", "escritura")
+
+
+class Histogram:
+    """Histograma acumulativo con límites fijos, como los de Prometheus"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, valor):
+        for i, limite in enumerate(self.buckets):
+            if valor <= limite:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.sum += valor
+        self.count += 1
+
+    def quantile(self, q):
+        """Estima un cuantil interpolando dentro del intervalo que lo contiene"""
+        if self.count == 0:
+            return 0.0
+        objetivo = q * self.count
+        acumulado = 0
+        inferior = 0.0
+        for i, cantidad in enumerate(self.counts):
+            superior = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+            if acumulado + cantidad >= objetivo and cantidad > 0:
+                return inferior + (superior - inferior) * (objetivo - acumulado) / cantidad
+            acumulado += cantidad
+            inferior = superior
+        return self.buckets[-1]
+
+    def summary(self):
+        return {
+            "cantidad": self.count,
+            "suma": round(self.sum, 6),
+            "media": round(self.sum / self.count, 6) if self.count else 0.0,
+            "p50": round(self.quantile(0.50), 6),
+            "p95": round(self.quantile(0.95), 6),
+            "p99": round(self.quantile(0.99), 6),
+        }
+
+
+class MetricsRegistry:
+    """
+    Contadores, medidores e histogramas de un lote de imágenes.
+
+    Se alimenta con los resultados de process_image (su diccionario "metricas") y
+    se puede exportar en formato de texto de Prometheus o como resumen JSON.
+    """
+
+    def __init__(self, prefix="reconocimiento"):
+        self.prefix = prefix
+        self.started = time.time()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def _key(self, nombre, etiquetas):
+        return nombre, tuple(sorted((etiquetas or {}).items()))
+
+    def inc(self, nombre, valor=1, etiquetas=None):
+        with self._lock:
+            clave = self._key(nombre, etiquetas)
+            self.counters[clave] = self.counters.get(clave, 0) + valor
+
+    def set_gauge(self, nombre, valor, etiquetas=None):
+        with self._lock:
+            self.gauges[self._key(nombre, etiquetas)] = valor
+
+    def observe(self, nombre, valor, etiquetas=None):
+        with self._lock:
+            clave = self._key(nombre, etiquetas)
+            histograma = self.histograms.get(clave)
+            if histograma is None:
+                histograma = self.histograms[clave] = Histogram()
+            histograma.observe(valor)
+
+    def record_result(self, resultado, duracion=None, reanudado=False):
+        """
+        Registra el resultado de una imagen.
+
+        Args:
+            resultado (dict): Resultado de process_image
+            duracion (float, opcional): Tiempo total de la imagen en el lote, en segundos
+            reanudado (bool): Si el resultado se recuperó de un trabajo anterior
+        """
+        if reanudado:
+            estado = "reanudado"
+        elif not resultado.get("success"):
+            estado = "error"
+        elif resultado.get("desde_cache"):
+            estado = "cache"
+        elif resultado.get("duplicado_de"):
+            estado = "duplicado"
+        else:
+            estado = "ok"
+        self.inc("imagenes_total", etiquetas={"estado": estado})
+        if reanudado:
+            return
+
+        if duracion is not None:
+            self.observe("imagen_duracion_segundos", duracion)
+        metricas = resultado.get("metricas") or {}
+        for etapa in STAGES:
+            if etapa in metricas:
+                self.observe("etapa_duracion_segundos", metricas[etapa], {"etapa": etapa})
+        if metricas.get("servidor"):
+            self.inc("imagenes_por_servidor_total", etiquetas={"servidor": metricas["servidor"]})
+        if metricas.get("respuesta_cortada"):
+            self.inc("respuestas_cortadas_total")
+        if metricas.get("tokens"):
+            self.inc("tokens_total", metricas["tokens"])
+        if resultado.get("numeros_encontrados"):
+            self.inc("numeros_encontrados_total", len(resultado["numeros_encontrados"]))
+
+    @staticmethod
+    def _labels(etiquetas, extra=None):
+        pares = list(etiquetas) + list(extra or [])
+        if not pares:
+            return ""
+        return "{" + ",".join(f'{k}="{v}"' for k, v in pares) + "}"
+
+    def to_prometheus(self):
+        """Exporta las métricas en el formato de texto de Prometheus"""
+        lineas = []
+        with self._lock:
+            declarados = set()
+            for (nombre, etiquetas), valor in sorted(self.counters.items()):
+                completo = f"{self.prefix}_{nombre}"
+                if completo not in declarados:
+                    lineas.append(f"# TYPE {completo} counter")
+                    declarados.add(completo)
+                lineas.append(f"{completo}{self._labels(etiquetas)} {valor}")
+            for (nombre, etiquetas), valor in sorted(self.gauges.items()):
+                completo = f"{self.prefix}_{nombre}"
+                if completo not in declarados:
+                    lineas.append(f"# TYPE {completo} gauge")
+                    declarados.add(completo)
+                lineas.append(f"{completo}{self._labels(etiquetas)} {valor}")
+            for (nombre, etiquetas), histograma in sorted(self.histograms.items()):
+                completo = f"{self.prefix}_{nombre}"
+                if completo not in declarados:
+                    lineas.append(f"# TYPE {completo} histogram")
+                    declarados.add(completo)
+                acumulado = 0
+                for limite, cantidad in zip(histograma.buckets + ("+Inf",), histograma.counts):
+                    acumulado += cantidad
+                    lineas.append(f"{completo}_bucket{self._labels(etiquetas, [('le', limite)])} {acumulado}")
+                lineas.append(f"{completo}_sum{self._labels(etiquetas)} {histograma.sum}")
+                lineas.append(f"{completo}_count{self._labels(etiquetas)} {histograma.count}")
+        return "\n".join(lineas) + "\n"
+
+    def summary(self):
+        """Resumen en un diccionario apto para JSON"""
+        with self._lock:
+            duracion = time.time() - self.started
+            procesadas = sum(v for (n, _), v in self.counters.items() if n == "imagenes_total")
+            resumen = {
+                "duracion_segundos": round(duracion, 3),
+                "imagenes_por_segundo": round(procesadas / duracion, 3) if duracion > 0 else 0.0,
+                "contadores": {},
+                "medidores": {},
+                "histogramas": {},
+            }
+            for (nombre, etiquetas), valor in sorted(self.counters.items()):
+                resumen["contadores"][nombre + self._labels(etiquetas)] = valor
+            for (nombre, etiquetas), valor in sorted(self.gauges.items()):
+                resumen["medidores"][nombre + self._labels(etiquetas)] = valor
+            for (nombre, etiquetas), histograma in sorted(self.histograms.items()):
+                resumen["histogramas"][nombre + self._labels(etiquetas)] = histograma.summary()
+        return resumen
+
+    def to_json(self):
+        return json.dumps(self.summary(), ensure_ascii=False, indent=2)
+
+    def write(self, path):
+        """Guarda las métricas; el formato depende de la extensión (.prom o .json)"""
+        contenido = self.to_prometheus() if path.endswith(".prom") else self.to_json()
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(contenido)
@@ -0,0 +1,240 @@
+"""
+Copias de una foto en varios tamaños (miniatura, vista previa, copia web y copia de venta).
+
+La foto se decodifica una sola vez, al tamaño de la copia más grande, y las copias se
+generan de mayor a menor con una cadena de reducciones a la mitad: cada copia parte del
+nivel anterior sin marca de agua, no de la foto completa. Así, generar todas las copias
+cuesta poco más que generar la más grande.
+
+Uso:
+    python renditions.py foto.jpg /ruta/salida --copias thumb preview full --webp
+"""
+import os
+import time
+import threading
+
+from PIL import Image, ImageOps, features
+
+from watermark import WatermarkRenderer
+
+# Formatos de salida y su extensión
+EXTENSIONS = {"JPEG": ".jpg", "WEBP": ".webp", "PNG": ".png"}
+
+# Copias disponibles: lado más largo en píxeles (None conserva la resolución original),
+# formato, calidad, marca de agua, JPEG progresivo y esfuerzo del codificador WebP (0 a 6).
+# La copia de venta se descarga entera: el JPEG progresivo solo conviene en las que se
+# muestran en la web, y en su tamaño costaría tanto como el resto de la copia
+RENDITIONS = {
+    "thumb": {"max_dimension": 320, "format": "JPEG", "quality": 75, "watermark": False},
+    "preview": {"max_dimension": 800, "format": "JPEG", "quality": 70, "watermark": True, "progressive": True},
+    "web": {"max_dimension": 2048, "format": "JPEG", "quality": 82, "watermark": True, "progressive": True,
+            "method": 2},
+    "full": {"max_dimension": None, "format": "JPEG", "quality": 92, "watermark": True, "method": 2},
+}
+
+
+def webp_available():
+    """Indica si Pillow se compiló con soporte para WebP"""
+    return features.check("webp")
+
+
+def rendition_options(opciones, format=None):
+    """
+    Completa las opciones de una copia con los valores por defecto.
+
+    Args:
+        opciones (dict | str): Opciones de la copia, o el nombre de una de RENDITIONS
+        format (str, opcional): Formato que reemplaza al de la copia ("JPEG", "WEBP" o "PNG")
+
+    Returns:
+        dict: Opciones con max_dimension, format, quality, watermark, progressive y method
+    """
+    if isinstance(opciones, str):
+        if opciones not in RENDITIONS:
+            raise ValueError(f"Copia desconocida: {opciones}")
+        opciones = RENDITIONS[opciones]
+    completas = {"max_dimension": None, "format": "JPEG", "quality": 85, "watermark": True, "progressive": False,
+                 "method": 4}
+    completas.update(opciones)
+    if format is not None:
+        completas["format"] = format.upper()
+    if completas["format"] not in EXTENSIONS:
+        raise ValueError(f"Formato de salida no admitido: {completas['format']}")
+    return completas
+
+
+def save_options(opciones):
+    """Opciones de Image.save para el formato de una copia"""
+    formato = opciones["format"]
+    if formato == "JPEG":
+        return {"quality": opciones["quality"], "optimize": True, "progressive": opciones["progressive"]}
+    if formato == "WEBP":
+        # Con method 4 (el valor por defecto de libwebp) una foto completa tarda varios
+        # segundos; con 0 o 1 las fotos con mucho detalle pueden superar el límite de la
+        # primera partición de VP8 y fallar con "encoding error 6"
+        return {"quality": opciones["quality"], "method": opciones["method"]}
+    return {"optimize": True}
+
+
+def atomic_save(img, output_path, **opciones):
+    """
+    Guarda una imagen sin que aparezca nunca un archivo a medio escribir en output_path.
+
+    Se escribe en un archivo temporal oculto de la misma carpeta y se renombra con
+    os.replace, que reemplaza el destino en un solo paso.
+
+    Args:
+        img (PIL.Image.Image): Imagen a guardar
+        output_path (str): Ruta final; su extensión determina el formato
+        **opciones: Opciones de Image.save (quality, optimize, etc.)
+    """
+    carpeta, nombre = os.path.split(output_path)
+    formato = Image.registered_extensions().get(os.path.splitext(nombre)[1].lower(), "JPEG")
+    temporal = os.path.join(carpeta, f".{nombre}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        img.save(temporal, format=formato, **opciones)
+        os.replace(temporal, output_path)
+    except BaseException:
+        try:
+            os.remove(temporal)
+        except OSError:
+            pass
+        raise
+
+
+class RenditionRenderer:
+    """
+    Genera las copias de una foto a partir de una sola decodificación.
+
+    Las copias se ordenan de mayor a menor. Cada una parte del nivel anterior: se reduce a
+    la mitad con Image.reduce (un promedio de bloques de 2x2, muy barato) mientras el
+    resultado no quede por debajo del tamaño pedido, y el último paso, de menos de 2x, se
+    hace con LANCZOS. La marca de agua se pega sobre una copia del nivel, de modo que las
+    copias siguientes se reducen desde la imagen limpia.
+    """
+
+    def __init__(self, watermarks=None):
+        """
+        Args:
+            watermarks (WatermarkRenderer, opcional): Renderizador de la marca de agua, para
+                reutilizar sus capas entre fotos del mismo tamaño
+        """
+        self.watermarks = watermarks or WatermarkRenderer()
+
+    @staticmethod
+    def decode(image_path, max_dimension=None):
+        """
+        Decodifica la foto orientada según su EXIF, al menor tamaño que cubra max_dimension.
+
+        Args:
+            image_path (str): Ruta de la foto
+            max_dimension (int, opcional): Lado más largo que se necesita; None para la
+                resolución completa
+
+        Returns:
+            PIL.Image.Image: Imagen RGB
+        """
+        with Image.open(image_path) as img:
+            orientacion = img.getexif().get(0x0112, 1)
+            if max_dimension is not None and max_dimension < max(img.size):
+                # En los JPEG se decodifica directamente a 1/2, 1/4 u 1/8 si alcanza
+                escala = max_dimension / max(img.size)
+                img.draft('RGB', (int(img.width * escala) + 1, int(img.height * escala) + 1))
+            if orientacion != 1:
+                img = ImageOps.exif_transpose(img)
+            if img.mode != 'RGB':
+                img = img.convert('RGB')
+            img.load()
+            return img
+
+    @staticmethod
+    def target_size(size, max_dimension):
+        """Tamaño final de una copia, con la proporción de la foto decodificada"""
+        if max_dimension is None or max(size) <= max_dimension:
+            return size
+        escala = max_dimension / max(size)
+        return max(1, round(size[0] * escala)), max(1, round(size[1] * escala))
+
+    @staticmethod
+    def reduce_to(img, size):
+        """Reduce una imagen a size: mitades con reduce(2) y un último paso LANCZOS de menos de 2x"""
+        while img.width >= 2 * size[0] and img.height >= 2 * size[1]:
+            img = img.reduce(2)
+        if img.size != size:
+            img = img.resize(size, Image.Resampling.LANCZOS)
+        return img
+
+    def render(self, img, renditions, text="COPIA", opacity=0.3):
+        """
+        Genera las copias de una imagen decodificada, de la más grande a la más chica.
+
+        Args:
+            img (PIL.Image.Image): Imagen RGB decodificada
+            renditions (list): Tuplas (clave, opciones completas de rendition_options)
+
+        Yields:
+            tuple: (clave, imagen de la copia, opciones)
+        """
+        tamanos = [(self.target_size(img.size, opciones["max_dimension"]), clave, opciones)
+                   for clave, opciones in renditions]
+        tamanos.sort(key=lambda t: t[0][0] * t[0][1], reverse=True)
+        nivel = img
+        for tamano, clave, opciones in tamanos:
+            nivel = self.reduce_to(nivel, tamano)
+            copia = nivel
+            if opciones["watermark"]:
+                capa = self.watermarks.layer(nivel.size, text, opacity)
+                copia = nivel.copy()
+                # Pegar con la capa como máscara equivale a alpha_composite sobre una foto
+                # opaca, sin convertir la copia a RGBA y de vuelta
+                copia.paste(capa, (0, 0), capa)
+            yield clave, copia, opciones
+
+    def export(self, image_path, destinos, text="COPIA", opacity=0.3):
+        """
+        Decodifica una foto una vez y guarda todas sus copias de forma atómica.
+
+        Args:
+            image_path (str): Ruta de la foto original
+            destinos (list): Tuplas (ruta de salida, opciones completas de rendition_options)
+            text (str): Texto de la marca de agua
+            opacity (float): Opacidad de la marca de agua (0.0 a 1.0)
+
+        Returns:
+            dict: Segundos de "decodificar" y de cada copia, por ruta de salida
+        """
+        inicio = time.perf_counter()
+        maximos = [opciones["max_dimension"] for _, opciones in destinos]
+        img = self.decode(image_path, None if None in maximos else max(maximos))
+        tiempos = {"decodificar": time.perf_counter() - inicio}
+
+        inicio = time.perf_counter()
+        for output_path, copia, opciones in self.render(img, destinos, text, opacity):
+            atomic_save(copia, output_path, **save_options(opciones))
+            fin = time.perf_counter()
+            # Incluye la reducción desde el nivel anterior, la marca de agua y la codificación
+            tiempos[output_path] = fin - inicio
+            inicio = fin
+        return tiempos
+
+
+# Para pruebas locales
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Genera las copias de una foto")
+    parser.add_argument("imagen", help="Ruta a la foto")
+    parser.add_argument("salida", help="Carpeta donde se guardan las copias")
+    parser.add_argument("--copias", nargs="+", choices=list(RENDITIONS), default=list(RENDITIONS))
+    parser.add_argument("--webp", action="store_true", help="Guardar las copias en WebP")
+    parser.add_argument("--texto", default="COPIA", help="Texto de la marca de agua")
+    args = parser.parse_args()
+
+    os.makedirs(args.salida, exist_ok=True)
+    nombre = os.path.splitext(os.path.basename(args.imagen))[0]
+    destinos = []
+    for copia in args.copias:
+        opciones = rendition_options(copia, "WEBP" if args.webp else None)
+        destinos.append((os.path.join(args.salida, f"{nombre}_{copia}{EXTENSIONS[opciones['format']]}"), opciones))
+    for ruta, segundos in RenditionRenderer().export(args.imagen, destinos, args.texto).items():
+        print(f"{ruta}: {segundos * 1000:.0f} ms")
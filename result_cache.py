@@ -0,0 +1,158 @@
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+
+# Tamaño máximo por defecto de la caché (64 MB)
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+
+class ResultCache:
+    """
+    Caché en disco de resultados de reconocimiento.
+
+    Cada entrada se identifica por el hash del contenido de la imagen, el modelo y el
+    prompt, de modo que una foto ya procesada no vuelve a enviarse a Ollama aunque se
+    haya movido o renombrado. Cuando la caché supera max_bytes se eliminan las entradas
+    usadas hace más tiempo (LRU).
+
+    Para no releer archivos grandes en cada ejecución, el hash de cada ruta se recuerda
+    junto con su tamaño y fecha de modificación.
+    """
+
+    def __init__(self, path, max_bytes=DEFAULT_MAX_BYTES):
+        """
+        Args:
+            path (str): Ruta del archivo SQLite de la caché
+            max_bytes (int): Tamaño máximo aproximado de los resultados guardados
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        directorio = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directorio, exist_ok=True)
+
+        # La caché se comparte entre los hilos del lote
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS resultados (
+                clave TEXT PRIMARY KEY,
+                modelo TEXT NOT NULL,
+                texto TEXT NOT NULL,
+                numeros TEXT NOT NULL,
+                tamano INTEGER NOT NULL,
+                ultimo_uso REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_resultados_uso ON resultados (ultimo_uso);
+            CREATE TABLE IF NOT EXISTS archivos (
+                ruta TEXT PRIMARY KEY,
+                tamano INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                hash TEXT NOT NULL
+            );
+        """)
+        self._conn.commit()
+        self._total = self._conn.execute("SELECT COALESCE(SUM(tamano), 0) FROM resultados").fetchone()[0]
+
+    def file_hash(self, image_path):
+        """Devuelve el hash SHA-256 del contenido de la imagen, reutilizando el calculado antes si no cambió"""
+        ruta = os.path.abspath(image_path)
+        info = os.stat(ruta)
+        with self._lock:
+            fila = self._conn.execute(
+                "SELECT tamano, mtime_ns, hash FROM archivos WHERE ruta = ?", (ruta,)
+            ).fetchone()
+        if fila and fila[0] == info.st_size and fila[1] == info.st_mtime_ns:
+            return fila[2]
+
+        digest = hashlib.sha256()
+        with open(ruta, 'rb') as f:
+            for bloque in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(bloque)
+        hash_contenido = digest.hexdigest()
+
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO archivos (ruta, tamano, mtime_ns, hash) VALUES (?, ?, ?, ?)",
+                (ruta, info.st_size, info.st_mtime_ns, hash_contenido)
+            )
+            self._conn.commit()
+        return hash_contenido
+
+    def make_key(self, image_path, model_name, prompt):
+        """Genera la clave de la caché para una imagen, un modelo y un prompt"""
+        clave = hashlib.sha256()
+        for parte in (self.file_hash(image_path), model_name, prompt):
+            clave.update(parte.encode('utf-8'))
+            clave.update(b'\0')
+        return clave.hexdigest()
+
+    def get(self, key):
+        """
+        Busca un resultado guardado.
+
+        Returns:
+            tuple: (texto_original, numeros_encontrados), o None si no está en la caché
+        """
+        with self._lock:
+            fila = self._conn.execute(
+                "SELECT texto, numeros FROM resultados WHERE clave = ?", (key,)
+            ).fetchone()
+            if fila is None:
+                return None
+            self._conn.execute("UPDATE resultados SET ultimo_uso = ? WHERE clave = ?", (time.time(), key))
+            self._conn.commit()
+        return fila[0], json.loads(fila[1])
+
+    def put(self, key, model_name, texto, numeros):
+        """Guarda el resultado de una imagen y elimina las entradas más antiguas si hace falta"""
+        numeros_json = json.dumps(numeros)
+        tamano = len(key) + len(model_name) + len(texto.encode('utf-8')) + len(numeros_json)
+        with self._lock:
+            anterior = self._conn.execute(
+                "SELECT tamano FROM resultados WHERE clave = ?", (key,)
+            ).fetchone()
+            if anterior:
+                self._total -= anterior[0]
+            self._conn.execute(
+                "INSERT OR REPLACE INTO resultados (clave, modelo, texto, numeros, tamano, ultimo_uso) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model_name, texto, numeros_json, tamano, time.time())
+            )
+            self._total += tamano
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        """Elimina las entradas menos usadas hasta volver por debajo de max_bytes"""
+        while self._total > self.max_bytes:
+            filas = self._conn.execute(
+                "SELECT clave, tamano FROM resultados ORDER BY ultimo_uso LIMIT 256"
+            ).fetchall()
+            if not filas:
+                self._total = 0
+                return
+            for clave, tamano in filas:
+                if self._total <= self.max_bytes:
+                    break
+                self._conn.execute("DELETE FROM resultados WHERE clave = ?", (clave,))
+                self._total -= tamano
+
+    def invalidate(self, model_name=None):
+        """Elimina los resultados guardados, todos o solo los de un modelo"""
+        with self._lock:
+            if model_name is None:
+                self._conn.execute("DELETE FROM resultados")
+                self._conn.execute("DELETE FROM archivos")
+            else:
+                self._conn.execute("DELETE FROM resultados WHERE modelo = ?", (model_name,))
+            self._conn.commit()
+            self._total = self._conn.execute("SELECT COALESCE(SUM(tamano), 0) FROM resultados").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
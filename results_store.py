@@ -0,0 +1,446 @@
+"""
+Tabla compacta de los resultados de un lote y su exportación.
+
+Uso:
+    python results_store.py resultados.jsonl tabla.parquet
+"""
+import os
+import sys
+import csv
+import json
+import argparse
+import threading
+import importlib.util
+from array import array
+from itertools import accumulate
+from collections.abc import Mapping
+
+# Estado de cada imagen, como se muestra en las interfaces y en las exportaciones
+OK, SIN_NUMEROS, ERROR = 0, 1, 2
+STATUS_LABELS = ("OK", "Sin números", "Error")
+
+# Mayor número que se guarda (64 bits sin signo)
+MAX_NUMBER = 2 ** 64 - 1
+
+# Columnas de las exportaciones, en orden
+COLUMNS = ("archivo", "numeros", "estado", "copia", "desde_cache", "duplicado_de", "error", "segundos")
+
+
+def export_formats():
+    """Extensiones de exportación disponibles; Parquet solo si pyarrow está instalado"""
+    formatos = [".csv", ".jsonl", ".npz"]
+    if importlib.util.find_spec("pyarrow") is not None:
+        formatos.append(".parquet")
+    return formatos
+
+
+class ResultsStore(Mapping):
+    """
+    Resultados de un lote guardados por columnas, en lugar de un diccionario por imagen.
+
+    El estado, la marca de caché y la duración de cada imagen se guardan en arrays de
+    tipos fijos; los números de todas las imágenes van en un único array, con el inicio
+    y la cantidad de cada fila. Los errores y las ráfagas, que son pocos, se guardan
+    aparte por fila. Con 100 000 imágenes la tabla ocupa unos pocos MB, en lugar de los
+    cientos que ocupan los diccionarios de process_image con su texto y sus métricas.
+
+    Se usa como un diccionario de solo lectura de clave a resultado (results[clave]
+    arma el diccionario al consultarlo) y BatchProcessor la llena con results[clave] =
+    resultado. Las filas conservan el orden de llegada y se pueden leer por posición con
+    row(), que es lo que usan las vistas de las interfaces. Las exportaciones recorren las
+    columnas en un solo paso y escriben a medida que avanzan.
+    """
+
+    def __init__(self, keep_text=False):
+        """
+        Args:
+            keep_text (bool): Conservar también el texto completo de la respuesta del modelo
+        """
+        self.keep_text = keep_text
+        self._lock = threading.Lock()
+        self._claves = []
+        self._filas = {}
+        self._estado = array('b')
+        self._desde_cache = array('b')
+        self._segundos = array('f')
+        self._inicio = array('Q')
+        self._cantidad = array('I')
+        self._numeros = array('Q')
+        self._copias = []
+        # Solo las filas que los tienen
+        self._errores = {}
+        self._duplicados = {}
+        self._textos = {}
+        # Al reemplazar una fila sus números viejos quedan sin uso en _numeros
+        self._reemplazos = 0
+
+    def __len__(self):
+        return len(self._claves)
+
+    def __iter__(self):
+        return iter(self._claves[:len(self)])
+
+    def __contains__(self, clave):
+        return clave in self._filas
+
+    def __getitem__(self, clave):
+        return self.result(self._filas[clave])
+
+    def __setitem__(self, clave, resultado):
+        self.add(clave, resultado)
+
+    def add(self, clave, resultado):
+        """
+        Agrega el resultado de una imagen, o reemplaza el anterior si la clave ya estaba.
+
+        Args:
+            clave (str): Ruta relativa de la imagen
+            resultado (dict): Resultado de process_image (o de BatchProcessor)
+
+        Returns:
+            int: Fila del resultado
+        """
+        exitoso = bool(resultado.get("success"))
+        numeros = (resultado.get("numeros_encontrados") or []) if exitoso else []
+        if not exitoso:
+            estado = ERROR
+        else:
+            estado = OK if numeros else SIN_NUMEROS
+        segundos = float((resultado.get("metricas") or {}).get("total") or 0.0)
+        # Los números que no entran en 64 bits sin signo (una tira de más de 19 dígitos
+        # leída como un solo número) no se guardan; el texto original los conserva
+        numeros = array('Q', [n for n in map(int, numeros) if 0 <= n <= MAX_NUMBER])
+
+        with self._lock:
+            # Lo que puede fallar se calcula antes de tocar la tabla, para que un
+            # resultado inválido no deje una fila a medias
+            fila = self._filas.get(clave)
+            nueva = fila is None
+            inicio = len(self._numeros)
+            valores = (estado, bool(resultado.get("desde_cache")), segundos, inicio, len(numeros),
+                       resultado.get("output_path"))
+            columnas = (self._estado, self._desde_cache, self._segundos, self._inicio, self._cantidad, self._copias)
+            self._numeros.extend(numeros)
+            if nueva:
+                fila = len(self._claves)
+                self._filas[clave] = fila
+                for columna, valor in zip(columnas, valores):
+                    columna.append(valor)
+                # La clave va al final: una fila es visible solo cuando todas sus columnas existen
+                self._claves.append(clave)
+            else:
+                self._reemplazos += 1
+                for columna, valor in zip(columnas, valores):
+                    columna[fila] = valor
+            for extra, valor in ((self._errores, None if exitoso else resultado.get("error", "Error desconocido")),
+                                 (self._duplicados, resultado.get("duplicado_de")),
+                                 (self._textos, resultado.get("texto_original") if self.keep_text else None)):
+                if valor:
+                    extra[fila] = valor
+                else:
+                    extra.pop(fila, None)
+        return fila
+
+    def numbers(self, fila):
+        """Números reconocidos en una fila"""
+        inicio = self._inicio[fila]
+        return self._numeros[inicio:inicio + self._cantidad[fila]].tolist()
+
+    def status(self, fila):
+        """Etiqueta de estado de una fila, como la muestran las interfaces"""
+        if fila in self._duplicados:
+            return "Ráfaga"
+        if self._desde_cache[fila] and self._estado[fila] != ERROR:
+            return "Caché"
+        return STATUS_LABELS[self._estado[fila]]
+
+    def row(self, fila):
+        """
+        Devuelve una fila como tupla, en el orden de COLUMNS.
+
+        Los números se devuelven separados por espacios; error y duplicado_de son "" si no hay.
+        """
+        inicio = self._inicio[fila]
+        return (
+            self._claves[fila],
+            " ".join(map(str, self._numeros[inicio:inicio + self._cantidad[fila]])),
+            self.status(fila),
+            self._copias[fila] or "",
+            bool(self._desde_cache[fila]),
+            self._duplicados.get(fila, ""),
+            self._errores.get(fila, ""),
+            round(self._segundos[fila], 3),
+        )
+
+    def result(self, fila):
+        """Arma el diccionario de resultado de una fila, con las claves de process_image"""
+        if self._estado[fila] == ERROR:
+            resultado = {"error": self._errores.get(fila, "Error desconocido")}
+        else:
+            resultado = {
+                "success": True,
+                "numeros_encontrados": self.numbers(fila),
+                "output_path": self._copias[fila],
+                "desde_cache": bool(self._desde_cache[fila]),
+            }
+            if fila in self._textos:
+                resultado["texto_original"] = self._textos[fila]
+        if fila in self._duplicados:
+            resultado["duplicado_de"] = self._duplicados[fila]
+        return resultado
+
+    def counts(self):
+        """Cantidad de imágenes por estado: {"OK": n, "Sin números": n, "Error": n}"""
+        with self._lock:
+            return {etiqueta: self._estado.count(codigo) for codigo, etiqueta in enumerate(STATUS_LABELS)}
+
+    @property
+    def success_count(self):
+        """Imágenes procesadas sin error"""
+        return len(self) - self._estado.count(ERROR)
+
+    @property
+    def duplicate_count(self):
+        """Imágenes resueltas con otra foto de su ráfaga"""
+        return len(self._duplicados)
+
+    @property
+    def replacements(self):
+        """Veces que se reemplazó el resultado de una fila; las filas nuevas no cuentan"""
+        return self._reemplazos
+
+    def is_error(self, fila):
+        return self._estado[fila] == ERROR
+
+    def error(self, fila):
+        """Mensaje de error de una fila, o "" si se procesó bien"""
+        return self._errores.get(fila, "")
+
+    def sort_key(self, columna):
+        """
+        Función de orden para una columna de COLUMNS, que recibe el número de fila.
+
+        Los números se ordenan por el primero de cada foto (las fotos sin números al final),
+        no como texto.
+        """
+        if columna == "archivo":
+            return self._claves.__getitem__
+        if columna == "numeros":
+            return lambda fila: (self._cantidad[fila] == 0, self._numeros[self._inicio[fila]] if self._cantidad[fila] else 0)
+        if columna == "estado":
+            return self.status
+        if columna == "segundos":
+            return self._segundos.__getitem__
+        posicion = COLUMNS.index(columna)
+        return lambda fila: self.row(fila)[posicion]
+
+    def has_number(self, fila, numero):
+        """Indica si el número aparece entre los reconocidos en una fila"""
+        inicio = self._inicio[fila]
+        return numero in self._numeros[inicio:inicio + self._cantidad[fila]]
+
+    def iter_rows(self, start=0, stop=None):
+        """Genera las filas de start a stop (por defecto, las que existen al empezar)"""
+        stop = len(self) if stop is None else min(stop, len(self))
+        for fila in range(start, stop):
+            yield self.row(fila)
+
+    def write_csv(self, destino):
+        """Escribe la tabla como CSV (UTF-8 con BOM, para que Excel respete los acentos)"""
+        with open(destino, 'w', encoding='utf-8-sig', newline='') as f:
+            escritor = csv.writer(f)
+            escritor.writerow(COLUMNS)
+            escritor.writerows(self.iter_rows())
+
+    def write_jsonl(self, destino):
+        """Escribe la tabla como JSONL, un objeto por imagen con los números como lista"""
+        with open(destino, 'w', encoding='utf-8') as f:
+            for fila, valores in enumerate(self.iter_rows()):
+                linea = dict(zip(COLUMNS, valores))
+                linea["numeros"] = self.numbers(fila)
+                f.write(json.dumps(linea, ensure_ascii=False) + "\n")
+
+    def _number_columns(self, stop):
+        """Desplazamientos (stop + 1) y valores de los números de las primeras stop filas, sin huecos"""
+        desplazamientos = array('Q', [0])
+        desplazamientos.extend(accumulate(self._cantidad[:stop]))
+        if not self._reemplazos:
+            return desplazamientos, self._numeros[:desplazamientos[-1]]
+        valores = array('Q')
+        for fila in range(stop):
+            inicio = self._inicio[fila]
+            valores.extend(self._numeros[inicio:inicio + self._cantidad[fila]])
+        return desplazamientos, valores
+
+    def _columns(self):
+        """Columnas de la tabla para las exportaciones por columnas"""
+        with self._lock:
+            n = len(self)
+            desplazamientos, valores = self._number_columns(n)
+            return n, {
+                "archivo": self._claves[:n],
+                "numeros": (desplazamientos, valores),
+                "estado": [self.status(fila) for fila in range(n)],
+                "copia": [copia or "" for copia in self._copias[:n]],
+                "desde_cache": self._desde_cache[:n],
+                "duplicado_de": [self._duplicados.get(fila, "") for fila in range(n)],
+                "error": [self._errores.get(fila, "") for fila in range(n)],
+                "segundos": self._segundos[:n],
+            }
+
+    def write_parquet(self, destino):
+        """Escribe la tabla como Parquet; los números quedan como una columna de listas"""
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("Para exportar a Parquet hace falta pyarrow: pip install pyarrow")
+        n, columnas = self._columns()
+        desplazamientos, valores = columnas["numeros"]
+        tabla = pa.table({
+            "archivo": pa.array(columnas["archivo"], pa.string()),
+            "numeros": pa.ListArray.from_arrays(pa.array(desplazamientos, pa.int32()), pa.array(valores, pa.uint64())),
+            "estado": pa.array(columnas["estado"], pa.string()).dictionary_encode(),
+            "copia": pa.array(columnas["copia"], pa.string()),
+            "desde_cache": pa.array(columnas["desde_cache"], pa.int8()).cast(pa.bool_()),
+            "duplicado_de": pa.array(columnas["duplicado_de"], pa.string()),
+            "error": pa.array(columnas["error"], pa.string()),
+            "segundos": pa.array(columnas["segundos"], pa.float32()),
+        })
+        pq.write_table(tabla, destino)
+
+    def write_npz(self, destino):
+        """
+        Escribe la tabla como arrays de numpy (.npz). Los números van en dos arrays:
+        numeros_valores y numeros_desplazamientos (los de la fila i están entre
+        desplazamientos[i] y desplazamientos[i + 1]).
+        """
+        import numpy as np
+        n, columnas = self._columns()
+        desplazamientos, valores = columnas["numeros"]
+        np.savez_compressed(
+            destino,
+            archivo=np.array(columnas["archivo"], dtype=str),
+            numeros_valores=np.frombuffer(valores, dtype=np.uint64),
+            numeros_desplazamientos=np.frombuffer(desplazamientos, dtype=np.uint64),
+            estado=np.array(columnas["estado"], dtype=str),
+            copia=np.array(columnas["copia"], dtype=str),
+            desde_cache=np.frombuffer(columnas["desde_cache"], dtype=np.int8).astype(bool),
+            duplicado_de=np.array(columnas["duplicado_de"], dtype=str),
+            error=np.array(columnas["error"], dtype=str),
+            segundos=np.frombuffer(columnas["segundos"], dtype=np.float32),
+        )
+
+    def export(self, destino):
+        """
+        Exporta la tabla en el formato que indica la extensión de destino.
+
+        Args:
+            destino (str): Ruta .csv, .jsonl, .parquet o .npz
+
+        Raises:
+            ValueError: Si la extensión no es una de las admitidas
+        """
+        extension = os.path.splitext(destino)[1].lower()
+        escritores = {".csv": self.write_csv, ".jsonl": self.write_jsonl,
+                      ".parquet": self.write_parquet, ".npz": self.write_npz}
+        if extension not in escritores:
+            raise ValueError(f"Formato de exportación no admitido: {extension or destino} "
+                             f"(se admiten {', '.join(escritores)})")
+        escritores[extension](destino)
+
+
+class ResultsView:
+    """
+    Orden y filtro por dorsal sobre una ResultsStore, para las tablas de las interfaces.
+
+    Guarda solo las posiciones de las filas (un array de enteros), no los valores. Sin
+    orden ni filtro no guarda nada y las filas se muestran en orden de llegada. Las
+    filas que llegan después de ordenar o filtrar se agregan al final con refresh() (si
+    cumplen el filtro) hasta que se vuelve a ordenar.
+    """
+
+    def __init__(self, store, column=None, descending=False, number=None):
+        """
+        Args:
+            store (ResultsStore): Tabla de resultados
+            column (str, opcional): Columna de COLUMNS por la que se ordena
+            descending (bool): Orden descendente
+            number (int, opcional): Mostrar solo las fotos con este número
+        """
+        self.store = store
+        self.column = None
+        self.descending = False
+        self.number = None
+        self._filas = None
+        self._vistas = len(store)
+        self.set_order(column, descending, number)
+
+    def __len__(self):
+        return self._vistas if self._filas is None else len(self._filas)
+
+    def row_at(self, posicion):
+        """Fila de la tabla que se muestra en una posición de la vista"""
+        return posicion if self._filas is None else self._filas[posicion]
+
+    def set_order(self, column=None, descending=False, number=None):
+        """Ordena por column y filtra por number; con ambos en None vuelve al orden de llegada"""
+        self.column, self.descending, self.number = column, descending, number
+        self._vistas = len(self.store)
+        if column is None and number is None:
+            self._filas = None
+            return
+        filas = range(self._vistas)
+        if number is not None:
+            filas = [fila for fila in filas if self.store.has_number(fila, number)]
+        if column is not None:
+            filas = sorted(filas, key=self.store.sort_key(column), reverse=descending)
+        self._filas = array('I', filas)
+
+    def sort(self, column, descending=False):
+        self.set_order(column, descending, self.number)
+
+    def filter(self, number):
+        self.set_order(self.column, self.descending, number)
+
+    def refresh(self):
+        """
+        Incorpora las filas que llegaron a la tabla desde la última llamada.
+
+        Returns:
+            int: Filas agregadas a la vista
+        """
+        total = len(self.store)
+        if total <= self._vistas:
+            return 0
+        antes = len(self)
+        if self._filas is not None:
+            nuevas = range(self._vistas, total)
+            if self.number is not None:
+                nuevas = [fila for fila in nuevas if self.store.has_number(fila, self.number)]
+            self._filas.extend(nuevas)
+        self._vistas = total
+        return len(self) - antes
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convierte los resultados JSONL de cli.py a otro formato")
+    parser.add_argument("resultados", help="Archivo JSONL escrito por cli.py")
+    parser.add_argument("destino", help="Archivo de salida (.csv, .jsonl, .parquet o .npz)")
+    args = parser.parse_args(argv)
+
+    tabla = ResultsStore()
+    with open(args.resultados, 'r', encoding='utf-8') as f:
+        for linea in f:
+            try:
+                resultado = json.loads(linea)
+            except json.JSONDecodeError:
+                continue
+            tabla.add(resultado.pop("archivo", resultado.get("ruta")), resultado)
+    tabla.export(args.destino)
+    print(f"{len(tabla)} resultados exportados a {args.destino}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,120 @@
+import os
+import fnmatch
+import threading
+
+# Extensiones que reconocen todas las entradas (interfaces, cli.py y la vigilancia de carpetas)
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.gif', '.tif', '.tiff')
+
+
+class ImageScanner:
+    """
+    Recorre una carpeta con os.scandir y genera las imágenes a medida que las encuentra.
+
+    Se itera con tuplas (ruta relativa, ruta completa), en orden de nombre dentro de cada
+    carpeta, de modo que el procesamiento empieza con la primera imagen en lugar de
+    esperar a listar todo el archivo del evento. Para la barra de progreso, count_in_background
+    cuenta las imágenes en otro hilo mientras tanto.
+
+    Los patrones de inclusión y exclusión usan la sintaxis de fnmatch y se comparan con la
+    ruta relativa (con / como separador); un patrón sin / se compara con el nombre. Una
+    carpeta excluida no se recorre. Los archivos y carpetas ocultos se ignoran.
+    """
+
+    def __init__(self, folder, recursive=True, include=None, exclude=None, extensions=IMAGE_EXTENSIONS):
+        """
+        Args:
+            folder (str): Carpeta a recorrer
+            recursive (bool): Incluir las subcarpetas
+            include (list, opcional): Patrones que deben cumplir las imágenes, por ejemplo "*_raw/*"
+            exclude (list, opcional): Patrones de imágenes o carpetas que se omiten
+            extensions (tuple): Extensiones de las imágenes, en minúsculas
+        """
+        self.folder = os.path.abspath(folder)
+        self.recursive = recursive
+        self.include = list(include or [])
+        self.exclude = list(exclude or [])
+        self.extensions = tuple(extensions)
+        # Conteo en segundo plano: imágenes contadas hasta ahora y total cuando termina
+        self.counted = 0
+        self.total = None
+        self._contador = None
+
+    @staticmethod
+    def _cumple(relativa, patrones):
+        nombre = relativa.rsplit('/', 1)[-1]
+        return any(fnmatch.fnmatch(relativa if '/' in patron else nombre, patron) for patron in patrones)
+
+    def skip_dir(self, relativa):
+        """Indica si una carpeta (ruta relativa con /) no debe recorrerse"""
+        nombre = relativa.rsplit('/', 1)[-1]
+        return nombre.startswith('.') or self._cumple(relativa, self.exclude)
+
+    def matches(self, relativa):
+        """Indica si un archivo (ruta relativa con /) es una imagen a procesar"""
+        nombre = relativa.rsplit('/', 1)[-1]
+        if nombre.startswith('.') or not nombre.lower().endswith(self.extensions):
+            return False
+        if self.include and not self._cumple(relativa, self.include):
+            return False
+        return not self._cumple(relativa, self.exclude)
+
+    def _recorrer(self):
+        """Genera (ruta relativa con /, ruta completa) de cada imagen, en profundidad"""
+        pendientes = [("", self.folder)]
+        while pendientes:
+            prefijo, carpeta = pendientes.pop()
+            try:
+                with os.scandir(carpeta) as it:
+                    entradas = sorted(it, key=lambda e: e.name)
+            except OSError as e:
+                print(f"No se pudo leer la carpeta {carpeta}: {str(e)}")
+                continue
+            subcarpetas = []
+            filtrar = self.include or self.exclude
+            for entrada in entradas:
+                nombre = entrada.name
+                if nombre.startswith('.'):
+                    continue
+                try:
+                    es_carpeta = entrada.is_dir(follow_symlinks=False)
+                except OSError:
+                    continue
+                if es_carpeta:
+                    if self.recursive and not self.skip_dir(prefijo + nombre):
+                        subcarpetas.append((prefijo + nombre + "/", entrada.path))
+                # La extensión se comprueba antes de armar la ruta relativa, que solo hace
+                # falta para los patrones
+                elif nombre.lower().endswith(self.extensions) and (not filtrar or self.matches(prefijo + nombre)):
+                    yield prefijo + nombre, entrada.path
+            # En orden inverso para que la pila devuelva primero la primera subcarpeta
+            pendientes.extend(reversed(subcarpetas))
+
+    def __iter__(self):
+        for relativa, ruta in self._recorrer():
+            yield (relativa if os.sep == '/' else relativa.replace('/', os.sep)), ruta
+
+    def count_in_background(self):
+        """Cuenta las imágenes en otro hilo; el resultado queda en total (y el avance en counted)"""
+        if self._contador is None:
+            self._contador = threading.Thread(target=self._contar, name="contar-imagenes", daemon=True)
+            self._contador.start()
+        return self
+
+    def _contar(self):
+        for _ in self._recorrer():
+            self.counted += 1
+        self.total = self.counted
+
+    def estimated_total(self, vistas=0):
+        """
+        Total para la barra de progreso.
+
+        Args:
+            vistas (int): Imágenes ya generadas por el recorrido principal
+
+        Returns:
+            int: El total si el conteo terminó; si no, lo contado hasta ahora (nunca menos que vistas)
+        """
+        if self.total is not None:
+            return self.total
+        return max(self.counted, vistas)
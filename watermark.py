@@ -0,0 +1,151 @@
+import math
+import threading
+from collections import OrderedDict
+
+from PIL import Image, ImageDraw, ImageFont
+
+# Ángulo de rotación de la marca de agua, en grados
+ANGLE = 15
+# Las capas completas se guardan en caché solo hasta este tamaño (en píxeles)
+MAX_CACHED_LAYER_PIXELS = 4_000_000
+
+
+class WatermarkRenderer:
+    """
+    Genera la marca de agua repetitiva sin volver a dibujar el texto en cada imagen.
+
+    El texto con su borde se dibuja y se rota una sola vez por (texto, tamaño de fuente,
+    opacidad); esa estampa se replica en las posiciones de la cuadrícula rotada. La capa
+    resultante también se reutiliza para todas las imágenes del mismo tamaño, de modo que
+    marcar un lote cuesta prácticamente una composición por imagen.
+    """
+
+    def __init__(self, max_entries=8, max_layer_pixels=MAX_CACHED_LAYER_PIXELS):
+        """
+        Args:
+            max_entries (int): Estampas y capas que se conservan en caché
+            max_layer_pixels (int): Tamaño máximo de las capas que se guardan en caché
+        """
+        self.max_entries = max_entries
+        self.max_layer_pixels = max_layer_pixels
+        self._stamps = OrderedDict()
+        self._layers = OrderedDict()
+        self._fonts = {}
+        # El renderizador se comparte entre los hilos de guardado
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def font_size_for(size):
+        """Tamaño de fuente para una imagen, agrupado de a 4 px para reutilizar estampas"""
+        base_font_size = max(24, int(min(size) / 15))
+        return base_font_size - base_font_size % 4
+
+    def _font(self, font_size):
+        font = self._fonts.get(font_size)
+        if font is None:
+            try:
+                font = ImageFont.truetype("arial.ttf", font_size)
+            except Exception:
+                # Si no se puede cargar la fuente, usar la predeterminada
+                font = ImageFont.load_default()
+            self._fonts[font_size] = font
+        return font
+
+    def _render_stamp(self, text, font_size, opacity):
+        """Dibuja el texto con borde una vez y lo rota"""
+        font = self._font(font_size)
+        temp_draw = ImageDraw.Draw(Image.new('RGBA', (1, 1)))
+        bbox = temp_draw.textbbox((0, 0), text, font=font)
+        text_width = bbox[2] - bbox[0]
+        text_height = bbox[3] - bbox[1]
+
+        # Margen para el borde de 2 px alrededor del texto
+        stamp = Image.new('RGBA', (text_width + 6, text_height + 6), (0, 0, 0, 0))
+        draw = ImageDraw.Draw(stamp)
+        origin = (3 - bbox[0], 3 - bbox[1])
+
+        # Primero el borde, ligeramente más transparente
+        border_opacity = int(255 * opacity * 0.7)
+        for x_offset in [-2, 0, 2]:
+            for y_offset in [-2, 0, 2]:
+                if x_offset != 0 or y_offset != 0:
+                    draw.text(
+                        (origin[0] + x_offset, origin[1] + y_offset),
+                        text,
+                        font=font,
+                        fill=(0, 0, 0, border_opacity)
+                    )
+        # Luego el texto principal
+        draw.text(origin, text, font=font, fill=(255, 255, 255, int(255 * opacity)))
+
+        rotated = stamp.rotate(ANGLE, resample=Image.BICUBIC, expand=True)
+        # Espaciado entre marcas de agua
+        spacing = (int(text_width * 3), int(text_height * 3))
+        return rotated, spacing
+
+    def _stamp(self, text, font_size, opacity):
+        key = (text, font_size, round(opacity, 3))
+        stamp = self._stamps.get(key)
+        if stamp is None:
+            stamp = self._render_stamp(text, font_size, opacity)
+            self._stamps[key] = stamp
+            if len(self._stamps) > self.max_entries:
+                self._stamps.popitem(last=False)
+        else:
+            self._stamps.move_to_end(key)
+        return stamp
+
+    def _build_layer(self, size, text, font_size, opacity):
+        """Replica la estampa sobre la cuadrícula en tablero de ajedrez, rotada alrededor del centro"""
+        stamp, (spacing_x, spacing_y) = self._stamp(text, font_size, opacity)
+        width, height = size
+        layer = Image.new('RGBA', size, (0, 0, 0, 0))
+
+        cx, cy = width / 2, height / 2
+        cos_a = math.cos(math.radians(ANGLE))
+        sin_a = math.sin(math.radians(ANGLE))
+        # Cubrir también las esquinas que aparecen al rotar la cuadrícula
+        margin = int(math.hypot(width, height) / 2) + max(spacing_x, spacing_y)
+        half_w, half_h = stamp.width // 2, stamp.height // 2
+
+        for j in range(-margin, height + margin, spacing_y):
+            # Desplazamiento para filas impares
+            offset = ((j // spacing_y) % 2) * (spacing_x // 2)
+            for i in range(-margin, width + margin, spacing_x):
+                x = i + offset - cx
+                y = j - cy
+                # Rotación antihoraria, como Image.rotate
+                px = int(cx + x * cos_a + y * sin_a) - half_w
+                py = int(cy - x * sin_a + y * cos_a) - half_h
+                if px + stamp.width <= 0 or py + stamp.height <= 0 or px >= width or py >= height:
+                    continue
+                # alpha_composite no admite destinos negativos: recortar la estampa en el borde
+                layer.alpha_composite(stamp, dest=(max(px, 0), max(py, 0)), source=(max(-px, 0), max(-py, 0)))
+        return layer
+
+    def layer(self, size, text="COPIA", opacity=0.3):
+        """Devuelve la capa de marca de agua para una imagen del tamaño dado"""
+        font_size = self.font_size_for(size)
+        key = (size, text, font_size, round(opacity, 3))
+        with self._lock:
+            layer = self._layers.get(key)
+            if layer is not None:
+                self._layers.move_to_end(key)
+                return layer
+            layer = self._build_layer(size, text, font_size, opacity)
+            if size[0] * size[1] <= self.max_layer_pixels:
+                self._layers[key] = layer
+                if len(self._layers) > self.max_entries:
+                    self._layers.popitem(last=False)
+            return layer
+
+    def apply(self, img, text="COPIA", opacity=0.3):
+        """
+        Combina la marca de agua con la imagen.
+
+        Returns:
+            PIL.Image.Image: Imagen RGBA con la marca de agua
+        """
+        if img.mode != 'RGBA':
+            img = img.convert('RGBA')
+        return Image.alpha_composite(img, self.layer(img.size, text, opacity))